@@ -14,7 +14,7 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import accuracy_score, classification_report, mean_squared_error, r2_score
 import joblib
 
-from insightface.app import FaceAnalysis
+from .face_recognizer import get_face_engine
 from .utils import cosine_similarity, assess_image_quality, parse_datetime_string
 from .location import extract_comprehensive_metadata, get_location_details
 
@@ -212,9 +212,10 @@ class MetadataEncoder:
 class EnhancedFaceEngine:
     """Erweiterte FaceEngine mit Metadaten-Integration"""
     
-    def __init__(self, det_size=(640,640), metadata_weights=None):
-        self.app = FaceAnalysis(name='buffalo_l')
-        self.app.prepare(ctx_id=-1, det_size=det_size)
+    def __init__(self, det_size=(640,640), metadata_weights=None, ort_options=None):
+        # Geteilte Modelle aus der prozessweiten Registry statt eigener FaceAnalysis
+        self.face_engine = get_face_engine(det_size=det_size, profile='full', ort_options=ort_options)
+        self.app = self.face_engine.app
         
         # Metadaten-Gewichtungen
         self.metadata_weights = metadata_weights or {
@@ -372,8 +373,12 @@ class EnhancedFaceEngine:
     
     def predict_with_metadata(self, img_bgr: np.ndarray, metadata: Dict) -> List[Dict]:
         """Vorhersage mit Metadaten-Integration"""
-        # Basis-Gesichtserkennung
-        faces = self.app.get(img_bgr)
+        # Basis-Gesichtserkennung über die geteilte Engine (gleiche Pipeline und Lock wie analyze)
+        engine = self.face_engine
+        with engine.lock:
+            faces = engine._detect(img_bgr)
+            if faces:
+                engine._run_face_models([(img_bgr, face) for face in faces])
         enhanced_results = []
         
         # Metadaten-Features kodieren
@@ -0,0 +1,355 @@
+"""
+Enrollment: Galerien aus Ordnern oder PBF-DAMS-Zuordnungen aufbauen
+
+build_gallery_from_folder liest <gallery_dir>/<Person>/*.jpg (optional inkrementell über
+Fingerabdrücke der Quellbilder), build_gallery_from_mapping analysiert die bekannten Regionen
+einer Zuordnung direkt im Originalbild. Mit workers > 1 laufen die Chunks in Worker-Prozessen
+mit je eigenem Modell; die Gesichter werden trotzdem in fester Reihenfolge hinzugefügt.
+"""
+
+from __future__ import annotations
+import glob
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import cv2
+
+from onnxruntime.capi.onnxruntime_pybind11_state import Fail as OrtFail, RuntimeException as OrtRuntimeException
+
+from .face_recognizer import EMBEDDING_PROFILES, FaceEngine, GalleryDB
+
+logger = logging.getLogger(__name__)
+
+# Fehler, die ein einzelnes Bild betreffen (Dekodierung, OpenCV, ONNX-Inferenz); alles andere bricht ab
+IMAGE_ERRORS = (cv2.error, OrtFail, OrtRuntimeException, MemoryError)
+
+GALLERY_EXTENSIONS = (".jpg",".jpeg",".png",".bmp",".webp",".tif",".tiff")
+
+def gallery_tasks(gallery_dir: str) -> List[Tuple[str, str]]:
+    """(Person, Bildpfad) aller Bilder unter <gallery_dir>/<Person>/ in fester Reihenfolge"""
+    tasks = []
+    for person in sorted(os.listdir(gallery_dir)):
+        person_dir = os.path.join(gallery_dir, person)
+        if not os.path.isdir(person_dir):
+            continue
+        for ext in GALLERY_EXTENSIONS:
+            tasks.extend((person, p) for p in sorted(glob.glob(os.path.join(person_dir, f"*{ext}"))))
+    return tasks
+
+def source_fingerprint(path: str, content_hash: bool = False) -> Dict:
+    """Fingerabdruck eines Galeriebilds (Größe, mtime, optional SHA-1 des Inhalts)"""
+    st = os.stat(path)
+    fingerprint = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if content_hash:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        fingerprint['sha1'] = h.hexdigest()
+    return fingerprint
+
+def _same_source(old: Optional[Dict], new: Dict) -> bool:
+    if not old:
+        return False
+    if old.get('size') == new['size'] and old.get('mtime_ns') == new['mtime_ns']:
+        return True
+    # Kopiert oder nur berührt: mit Inhalts-Hash trotzdem unverändert
+    return 'sha1' in old and old['sha1'] == new.get('sha1')
+
+def plan_incremental_enrollment(db: 'GalleryDB', gallery_dir: str, tasks: List[Tuple[str, str]],
+                                content_hash: bool = False) -> Tuple[List[Tuple[str, str]], List[str]]:
+    """(neu einzulesende Bilder, zu entfernende source_image) gegenüber dem Stand in db
+
+    Unverändert ist ein Bild, wenn es bei derselben Person mit gleichem Fingerabdruck eingetragen
+    ist, als Gesicht oder als Bild ohne Gesicht (db.empty_sources). Entfernt werden geänderte,
+    verschobene und gelöschte Bilder unterhalb von gallery_dir; Gesichter aus anderen Ordnern
+    bleiben unangetastet. Verglichen wird über absolute Pfade, das Ergebnis hängt daher nicht
+    vom Arbeitsverzeichnis oder der Schreibweise von gallery_dir ab.
+    """
+    known: Dict[str, Tuple[str, Optional[Dict], str]] = {}
+    for name, items in db.face_metadata.items():
+        for m in items:
+            if m.get('source_image'):
+                known[os.path.abspath(m['source_image'])] = (name, m.get('source_fingerprint'), m['source_image'])
+    for source, entry in db.empty_sources.items():
+        known[os.path.abspath(source)] = (entry.get('person'), entry.get('source_fingerprint'), source)
+    todo, stale = [], []
+    for person, p in tasks:
+        prev = known.pop(os.path.abspath(p), None)
+        if prev is not None and prev[0] == person and _same_source(prev[1], source_fingerprint(p, content_hash)):
+            continue
+        todo.append((person, p))
+        if prev is not None:
+            stale.append(prev[2])
+    root = os.path.abspath(gallery_dir) + os.sep
+    stale.extend(source for path, (_, _, source) in known.items() if path.startswith(root))
+    return todo, stale
+
+def _enrollment_records(engine: FaceEngine, tasks: List[Tuple[str, str]], max_decode_side: Optional[int] = None,
+                        content_hash: bool = False):
+    """(Person, Embedding, Metadaten) des größten Gesichts je Bild
+
+    Bilder ohne Gesicht liefern Embedding None und nur den Fingerabdruck, unlesbare Bilder entfallen.
+    """
+    records = []
+    analyzed = engine.analyze_files([p for _, p in tasks], max_decode_side=max_decode_side)
+    for (person, p), faces in zip(tasks, analyzed):
+        if faces is None:
+            continue
+        if not faces:
+            records.append((person, None, {'source_image': p, 'source_fingerprint': source_fingerprint(p, content_hash)}))
+            continue
+        faces.sort(key=lambda f: (f['bbox'][2]-f['bbox'][0])*(f['bbox'][3]-f['bbox'][1]), reverse=True)
+
+        # Erweiterte Metadaten speichern
+        face_data = faces[0]
+        metadata = {
+            'age': face_data.get('age'),
+            'gender': face_data.get('gender'),
+            'quality_score': face_data.get('quality_score'),
+            'emotion': face_data.get('emotion'),
+            'eye_status': face_data.get('eye_status'),
+            'mouth_status': face_data.get('mouth_status'),
+            'source_image': p,
+            'source_fingerprint': source_fingerprint(p, content_hash)
+        }
+        records.append((person, face_data["embedding"], metadata))
+    return records
+
+# Engine eines Enrollment-Worker-Prozesses (einmal pro Prozess geladen)
+_WORKER_ENGINE: Optional[FaceEngine] = None
+
+def _init_enroll_worker(det_size, profile: str, ort_options: Optional[Dict], core_groups: List[List[int]], counter,
+                        engine_factory=FaceEngine):
+    """Bindet den Worker an seinen Anteil der Kerne und lädt das Modell"""
+    global _WORKER_ENGINE
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    cores = core_groups[slot % len(core_groups)] if core_groups else None
+    options = dict(ort_options or {})
+    if cores:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cores)
+        options.setdefault('intra_op_threads', len(cores))
+        options.setdefault('inter_op_threads', 1)
+    _WORKER_ENGINE = engine_factory(det_size=det_size, profile=profile, ort_options=options)
+
+def _enroll_worker_chunk(index: int, fn, chunk: List, args: Tuple):
+    return index, fn(_WORKER_ENGINE, chunk, *args)
+
+def _core_groups(workers: int) -> List[List[int]]:
+    """Verteilt die nutzbaren Kerne gleichmäßig auf workers Gruppen"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    if len(cores) < workers:
+        return []
+    size = len(cores) // workers
+    return [cores[i * size:(i + 1) * size] for i in range(workers)]
+
+def _parallel_enrollment(chunks: List[List], fn, args: Tuple, det_size, profile, ort_options, workers: int,
+                         engine_factory=FaceEngine):
+    """Ruft fn(engine, chunk, *args) in Worker-Prozessen auf; Ergebnisse in Chunk-Reihenfolge, sobald sie vorliegen"""
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    ctx = multiprocessing.get_context('spawn')
+    counter = ctx.Value('i', 0)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_enroll_worker,
+                             initargs=(det_size, profile, ort_options, _core_groups(workers), counter,
+                                       engine_factory)) as pool:
+        pending, done, next_chunk, next_emit = set(), {}, 0, 0
+        while next_emit < len(chunks):
+            # Höchstens 2 Chunks pro Worker unterwegs, damit fertige Ergebnisse nicht unbegrenzt puffern
+            while next_chunk < len(chunks) and len(pending) + len(done) < 2 * workers:
+                pending.add(pool.submit(_enroll_worker_chunk, next_chunk, fn, chunks[next_chunk], args))
+                next_chunk += 1
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, result = future.result()
+                done[index] = result
+            while next_emit in done:
+                yield done.pop(next_emit)
+                next_emit += 1
+
+def _check_embedding_profile(profile: str):
+    if profile not in EMBEDDING_PROFILES:
+        raise ValueError(f"Profil '{profile}' berechnet keine Embeddings (erlaubt: {', '.join(EMBEDDING_PROFILES)})")
+
+def build_gallery_from_folder(gallery_dir: str, det_size=(640,640), profile: str = 'detect+embed',
+                              ort_options: Optional[Dict] = None, max_decode_side: Optional[int] = None,
+                              chunk_size: int = 8, db: Optional['GalleryDB'] = None, workers: int = 1,
+                              incremental: bool = False, content_hash: bool = False,
+                              report: Optional[Dict] = None, engine_factory=FaceEngine) -> 'GalleryDB':
+    """Baut eine Galerie aus <gallery_dir>/<Person>/*.jpg; mit db werden die Gesichter dort ergänzt
+
+    workers > 1 verteilt die Bilder auf Worker-Prozesse mit je eigenem Modell und eigenem
+    Anteil der Kerne. Die Gesichter werden in derselben Reihenfolge wie mit einem Prozess
+    hinzugefügt, das Ergebnis hängt daher nicht von workers ab.
+
+    incremental liest nur neue oder geänderte Bilder ein und entfernt Gesichter gelöschter
+    Bilder (siehe plan_incremental_enrollment); content_hash speichert zusätzlich einen
+    SHA-1 des Inhalts. Bilder ohne Gesicht werden in db.empty_sources vermerkt und bei
+    unverändertem Fingerabdruck ebenfalls übersprungen. report wird mit den Zählern
+    images/embedded/skipped/removed gefüllt.
+    engine_factory(det_size=..., profile=..., ort_options=...) erzeugt das Modell je Prozess;
+    bei workers > 1 muss es picklebar sein (z. B. eine Klasse auf Modulebene).
+    """
+    _check_embedding_profile(profile)
+    db = db if db is not None else GalleryDB()
+    # source_image wird absolut gespeichert, damit spätere Läufe unabhängig vom Arbeitsverzeichnis sind
+    gallery_dir = os.path.abspath(gallery_dir)
+    tasks = gallery_tasks(gallery_dir)
+    stats = {'images': len(tasks), 'embedded': 0, 'skipped': 0, 'removed': 0}
+    if incremental:
+        todo, stale = plan_incremental_enrollment(db, gallery_dir, tasks, content_hash)
+        stats['skipped'] = len(tasks) - len(todo)
+        stats['removed'] = db.remove_sources(stale) if stale else 0
+        tasks = todo
+    if workers > 1 and len(tasks) > chunk_size:
+        chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+        batches = _parallel_enrollment(chunks, _enrollment_records, (max_decode_side, content_hash),
+                                       det_size, profile, ort_options, workers, engine_factory)
+    elif tasks:
+        engine = engine_factory(det_size=det_size, profile=profile, ort_options=ort_options)
+        batches = (_enrollment_records(engine, tasks[i:i + chunk_size], max_decode_side, content_hash)
+                   for i in range(0, len(tasks), chunk_size))
+    else:
+        batches = []
+    empty = {}
+    for records in batches:
+        for person, embedding, metadata in records:
+            if embedding is None:
+                empty[metadata['source_image']] = {'person': person, 'source_fingerprint': metadata['source_fingerprint']}
+                continue
+            db.add(person, embedding, metadata)
+            stats['embedded'] += 1
+    db.mark_empty_sources(empty)
+    if report is not None:
+        report.update(stats)
+    return db
+
+def mapping_tasks(mapping, min_region_size: int = 30, clean_names: bool = True) -> Tuple[List[Tuple[str, List]], Dict]:
+    """(Bildpfad, [(Person, Region), ...]) je Bild einer PBF-DAMS-Zuordnung plus Filterzähler"""
+    tasks = []
+    stats = {'images': 0, 'regions': 0, 'no_coords': 0, 'too_small': 0, 'missing_images': 0}
+    for item in mapping if isinstance(mapping, list) else [mapping]:
+        if not isinstance(item, dict) or not item.get('image') or not isinstance(item.get('regions'), list):
+            continue
+        regions = []
+        for region in item['regions']:
+            if not isinstance(region, dict) or not region.get('name'):
+                continue
+            name = region['name'].lstrip(':') if clean_names else region['name']
+            if None in [region.get(k) for k in ('x_abs', 'y_abs', 'width_px', 'height_px')]:
+                stats['no_coords'] += 1
+                continue
+            if region['width_px'] < min_region_size or region['height_px'] < min_region_size:
+                stats['too_small'] += 1
+                continue
+            regions.append((name, region))
+        if not regions:
+            continue
+        if not os.path.exists(item['image']):
+            stats['missing_images'] += 1
+            continue
+        tasks.append((item['image'], regions))
+        stats['images'] += 1
+        stats['regions'] += len(regions)
+    return tasks, stats
+
+def _mapping_records(engine: FaceEngine, tasks: List[Tuple[str, List]], min_iou: float = 0.3):
+    """Region-geführte Analyse je Bild; liefert ((Person, Embedding, Metadaten)-Liste, Zähler)"""
+    records = []
+    stats = {'unreadable': 0, 'unmatched': 0, 'errors': 0}
+    for image_path, regions in tasks:
+        try:
+            img = cv2.imread(image_path)
+        except IMAGE_ERRORS as exc:
+            logger.warning("Bild %s nicht lesbar: %s", image_path, exc)
+            img = None
+        if img is None:
+            stats['unreadable'] += 1
+            continue
+        h_img, w_img = img.shape[:2]
+        boxes = []
+        for _, region in regions:
+            x1 = max(0, min(int(region['x_abs']), w_img-1))
+            y1 = max(0, min(int(region['y_abs']), h_img-1))
+            x2 = max(x1+1, min(int(region['x_abs'] + region['width_px']), w_img))
+            y2 = max(y1+1, min(int(region['y_abs'] + region['height_px']), h_img))
+            boxes.append([x1, y1, x2, y2])
+        try:
+            faces = engine.analyze_regions(img, boxes, min_iou=min_iou)
+        except IMAGE_ERRORS as exc:
+            logger.warning("Analyse von %s fehlgeschlagen: %s", image_path, exc)
+            stats['errors'] += 1
+            continue
+        for (name, region), bbox, face in zip(regions, boxes, faces):
+            if face is None or face.get('embedding') is None:
+                stats['unmatched'] += 1
+                continue
+            metadata = {
+                'source_image': image_path,
+                'source': 'pbf_dams_mapping',
+                'bbox': bbox,
+                'region_type': region.get('type'),
+                'region_iou': face.get('region_iou'),
+                'quality_score': face.get('quality_score'),
+                'age': face.get('age'),
+                'gender': face.get('gender'),
+                'original_coords': {
+                    'x_rel': region.get('x_rel'),
+                    'y_rel': region.get('y_rel'),
+                    'width_rel': region.get('width_rel'),
+                    'height_rel': region.get('height_rel')
+                }
+            }
+            embedding = np.asarray(face['embedding'], dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            records.append((name, embedding / norm if norm > 0 else embedding, metadata))
+    return records, stats
+
+def build_gallery_from_mapping(mapping, det_size=(640,640), profile: str = 'detect+embed',
+                               ort_options: Optional[Dict] = None, min_region_size: int = 30,
+                               clean_names: bool = True, chunk_size: int = 8, db: Optional['GalleryDB'] = None,
+                               workers: int = 1, progress=None, report: Optional[Dict] = None,
+                               min_iou: float = 0.3, engine_factory=FaceEngine) -> 'GalleryDB':
+    """Baut eine Galerie direkt aus einer PBF-DAMS-Zuordnung (Liste oder Pfad zur JSON-Datei)
+
+    Jedes Bild wird einmal dekodiert und nur in den bekannten Regionen analysiert
+    (FaceEngine.analyze_regions, Regionen mit Überlappung unter min_iou bleiben leer),
+    ohne Umweg über ausgeschnittene JPEGs. workers und engine_factory wie bei
+    build_gallery_from_folder; progress(fertige Bilder, Bilder gesamt) wird nach jedem Chunk
+    aufgerufen, report mit den Zählern gefüllt.
+    """
+    _check_embedding_profile(profile)
+    if isinstance(mapping, str):
+        with open(mapping, 'r', encoding='utf-8') as f:
+            mapping = json.load(f)
+    db = db if db is not None else GalleryDB()
+    tasks, stats = mapping_tasks(mapping, min_region_size, clean_names)
+    stats.update({'embedded': 0, 'unreadable': 0, 'unmatched': 0, 'errors': 0})
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        batches = _parallel_enrollment(chunks, _mapping_records, (min_iou,), det_size, profile, ort_options, workers,
+                                       engine_factory)
+    elif chunks:
+        engine = engine_factory(det_size=det_size, profile=profile, ort_options=ort_options)
+        batches = (_mapping_records(engine, chunk, min_iou) for chunk in chunks)
+    else:
+        batches = []
+    done = 0
+    for chunk, (records, chunk_stats) in zip(chunks, batches):
+        for name, embedding, metadata in records:
+            db.add(name, embedding, metadata)
+        stats['embedded'] += len(records)
+        for key, value in chunk_stats.items():
+            stats[key] += value
+        done += len(chunk)
+        if progress is not None:
+            progress(done, len(tasks))
+    if report is not None:
+        report.update(stats)
+    return db
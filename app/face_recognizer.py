@@ -1,41 +1,479 @@
 
 from __future__ import annotations
-import pickle, os, glob
-from typing import Dict, List, Optional
+import pickle, os, threading, time, warnings
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import cv2
+import onnxruntime as ort
 from insightface.app import FaceAnalysis
-from .utils import cosine_similarity
+from insightface.app.common import Face
+from insightface.model_zoo.model_zoo import PickableInferenceSession
+from insightface.utils import face_align
+from .utils import box_iou
+from .image_loader import load_image
+from .gallery_index import create_index, load_index
+from .gallery_store import (BINARY_GALLERY_SUFFIX, MappedPeople, is_binary_gallery, open_embeddings,
+                            open_prototypes, open_scores, read_manifest, read_metadata, recover_binary_gallery,
+                            replace_binary_gallery, write_binary_gallery)
+from .quantization import QuantizedMatrix, check_precision
+from .gallery_journal import GalleryJournal, read_journal
+from .gallery_sqlite import SQLiteGalleryStore, SQLitePeople, is_sqlite_gallery, write_sqlite_gallery
+
+# Analyseprofile: welche insightface-Module geladen werden und ob die
+# Haar-/Qualitäts-Attributstufe läuft (None = alle Module des Modellpakets)
+ANALYSIS_PROFILES: Dict[str, Dict] = {
+    'detect': {'allowed_modules': ['detection'], 'attributes': False},
+    'detect+embed': {'allowed_modules': ['detection', 'recognition'], 'attributes': False},
+    'full': {'allowed_modules': None, 'attributes': True},
+}
+# Profile mit Recognition-Modell (für Galerien, 'detect' liefert keine Embeddings)
+EMBEDDING_PROFILES = [name for name, cfg in ANALYSIS_PROFILES.items()
+                      if cfg['allowed_modules'] is None or 'recognition' in cfg['allowed_modules']]
+
+def apply_session_options(app: FaceAnalysis, sess_options: ort.SessionOptions):
+    """Erzeugt die ONNX-Sessions aller Modelle mit sess_options neu
+
+    insightface reicht beim Laden nur providers weiter, keine SessionOptions.
+    """
+    for model in app.models.values():
+        providers = model.session.get_providers()
+        model.session = PickableInferenceSession(model.model_file, sess_options=sess_options, providers=providers)
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config.yaml')
+
+_EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+_GRAPH_OPT_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+ORT_EXECUTION_MODES = list(_EXECUTION_MODES)
+ORT_GRAPH_OPT_LEVELS = list(_GRAPH_OPT_LEVELS)
+
+def load_ort_config(path: str = DEFAULT_CONFIG_PATH) -> Dict:
+    """Liest den Abschnitt 'onnxruntime' aus config.yaml (leer, falls nicht vorhanden)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        import yaml
+    except ImportError:
+        if any(line.startswith('onnxruntime:') for line in text.splitlines()):
+            warnings.warn(f"PyYAML fehlt, der Abschnitt 'onnxruntime' in {path} wird ignoriert "
+                          "(pip install pyyaml)")
+        return {}
+    config = yaml.safe_load(text) or {}
+    section = config.get('onnxruntime') or {}
+    return {k: v for k, v in section.items() if v is not None}
+
+def build_session_options(ort_options: Dict) -> Optional[ort.SessionOptions]:
+    """Erzeugt ONNX-Runtime-SessionOptions aus einem Options-Dict
+
+    Unterstützte Schlüssel: intra_op_threads, inter_op_threads,
+    execution_mode ('sequential'/'parallel'), graph_optimization_level
+    ('disable'/'basic'/'extended'/'all'), thread_affinity (ORT-Format für
+    session.intra_op_thread_affinities, z.B. "1;2;3"; nur zusammen mit
+    intra_op_threads, ORT lehnt Affinitäten ohne feste Thread-Zahl ab).
+    Ohne Optionen None.
+    """
+    if not ort_options:
+        return None
+    if ort_options.get('thread_affinity') and ort_options.get('intra_op_threads') is None:
+        raise ValueError("thread_affinity benötigt intra_op_threads")
+    opts = ort.SessionOptions()
+    if ort_options.get('intra_op_threads') is not None:
+        opts.intra_op_num_threads = int(ort_options['intra_op_threads'])
+    if ort_options.get('inter_op_threads') is not None:
+        opts.inter_op_num_threads = int(ort_options['inter_op_threads'])
+    if ort_options.get('execution_mode') is not None:
+        opts.execution_mode = _EXECUTION_MODES[ort_options['execution_mode']]
+    if ort_options.get('graph_optimization_level') is not None:
+        opts.graph_optimization_level = _GRAPH_OPT_LEVELS[ort_options['graph_optimization_level']]
+    if ort_options.get('thread_affinity'):
+        opts.add_session_config_entry('session.intra_op_thread_affinities', str(ort_options['thread_affinity']))
+    return opts
+
+def _nms(dets: np.ndarray, thresh: float) -> List[int]:
+    """Non-Maximum-Suppression über [x1, y1, x2, y2, score], Indizes nach Score absteigend"""
+    x1, y1, x2, y2, scores = dets[:, 0], dets[:, 1], dets[:, 2], dets[:, 3], dets[:, 4]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(int(i))
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[np.where(ovr <= thresh)[0] + 1]
+    return keep
+
+def _cut_at_inner_edge(boxes: np.ndarray, x: int, y: int, width: int, height: int, tile_w: int, tile_h: int,
+                       margin: float = 2.0) -> np.ndarray:
+    """Maske der Kachel-Detections (Kachelkoordinaten), die an einer Kachelkante im Bildinneren anliegen"""
+    cut = np.zeros(len(boxes), dtype=bool)
+    if x > 0:
+        cut |= boxes[:, 0] <= margin
+    if y > 0:
+        cut |= boxes[:, 1] <= margin
+    if x + tile_w < width:
+        cut |= boxes[:, 2] >= tile_w - margin
+    if y + tile_h < height:
+        cut |= boxes[:, 3] >= tile_h - margin
+    return cut
 
 class FaceEngine:
-    def __init__(self, det_size=(640,640)):
-        self.app = FaceAnalysis(name='buffalo_l')
+    def __init__(self, det_size=(640,640), batch_size: int = 64, profile: str = 'full', model_name: str = 'buffalo_l',
+                 ort_options: Optional[Dict] = None, max_detect_side: Optional[int] = None,
+                 tile_size: Optional[int] = None, tile_overlap: float = 0.2):
+        if profile not in ANALYSIS_PROFILES:
+            raise ValueError(f"Unbekanntes Analyseprofil: {profile} (erlaubt: {', '.join(ANALYSIS_PROFILES)})")
+        self.profile = profile
+        self.extract_attributes = ANALYSIS_PROFILES[profile]['attributes']
+        self.app = FaceAnalysis(name=model_name, allowed_modules=ANALYSIS_PROFILES[profile]['allowed_modules'])
+        # Explizite Optionen überschreiben den Abschnitt 'onnxruntime' aus config.yaml
+        self.ort_options = {**load_ort_config(), **(ort_options or {})}
+        sess_options = build_session_options(self.ort_options)
+        if sess_options is not None:
+            apply_session_options(self.app, sess_options)
         self.app.prepare(ctx_id=-1, det_size=det_size)
+        # Engines werden über get_face_engine prozessweit geteilt; die
+        # Haar-Cascades sind nicht für parallele Aufrufe ausgelegt
+        self.lock = threading.RLock()
+        # Maximale Anzahl Gesichter pro ONNX-Aufruf (Recognition/Gender-Age)
+        self.batch_size = batch_size
+        # Große Bilder: Detection auf verkleinerter Kopie (längste Seite <= max_detect_side)
+        # und optional in überlappenden Kacheln der Kantenlänge tile_size
+        self.max_detect_side = max_detect_side
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        # Haar-Cascades werden einmal pro Engine geladen (siehe _get_cascades)
+        self._cascades: Optional[Dict[str, cv2.CascadeClassifier]] = None
+
+    def analyze(self, img_bgr, **filters):
+        return self.analyze_batch([img_bgr], **filters)[0]
+
+    def analyze_batch(self, images: List[np.ndarray], min_det_score: float = 0.0,
+                      min_face_area: int = 0, min_quality: Optional[float] = None) -> List[List[Dict]]:
+        """Analysiert mehrere Bilder: Detection pro Bild, Recognition und Gender/Age gebündelt über alle Gesichter
+
+        Gesichter unter min_det_score, min_face_area (Box-Fläche in Pixel) oder
+        min_quality werden direkt nach der Detection verworfen und nicht eingebettet.
+        """
+        with self.lock:
+            return self._analyze_batch(images, min_det_score, min_face_area, min_quality)
+
+    def _analyze_batch(self, images, min_det_score, min_face_area, min_quality) -> List[List[Dict]]:
+        detected = []
+        for img in images:
+            faces = self._detect(img)
+            if min_det_score > 0 or min_face_area > 0 or min_quality is not None:
+                faces = [f for f in faces if self._passes_prefilter(img, f, min_det_score, min_face_area, min_quality)]
+            detected.append(faces)
+        items = [(img, face) for img, faces in zip(images, detected) for face in faces]
+        if items:
+            self._run_face_models(items)
 
-    def analyze(self, img_bgr):
-        faces = self.app.get(img_bgr)
         results = []
-        for f in faces:
-            box = f.bbox.astype(int).tolist()
-            prob = float(getattr(f, "det_score", 1.0))
-            gender = getattr(f, "gender", None)
-            gender_str = "male" if gender == 0 else ("female" if gender == 1 else None)
-            age = int(getattr(f, "age", -1)) if getattr(f, "age", None) is not None else None
-            emb = f.embedding.astype(np.float32)
-            
-            # Erweiterte Attribute
-            face_attributes = self._extract_face_attributes(f, img_bgr, box)
-            
-            results.append({
-                "bbox": box,
-                "prob": prob,
-                "embedding": emb,
-                "age": age if age and age >= 0 else None,
-                "gender": gender_str,
-                **face_attributes
-            })
+        for img, faces in zip(images, detected):
+            results.append([self._face_to_result(f, img) for f in faces])
+        return results
+
+    def analyze_files(self, paths: List[str], max_decode_side: Optional[int] = None,
+                      min_det_score: float = 0.0, min_face_area: int = 0,
+                      min_quality: Optional[float] = None) -> List[Optional[List[Dict]]]:
+        """Analysiert Bilddateien mit reduzierter JPEG-Dekodierung für die Detection
+
+        Die Detection läuft auf einer Kopie mit längster Seite >= max_decode_side.
+        Ausrichtung, Embedding, Attribute und Qualität werden immer aus der vollen
+        Auflösung berechnet (nur für Bilder mit Gesichtern nachgeladen), das Ergebnis
+        hängt daher nicht von max_decode_side ab. Boxen und Landmarks beziehen sich
+        auf das Originalbild; für nicht lesbare Dateien steht None.
+        """
+        with self.lock:
+            work = []
+            for path in paths:
+                loaded = load_image(path, max_side=max_decode_side)
+                if loaded is None:
+                    work.append(None)
+                    continue
+                img, scale = loaded.image, loaded.scale
+                faces = self._detect(img)
+                if faces and scale != 1.0:
+                    full = loaded.full()
+                    if full is None:
+                        work.append(None)
+                        continue
+                    for f in faces:
+                        f.bbox = f.bbox / scale
+                        if f.kps is not None:
+                            f.kps = f.kps / scale
+                    img = full
+                if min_det_score > 0 or min_face_area > 0 or min_quality is not None:
+                    faces = [f for f in faces if self._passes_prefilter(img, f, min_det_score, min_face_area, min_quality)]
+                work.append((img, faces))
+
+            items = []
+            for entry in work:
+                if entry is not None:
+                    img, faces = entry
+                    items.extend((img, f) for f in faces)
+            if items:
+                self._run_face_models(items)
+
+            return [None if entry is None else [self._face_to_result(f, entry[0]) for f in entry[1]]
+                    for entry in work]
+
+    def analyze_regions(self, img_bgr, boxes, padding: float = 0.5, region_det_size: int = 256,
+                        min_iou: float = 0.3) -> List[Optional[Dict]]:
+        """Analysiert nur bekannte Gesichtsregionen (z.B. PBF-DAMS-Boxen)
+
+        Für jede Box [x1, y1, x2, y2] wird in einem gepolsterten Ausschnitt mit
+        kleiner Detector-Größe gesucht; das Gesicht mit der besten Überlappung
+        wird im Originalbild ausgerichtet und eingebettet. Liegt die beste
+        Überlappung unter min_iou (z.B. nur ein Nachbargesicht im Ausschnitt),
+        gilt die Region als ohne Gesicht. Liefert pro Box ein Ergebnis-Dict
+        (wie analyze, plus 'region_iou') oder None.
+        """
+        with self.lock:
+            return self._analyze_regions(img_bgr, boxes, padding, region_det_size, min_iou)
+
+    def _analyze_regions(self, img_bgr, boxes, padding, region_det_size, min_iou) -> List[Optional[Dict]]:
+        h, w = img_bgr.shape[:2]
+        chosen: List[Optional[Face]] = []
+        for box in boxes:
+            bx1, by1, bx2, by2 = [float(v) for v in box]
+            pad_x, pad_y = (bx2 - bx1) * padding, (by2 - by1) * padding
+            cx1, cy1 = max(0, int(bx1 - pad_x)), max(0, int(by1 - pad_y))
+            cx2, cy2 = min(w, int(bx2 + pad_x)), min(h, int(by2 + pad_y))
+            if cx2 - cx1 < 2 or cy2 - cy1 < 2:
+                chosen.append(None)
+                continue
+            faces = self._detect(img_bgr[cy1:cy2, cx1:cx2], input_size=(region_det_size, region_det_size))
+            best, best_iou = None, 0.0
+            for face in faces:
+                # Zurück in Koordinaten des Originalbilds
+                face.bbox = face.bbox + np.array([cx1, cy1, cx1, cy1], dtype=face.bbox.dtype)
+                if face.kps is not None:
+                    face.kps = face.kps + np.array([cx1, cy1], dtype=face.kps.dtype)
+                iou = box_iou(face.bbox, [bx1, by1, bx2, by2])
+                if best is None or iou > best_iou:
+                    best, best_iou = face, iou
+            if best is not None and best_iou < min_iou:
+                best = None
+            if best is not None:
+                best['region_iou'] = best_iou
+            chosen.append(best)
+
+        items = [(img_bgr, face) for face in chosen if face is not None]
+        if items:
+            self._run_face_models(items)
+
+        results: List[Optional[Dict]] = []
+        for face in chosen:
+            if face is None:
+                results.append(None)
+                continue
+            result = self._face_to_result(face, img_bgr)
+            result['region_iou'] = float(face['region_iou'])
+            results.append(result)
         return results
+
+    def _detect(self, img_bgr, input_size=None) -> List[Face]:
+        """Führt nur den Detektor aus und erzeugt Face-Objekte (wie FaceAnalysis.get)
+
+        Boxen und Landmarks liegen immer in Koordinaten von img_bgr, auch wenn
+        auf einer verkleinerten Kopie oder in Kacheln detektiert wurde.
+        """
+        h, w = img_bgr.shape[:2]
+        scale = 1.0
+        det_img = img_bgr
+        if self.max_detect_side and max(h, w) > self.max_detect_side:
+            scale = self.max_detect_side / max(h, w)
+            det_img = cv2.resize(img_bgr, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                                 interpolation=cv2.INTER_AREA)
+
+        if self.tile_size and max(det_img.shape[:2]) > self.tile_size:
+            bboxes, kpss = self._detect_tiled(det_img, input_size)
+        else:
+            bboxes, kpss = self.app.det_model.detect(det_img, input_size=input_size, max_num=0, metric='default')
+
+        if scale != 1.0:
+            bboxes = bboxes.copy()
+            bboxes[:, 0:4] /= scale
+            if kpss is not None:
+                kpss = kpss / scale
+
+        faces = []
+        for i in range(bboxes.shape[0]):
+            kps = kpss[i] if kpss is not None else None
+            faces.append(Face(bbox=bboxes[i, 0:4], kps=kps, det_score=bboxes[i, 4]))
+        return faces
+
+    def _detect_tiled(self, det_img, input_size=None):
+        """Detection auf dem Gesamtbild plus überlappenden Kacheln, zusammengeführt per NMS
+
+        Gesichter, die kleiner als die Überlappung (tile_size * tile_overlap) sind, liegen immer
+        vollständig in mindestens einer Kachel.
+        """
+        det_model = self.app.det_model
+        th, tw = det_img.shape[:2]
+        tile = int(self.tile_size)
+        step = max(1, int(tile * (1.0 - self.tile_overlap)))
+
+        def starts(n):
+            if n <= tile:
+                return [0]
+            pos = list(range(0, n - tile + 1, step))
+            if pos[-1] != n - tile:
+                pos.append(n - tile)
+            return pos
+
+        # Globaler Durchlauf findet Gesichter, die größer als eine Kachel sind
+        bboxes, kpss = det_model.detect(det_img, input_size=input_size, max_num=0, metric='default')
+        all_boxes, all_kps = [bboxes], [kpss]
+        for y in starts(th):
+            for x in starts(tw):
+                crop = det_img[y:y + tile, x:x + tile]
+                b, k = det_model.detect(crop, input_size=input_size, max_num=0, metric='default')
+                # Von einer inneren Kachelkante abgeschnittene Gesichter liefern nur Teilboxen, deren IoU
+                # mit der vollen Box unter nms_thresh liegt; sie stecken ganz in der Nachbarkachel
+                # (Überlappung) oder werden vom globalen Durchlauf gefunden
+                keep = ~_cut_at_inner_edge(b, x, y, tw, th, crop.shape[1], crop.shape[0])
+                if not keep.any():
+                    continue
+                b = b[keep].copy()
+                k = k[keep] if k is not None else None
+                b[:, 0:4] += np.array([x, y, x, y], dtype=b.dtype)
+                all_boxes.append(b)
+                all_kps.append(k + np.array([x, y], dtype=k.dtype) if k is not None else None)
+
+        bboxes = np.concatenate(all_boxes, axis=0)
+        kpss = None if any(k is None for k in all_kps) else np.concatenate(all_kps, axis=0)
+        keep = _nms(bboxes, det_model.nms_thresh)
+        return bboxes[keep], (kpss[keep] if kpss is not None else None)
+
+    def _passes_prefilter(self, img_bgr, face, min_det_score, min_face_area, min_quality) -> bool:
+        """Günstige Filter vor Recognition: Detection-Score, Box-Fläche, Landmark-Qualität"""
+        if float(face.det_score) < min_det_score:
+            return False
+        x1, y1, x2, y2 = face.bbox.astype(int).tolist()
+        if (x2 - x1) * (y2 - y1) < min_face_area:
+            return False
+        if min_quality is not None:
+            quality = 0.5
+            if face.kps is not None:
+                quality = self._assess_face_quality(img_bgr, [x1, y1, x2, y2], face.kps.astype(np.int32))
+                # Wiederverwendung in _extract_face_attributes
+                face['quality_score'] = quality
+            if quality < min_quality:
+                return False
+        return True
+
+    def _run_face_models(self, items):
+        """Führt alle Nicht-Detektor-Modelle für (Bild, Gesicht)-Paare aus"""
+        for taskname, model in self.app.models.items():
+            if taskname == 'detection':
+                continue
+            if taskname == 'recognition':
+                self._embed_batched(model, items)
+            elif taskname == 'genderage':
+                self._genderage_batched(model, items)
+            else:
+                # Landmark-Modelle weiterhin pro Gesicht
+                for img, face in items:
+                    model.get(img, face)
+
+    def _chunks(self, model, items):
+        """Teilt items in Batches; Modelle mit fester Batch-Größe 1 bekommen Einzelaufrufe"""
+        fixed = model.input_shape[0] if isinstance(model.input_shape[0], int) else None
+        size = fixed or max(1, self.batch_size)
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    def _embed_batched(self, rec_model, items):
+        """ArcFace-Embeddings für alle ausgerichteten Gesichtscrops in einem Aufruf pro Batch"""
+        for chunk in self._chunks(rec_model, items):
+            aimgs = [face_align.norm_crop(img, landmark=face.kps, image_size=rec_model.input_size[0])
+                     for img, face in chunk]
+            feats = rec_model.get_feat(aimgs)
+            for (_, face), feat in zip(chunk, feats):
+                face.embedding = feat.flatten()
+
+    def _genderage_batched(self, ga_model, items):
+        """Gender/Age-Kopf gebündelt (gleiche Vorverarbeitung wie insightface Attribute.get)"""
+        input_size = tuple(ga_model.input_size)
+        for chunk in self._chunks(ga_model, items):
+            aimgs = []
+            for img, face in chunk:
+                bbox = face.bbox
+                w, h = (bbox[2] - bbox[0]), (bbox[3] - bbox[1])
+                center = (bbox[2] + bbox[0]) / 2, (bbox[3] + bbox[1]) / 2
+                scale = ga_model.input_size[0] / (max(w, h) * 1.5)
+                aimg, _ = face_align.transform(img, center, ga_model.input_size[0], scale, 0)
+                aimgs.append(aimg)
+            blob = cv2.dnn.blobFromImages(aimgs, 1.0 / ga_model.input_std, input_size,
+                                          (ga_model.input_mean,) * 3, swapRB=True)
+            preds = ga_model.session.run(ga_model.output_names, {ga_model.input_name: blob})[0]
+            for (_, face), pred in zip(chunk, preds):
+                face['gender'] = int(np.argmax(pred[:2]))
+                face['age'] = int(np.round(pred[2] * 100))
+
+    def _face_to_result(self, f, img_bgr) -> Dict:
+        box = f.bbox.astype(int).tolist()
+        prob = float(getattr(f, "det_score", 1.0))
+        gender = getattr(f, "gender", None)
+        gender_str = "male" if gender == 0 else ("female" if gender == 1 else None)
+        age = int(getattr(f, "age", -1)) if getattr(f, "age", None) is not None else None
+        emb = f.embedding.astype(np.float32) if f.embedding is not None else None
+        
+        # Erweiterte Attribute (nur im Profil 'full')
+        face_attributes = self._extract_face_attributes(f, img_bgr, box) if self.extract_attributes else {}
+        if 'quality_score' not in face_attributes and emb is not None and f.kps is not None:
+            # Auch 'detect+embed' speichert die Landmark-Qualität, damit Galerien danach filtern können
+            face_attributes['quality_score'] = f.get('quality_score')
+            if face_attributes['quality_score'] is None:
+                face_attributes['quality_score'] = self._assess_face_quality(img_bgr, box, f.kps.astype(np.int32))
+        
+        return {
+            "bbox": box,
+            "prob": prob,
+            "embedding": emb,
+            "age": age if age and age >= 0 else None,
+            "gender": gender_str,
+            **face_attributes
+        }
     
+    def _get_cascades(self) -> Dict[str, cv2.CascadeClassifier]:
+        """Lädt die Haar-Cascades beim ersten Gebrauch und hält sie für die Engine vor"""
+        if self._cascades is None:
+            self._cascades = {
+                'eye': cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml'),
+                'eye_glasses': cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye_tree_eyeglasses.xml'),
+                'smile': cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml'),
+            }
+        return self._cascades
+
+    def _detect_face_parts(self, gray_face) -> Optional[Dict[str, int]]:
+        """Cascade-Erkennungen einmal pro Gesicht, geteilt von Emotion, Augen und Mund"""
+        try:
+            cascades = self._get_cascades()
+            return {
+                'eyes': len(cascades['eye'].detectMultiScale(gray_face, 1.1, 3)),
+                'eyes_glasses': len(cascades['eye_glasses'].detectMultiScale(gray_face, 1.1, 3)),
+                'mouths': len(cascades['smile'].detectMultiScale(gray_face, 1.1, 3)),
+            }
+        except Exception:
+            return None
+
     def _extract_face_attributes(self, face, img_bgr, bbox):
         """Extrahiert erweiterte Gesichtsattribute"""
         attributes = {}
@@ -48,40 +486,55 @@ class FaceEngine:
                 'roll': float(getattr(face.pose, 'roll', 0))
             }
         
+        # Gesichts-ROI und Graustufenbild nur einmal berechnen
+        x1, y1, x2, y2 = bbox
+        face_roi = img_bgr[y1:y2, x1:x2]
+        gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY) if face_roi.size > 0 else None
+        
         # Landmarks für Qualitätsbewertung
         if hasattr(face, 'kps') and face.kps is not None:
             landmarks = face.kps.astype(np.int32)
             attributes['landmarks'] = landmarks.tolist()
             
-            # Qualitätsbewertung basierend auf Landmarks
-            quality_score = self._assess_face_quality(img_bgr, bbox, landmarks)
+            # Qualitätsbewertung basierend auf Landmarks (ggf. schon beim Vorfilter berechnet)
+            quality_score = face.get('quality_score')
+            if quality_score is None:
+                quality_score = self._assess_face_quality(img_bgr, bbox, landmarks, gray)
             attributes['quality_score'] = quality_score
         
+        if gray is None:
+            return attributes
+        
+        parts = self._detect_face_parts(gray)
+        if parts is None:
+            return attributes
+        
         # Emotion-Schätzung (einfache Implementierung)
-        emotion = self._estimate_emotion(img_bgr, bbox)
+        emotion = self._estimate_emotion(parts)
         if emotion:
             attributes['emotion'] = emotion
         
         # Augen-Status
-        eye_status = self._detect_eye_status(img_bgr, bbox)
+        eye_status = self._detect_eye_status(gray, parts)
         if eye_status:
             attributes['eye_status'] = eye_status
         
         # Mund-Status
-        mouth_status = self._detect_mouth_status(img_bgr, bbox)
+        mouth_status = self._detect_mouth_status(gray, parts)
         if mouth_status:
             attributes['mouth_status'] = mouth_status
         
         return attributes
     
-    def _assess_face_quality(self, img_bgr, bbox, landmarks):
+    def _assess_face_quality(self, img_bgr, bbox, landmarks, gray=None):
         """Bewertet die Qualität des Gesichts mit erweiterten Metriken"""
         try:
             x1, y1, x2, y2 = bbox
-            face_roi = img_bgr[y1:y2, x1:x2]
-            
-            if face_roi.size == 0:
-                return 0.0
+            if gray is None:
+                face_roi = img_bgr[y1:y2, x1:x2]
+                if face_roi.size == 0:
+                    return 0.0
+                gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
             
             # Größe des Gesichts
             face_area = (x2 - x1) * (y2 - y1)
@@ -89,7 +542,6 @@ class FaceEngine:
             size_score = min(face_area / img_area * 100, 1.0)
             
             # Schärfe (Laplacian Variance) - verbessert
-            gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
             laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
             sharpness_score = min(laplacian_var / 800, 1.0)  # Angepasst für bessere Erkennung
             
@@ -184,58 +636,21 @@ class FaceEngine:
         except Exception:
             return 0.5
     
-    def _estimate_emotion(self, img_bgr, bbox):
-        """Einfache Emotionsschätzung basierend auf Gesichtsgeometrie"""
-        try:
-            x1, y1, x2, y2 = bbox
-            face_roi = img_bgr[y1:y2, x1:x2]
-            
-            if face_roi.size == 0:
-                return None
-            
-            # Graustufen-Konvertierung
-            gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-            
-            # Haar Cascade für Augen
-            eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-            eyes = eye_cascade.detectMultiScale(gray, 1.1, 3)
-            
-            # Haar Cascade für Mund
-            mouth_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml')
-            mouths = mouth_cascade.detectMultiScale(gray, 1.1, 3)
-            
-            # Einfache Emotionslogik
-            if len(eyes) >= 2 and len(mouths) > 0:
-                return "happy"
-            elif len(eyes) >= 2:
-                return "neutral"
-            else:
-                return "unknown"
-                
-        except Exception:
-            return None
+    def _estimate_emotion(self, parts):
+        """Einfache Emotionsschätzung basierend auf Augen-/Mund-Erkennungen"""
+        # Einfache Emotionslogik
+        if parts['eyes'] >= 2 and parts['mouths'] > 0:
+            return "happy"
+        elif parts['eyes'] >= 2:
+            return "neutral"
+        else:
+            return "unknown"
     
-    def _detect_eye_status(self, img_bgr, bbox):
+    def _detect_eye_status(self, gray, parts):
         """Verbesserte Augen-Status-Erkennung (offen/geschlossen)"""
         try:
-            x1, y1, x2, y2 = bbox
-            face_roi = img_bgr[y1:y2, x1:x2]
-            
-            if face_roi.size == 0:
-                return None
-            
-            gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-            
-            # Mehrere Erkennungsmethoden kombinieren
-            eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-            eye_glasses_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye_tree_eyeglasses.xml')
-            
-            # Standard-Augen-Erkennung
-            eyes = eye_cascade.detectMultiScale(gray, 1.1, 3)
-            eyes_glasses = eye_glasses_cascade.detectMultiScale(gray, 1.1, 3)
-            
-            # Kombiniere Ergebnisse
-            total_eyes = len(eyes) + len(eyes_glasses)
+            # Kombiniere Standard- und Brillen-Cascade
+            total_eyes = parts['eyes'] + parts['eyes_glasses']
             
             # Erweiterte Analyse basierend auf Augenregion
             eye_region_analysis = self._analyze_eye_region(gray)
@@ -290,26 +705,14 @@ class FaceEngine:
         except Exception:
             return "unknown"
     
-    def _detect_mouth_status(self, img_bgr, bbox):
+    def _detect_mouth_status(self, gray, parts):
         """Verbesserte Mund-Status-Erkennung (offen/geschlossen)"""
         try:
-            x1, y1, x2, y2 = bbox
-            face_roi = img_bgr[y1:y2, x1:x2]
-            
-            if face_roi.size == 0:
-                return None
-            
-            gray = cv2.cvtColor(face_roi, cv2.COLOR_BGR2GRAY)
-            
-            # Mehrere Erkennungsmethoden
-            mouth_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml')
-            mouths = mouth_cascade.detectMultiScale(gray, 1.1, 3)
-            
             # Mundregion-Analyse
             mouth_region_analysis = self._analyze_mouth_region(gray)
             
             # Kombiniere Ergebnisse
-            if len(mouths) > 0:
+            if parts['mouths'] > 0:
                 # Mund erkannt - prüfe ob wirklich offen
                 if mouth_region_analysis == "open":
                     return "open"
@@ -362,84 +765,698 @@ class FaceEngine:
         except Exception:
             return "unknown"
 
+_ENGINE_REGISTRY: Dict[Tuple, FaceEngine] = {}
+_ENGINE_REGISTRY_LOCK = threading.Lock()
+
+def get_face_engine(det_size=(640,640), profile: str = 'full', model_name: str = 'buffalo_l',
+                    ort_options: Optional[Dict] = None, **engine_options) -> FaceEngine:
+    """Liefert eine prozessweit geteilte FaceEngine für (Modell, det_size, Profil)
+
+    Alle Streamlit-Sessions und Seiten eines Prozesses teilen sich dieselben
+    ONNX-Sessions, statt die Modelle pro Session neu zu laden. Abweichende
+    ort_options oder weitere Engine-Optionen ergeben eine eigene Engine.
+    """
+    key = (model_name, tuple(int(v) for v in det_size), profile,
+           tuple(sorted((ort_options or {}).items())), tuple(sorted(engine_options.items())))
+    with _ENGINE_REGISTRY_LOCK:
+        engine = _ENGINE_REGISTRY.get(key)
+        if engine is None:
+            engine = FaceEngine(det_size=key[1], profile=profile, model_name=model_name, ort_options=ort_options,
+                                **engine_options)
+            _ENGINE_REGISTRY[key] = engine
+        return engine
+
+def select_representatives(embeddings: List[np.ndarray], threshold: float = 0.98,
+                           max_keep: Optional[int] = None) -> List[int]:
+    """Indizes der zu behaltenden Embeddings einer Person
+
+    Embeddings mit Cosine >= threshold zu einem bereits behaltenen fallen weg; mit max_keep
+    werden per k-Center (farthest-first, Start beim Prototyp-nächsten) höchstens max_keep
+    verschiedene Vertreter gewählt. Null-Vektoren (reine Metadaten-Einträge) bleiben immer erhalten.
+    """
+    if len(embeddings) == 0:
+        return []
+    m = np.stack([np.asarray(e, dtype=np.float32).ravel() for e in embeddings])
+    norms = np.linalg.norm(m, axis=1)
+    m /= norms[:, None] + 1e-8
+    zero = [i for i in range(len(m)) if norms[i] == 0]
+    kept: List[int] = []
+    for i in range(len(m)):
+        if norms[i] == 0:
+            continue
+        if not kept or float(np.max(m[kept] @ m[i])) < threshold:
+            kept.append(i)
+    if max_keep is not None and len(kept) > max_keep:
+        cand = m[kept]
+        first = int(np.argmax(cand @ cand.mean(axis=0)))
+        chosen = [first]
+        min_dist = 1.0 - cand @ cand[first]
+        min_dist[first] = -1.0
+        while len(chosen) < max_keep:
+            nxt = int(np.argmax(min_dist))
+            # Alle übrigen sind Kopien bereits gewählter Vertreter (z. B. bei threshold >= 1)
+            if min_dist[nxt] <= 1e-6:
+                break
+            chosen.append(nxt)
+            min_dist = np.minimum(min_dist, 1.0 - cand @ cand[nxt])
+            min_dist[nxt] = -1.0
+        kept = [kept[i] for i in sorted(chosen)]
+    return sorted(kept + zero)
+
+def _snapshot_identity(path: str) -> Tuple[int, int]:
+    """(Inode, mtime) des Snapshots; ändert sich, wenn compact() ihn ersetzt"""
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns
+
 class GalleryDB:
-    def __init__(self):
-        self.people: Dict[str, List[np.ndarray]] = {}
-        self.face_metadata: Dict[str, List[Dict]] = {}  # Erweiterte Metadaten
+    def __init__(self, precision: str = 'float32'):
+        # Präzision der gespeicherten Embeddings (Binärformat) und des Scorings: float32, float16, int8
+        self.precision = check_precision(precision)
+        self._people: Dict[str, List[np.ndarray]] = {}
+        self._metadata: Optional[Dict[str, List[Dict]]] = {}  # Erweiterte Metadaten
+        self._metadata_path: Optional[str] = None  # Binärgalerie, aus der _metadata nachgeladen wird
+        # Eingelesene Quellbilder ohne Gesicht: source_image -> {'person', 'source_fingerprint'}
+        self.empty_sources: Dict[str, Dict] = {}
+        self._mapped_path: Optional[str] = None  # Binärgalerie, deren Dateien per memmap geöffnet sind
+        self._ann_params: Optional[Dict] = None  # gesetzt = ANN-Index für match_many verwenden
+        self.revision = 0  # zählt Änderungen, z. B. um serialisierte Kopien zu cachen
+        self._journal_seq = 0  # höchste enthaltene Journal-Sequenznummer
+        self._journal: Optional[GalleryJournal] = None
+        self._compact_every: Optional[int] = None
+        self._compaction: Optional[threading.Thread] = None
+        self._compaction_error: Optional[BaseException] = None
+        self._sqlite: Optional[SQLiteGalleryStore] = None  # gesetzt = add() schreibt direkt in die Datenbank
+        self._sqlite_dirty = set()  # Personen, deren Entfernungen erst save() in die Datenbank schreibt
+        self._reset_prototypes()
+
+    @property
+    def people(self) -> Dict[str, List[np.ndarray]]:
+        return self._people
+
+    @people.setter
+    def people(self, value: Dict[str, List[np.ndarray]]):
+        self._people = value
+        self.revision += 1
+        # Ersetzter Inhalt gehört nicht mehr zur Datenbank; speichern mit save()
+        self._sqlite = None
+        self._sqlite_dirty = set()
+        self._reset_prototypes()
+
+    @property
+    def face_metadata(self) -> Dict[str, List[Dict]]:
+        if self._metadata is None:
+            self._metadata = read_metadata(self._metadata_path) if self._metadata_path else {}
+        return self._metadata
+
+    @face_metadata.setter
+    def face_metadata(self, value: Dict[str, List[Dict]]):
+        self._metadata = value
+        self._metadata_path = None
+        self.revision += 1
+
+    def _plain_people(self) -> Dict[str, List[np.ndarray]]:
+        """people als einfaches dict (memory-mapped Zeilen werden kopiert)"""
+        if not isinstance(self._people, dict):
+            return {name: [np.array(e) for e in embs] for name, embs in self._people.items()}
+        return self._people
+
+    def _plain_metadata(self) -> Dict[str, List[Dict]]:
+        metadata = self.face_metadata
+        if not isinstance(metadata, dict):
+            return {name: list(items) for name, items in metadata.items()}
+        return metadata
+
+    def __getstate__(self):
+        return {'_people': self._plain_people(), 'face_metadata': self._plain_metadata(), '_ann_params': self._ann_params,
+                'precision': self.precision, '_journal_seq': self._journal_seq, 'empty_sources': self.empty_sources}
+
+    def __setstate__(self, state):
+        # Ältere Pickles speichern 'people' direkt im __dict__
+        if 'people' in state:
+            state['_people'] = state.pop('people')
+        state['_metadata'] = state.pop('face_metadata', {})
+        state['_metadata_path'] = None
+        state['_mapped_path'] = None
+        state.setdefault('_ann_params', None)
+        state.setdefault('precision', 'float32')
+        state.setdefault('_journal_seq', 0)
+        state.setdefault('empty_sources', {})
+        state.setdefault('revision', 0)
+        state.update(_journal=None, _compact_every=None, _compaction=None, _compaction_error=None, _sqlite=None,
+                     _sqlite_dirty=set())
+        self.__dict__.update(state)
+        self._reset_prototypes()
 
     def add(self, name: str, embedding: np.ndarray, metadata: Optional[Dict] = None):
-        self.people.setdefault(name, []).append(embedding.astype(np.float32))
+        emb = embedding.astype(np.float32)
+        self._people.setdefault(name, []).append(emb)
+        self.revision += 1
+        if self._proto_names is not None:
+            row = self._add_to_prototype(name, emb)
+            if row is not None:
+                mean = self._proto_sums[row] / self._proto_counts[row]
+                if self._scores is not None:
+                    self._scores.set_row(row, mean)
+                if self._ann is not None:
+                    self._ann.upsert([row], [mean])
         if metadata:
             self.face_metadata.setdefault(name, []).append(metadata)
+        if self._sqlite is not None:
+            self._sqlite.add(name, emb, metadata)
+        if self._journal is not None:
+            self._journal_seq = self._journal.append(name, emb, metadata)
+            if self._compact_every and self._journal.records_since_rotate >= self._compact_every:
+                self.compact(background=True)
 
     def save(self, path: str):
+        if path.rstrip(os.sep).endswith(BINARY_GALLERY_SUFFIX):
+            self.save_binary(path)
+            return
+        if is_sqlite_gallery(path):
+            self.save_sqlite(path)
+            return
         data = {
-            'people': self.people,
-            'metadata': self.face_metadata
+            'people': self._plain_people(),
+            'metadata': self._plain_metadata(),
+            'journal_seq': self._journal_seq,
+            'empty_sources': self.empty_sources
         }
-        with open(path, "wb") as f:
+        # Erst vollständig schreiben, dann ersetzen: Leser sehen nie einen halben Snapshot
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
             pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def save_binary(self, path: str):
+        """Speichert im versionierten Binärformat (siehe gallery_store)
+
+        Ist path die per memmap geöffnete Galerie selbst, werden die memmaps vor dem Ersetzen
+        geschlossen und danach auf die neuen Dateien geöffnet.
+        """
+        names, sums, _ = self._prototypes()
+        remap = self._mapped_path is not None and self._mapped_path == os.path.abspath(path)
+        write_binary_gallery(path, names, (self._people[name] for name in names), sums, self._plain_metadata(),
+                             precision=self.precision, scores=self._score_matrix(), journal_seq=self._journal_seq,
+                             empty_sources=self.empty_sources, replace=not remap)
+        if remap:
+            del sums
+            self._release_mapping()
+            replace_binary_gallery(path)
+            self._map_binary(path)
+
+    def _release_mapping(self):
+        """Gibt alle memmaps auf die geladene Binärgalerie frei (ANN-Index und Metadaten bleiben)"""
+        self._people = {}
+        self._proto_sums = np.zeros((0, 0), dtype=np.float32)
+        self._scores = None
+        self._mapped_path = None
+
+    def _map_binary(self, path: str):
+        manifest = read_manifest(path)
+        names, counts = manifest['names'], manifest['counts']
+        matrix, scales = open_embeddings(path)
+        self._people = MappedPeople(matrix, names, counts, scales=scales)
+        self._metadata, self._metadata_path = None, path
+        self._mapped_path = os.path.abspath(path)
+        self._proto_names = list(names)
+        self._proto_rows = {name: i for i, name in enumerate(names)}
+        self._proto_sums = open_prototypes(path)
+        self._proto_counts = np.asarray(counts, dtype=np.int64)
+        self._scores = open_scores(path, self.precision) if self.precision != 'float32' else None
+        self._journal_seq = manifest.get('journal_seq', 0)
+        self.empty_sources = manifest.get('empty_sources', {})
 
     @staticmethod
-    def load(path: str) -> 'GalleryDB':
+    def load_binary(path: str) -> 'GalleryDB':
+        """Öffnet eine Binärgalerie per memmap; Metadaten werden erst bei Zugriff geladen"""
+        db = GalleryDB(precision=read_manifest(path).get('dtype', 'float32'))
+        db._map_binary(path)
+        return db
+
+    def save_sqlite(self, path: str):
+        """Schreibt die Galerie in eine SQLite-Datenbank
+
+        In die eigene Datenbank werden nur die geänderten Personen geschrieben; eine andere
+        Datei wird komplett neu erstellt und die Quelldatenbank bleibt unverändert.
+        """
+        if self._sqlite is not None and os.path.abspath(self._sqlite.path) == os.path.abspath(path):
+            for name in sorted(self._sqlite_dirty):
+                if name in self._people:
+                    self._sqlite.replace_identity(name, self._people[name], self.face_metadata.get(name, []))
+                else:
+                    self._sqlite.remove_identity(name)
+            self._sqlite_dirty.clear()
+            if self.empty_sources != self._sqlite.empty_sources():
+                self._sqlite.set_empty_sources(self.empty_sources)
+            self._sqlite.commit()
+            return
+        write_sqlite_gallery(path, list(self._people.keys()), self._people, self.face_metadata, self.empty_sources)
+
+    @staticmethod
+    def load_sqlite(path: str) -> 'GalleryDB':
+        """Öffnet eine SQLite-Galerie; Daten werden erst bei Zugriff geladen"""
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Galerie-Datenbank nicht gefunden: {path}")
+        store = SQLiteGalleryStore(path)
+        db = GalleryDB()
+        db._people = SQLitePeople(store, store.embeddings)
+        db._metadata = SQLitePeople(store, store.metadata)
+        db.empty_sources = store.empty_sources()
+        db._sqlite = store
+        return db
+
+    def find_faces(self, source_image: Optional[str] = None, min_quality: Optional[float] = None,
+                   name: Optional[str] = None) -> List[Dict]:
+        """Metadaten-Einträge nach Quellbild, Mindestqualität und/oder Person
+
+        Mit SQLite-Backend über indizierte Spalten, sonst durch Durchsuchen von face_metadata.
+        """
+        if self._sqlite is not None and not self._sqlite_dirty:
+            return self._sqlite.find_faces(source_image=source_image, min_quality=min_quality, name=name)
+        found = []
+        names = [name] if name is not None else list(self.face_metadata.keys())
+        for person in names:
+            for item in self.face_metadata.get(person, []):
+                if source_image is not None and item.get('source_image') != source_image:
+                    continue
+                if min_quality is not None and (item.get('quality_score') is None or item['quality_score'] < min_quality):
+                    continue
+                found.append({'name': person, **item})
+        return found
+
+    def close(self):
+        """Beendet Journal bzw. Datenbankverbindung (ausstehende add() werden geschrieben, Entfernungen nur mit save())"""
+        self.close_journal()
+        if self._sqlite is not None:
+            self._sqlite.close()
+            self._sqlite = None
+
+    @staticmethod
+    def load(path: str, retries: int = 5) -> 'GalleryDB':
+        """Lädt den Snapshot und spielt neuere Einträge aus dem Journal nach
+
+        Kompaktiert ein anderer Prozess währenddessen, können eingearbeitete Segmente zwischen
+        Snapshot und Journal verschwinden. Wurde der Snapshot während des Ladens ersetzt oder
+        haben die Sequenznummern eine Lücke, wird mit dem neuen Snapshot erneut geladen.
+        """
+        if is_sqlite_gallery(path):
+            return GalleryDB.load_sqlite(path)
+        for attempt in range(retries):
+            try:
+                before = _snapshot_identity(path)
+                db = GalleryDB._load_snapshot(path)
+                if db._replay_journal(path) and _snapshot_identity(path) == before:
+                    return db
+            except FileNotFoundError:
+                # Snapshot oder Segment wurde gerade ersetzt bzw. gelöscht
+                if attempt == 0 and not os.path.exists(path) and not os.path.exists(path.rstrip(os.sep) + ".old"):
+                    raise
+            time.sleep(0.05 * (attempt + 1))
+        if recover_binary_gallery(path):
+            # Ein Schreiber ist zwischen den beiden rename abgebrochen, siehe gallery_store
+            return GalleryDB.load(path, retries)
+        raise RuntimeError(f"Konnte {path} nicht konsistent laden (Snapshot und Journal ändern sich laufend)")
+
+    @staticmethod
+    def _load_snapshot(path: str) -> 'GalleryDB':
+        if is_binary_gallery(path):
+            return GalleryDB.load_binary(path)
         db = GalleryDB()
         with open(path, "rb") as f:
             data = pickle.load(f)
             if isinstance(data, dict):
                 db.people = data.get('people', {})
                 db.face_metadata = data.get('metadata', {})
+                db._journal_seq = data.get('journal_seq', 0)
+                db.empty_sources = data.get('empty_sources', {})
             else:
                 # Rückwärtskompatibilität
                 db.people = data
         return db
 
+    def _replay_journal(self, path: str) -> bool:
+        """Wendet Journal-Einträge nach journal_seq an; False bei einer Lücke in den Sequenznummern"""
+        for seq, name, embedding, metadata in read_journal(path, self._journal_seq):
+            if seq != self._journal_seq + 1:
+                return False
+            self.add(name, embedding, metadata)
+            self._journal_seq = seq
+        return True
+
+    def deduplicate(self, threshold: float = 0.98, max_per_identity: Optional[int] = None,
+                    names: Optional[List[str]] = None) -> Dict:
+        """Entfernt nahezu identische Embeddings und begrenzt optional die Anzahl je Person
+
+        Siehe select_representatives. Metadaten werden mitgekürzt, wenn sie eins zu eins zu den
+        Embeddings gehören (gleiche Länge). Mit aktivem Journal wird danach kompaktiert,
+        da das Journal nur Hinzufügungen kennt; eine SQLite-Datenbank ändert erst save().
+        Liefert einen Bericht über die Entfernungen.
+        """
+        report = {'identities': 0, 'before': 0, 'after': 0, 'duplicates_removed': 0, 'capped_removed': 0,
+                  'per_identity': {}}
+        changed = False
+        for name in list(names if names is not None else self._people.keys()):
+            if name not in self._people:
+                continue
+            embs = self._people[name]
+            uncapped = select_representatives(embs, threshold)
+            keep = select_representatives(embs, threshold, max_per_identity) if max_per_identity else uncapped
+            report['identities'] += 1
+            report['before'] += len(embs)
+            report['after'] += len(keep)
+            report['duplicates_removed'] += len(embs) - len(uncapped)
+            report['capped_removed'] += len(uncapped) - len(keep)
+            if len(keep) == len(embs):
+                continue
+            report['per_identity'][name] = (len(embs), len(keep))
+            metadata = self.face_metadata.get(name)
+            if metadata is not None and len(metadata) == len(embs):
+                self.face_metadata[name] = [metadata[i] for i in keep]
+            self._people[name] = [embs[i] for i in keep]
+            if self._sqlite is not None:
+                self._sqlite_dirty.add(name)
+            changed = True
+        if changed:
+            self.revision += 1
+            self._reset_prototypes()
+            if self._journal is not None:
+                self.compact()
+        return report
+
+    def remove_sources(self, source_images) -> int:
+        """Entfernt alle Gesichter, deren Metadaten auf eines der Bilder verweisen
+
+        Nur Personen mit eins zu eins zugeordneten Metadaten können bearbeitet werden, für andere
+        betroffene Personen gibt es eine Warnung; Personen ohne verbleibende Gesichter werden gelöscht. Mit aktivem Journal wird danach kompaktiert,
+        eine SQLite-Datenbank ändert erst save(). Vermerkte Bilder ohne Gesicht (empty_sources) werden
+        ebenfalls verworfen. Liefert die Anzahl entfernter Gesichter.
+        """
+        sources = set(source_images)
+        removed = 0
+        unaligned = []
+        for name in list(self._people.keys()):
+            embs = self._people[name]
+            metadata = self.face_metadata.get(name)
+            if metadata is None or len(metadata) != len(embs):
+                if any(m.get('source_image') in sources for m in metadata or []):
+                    unaligned.append(name)
+                continue
+            keep = [i for i, m in enumerate(metadata) if m.get('source_image') not in sources]
+            if len(keep) == len(embs):
+                continue
+            removed += len(embs) - len(keep)
+            if keep:
+                self._people[name] = [embs[i] for i in keep]
+                self.face_metadata[name] = [metadata[i] for i in keep]
+                if self._sqlite is not None:
+                    self._sqlite_dirty.add(name)
+            else:
+                del self._people[name]
+                del self.face_metadata[name]
+                if self._sqlite is not None:
+                    self._sqlite_dirty.add(name)
+        if unaligned:
+            warnings.warn(f"Metadaten passen nicht zu den Embeddings, veraltete Gesichter bleiben erhalten: "
+                          f"{', '.join(sorted(unaligned))} (Person neu einlesen oder Eintrag löschen)")
+        dropped = [source for source in sources if self.empty_sources.pop(source, None) is not None]
+        if removed:
+            self._reset_prototypes()
+        if removed or dropped:
+            self.revision += 1
+            if self._journal is not None:
+                self.compact()
+        return removed
+
+    def mark_empty_sources(self, entries: Dict[str, Dict]):
+        """Vermerkt eingelesene Quellbilder ohne Gesicht (source_image -> {'person', 'source_fingerprint'})
+
+        Damit überspringt ein inkrementelles Enrollment sie, solange sie unverändert sind. Mit
+        aktivem Journal wird danach kompaktiert, eine SQLite-Datenbank ändert erst save().
+        """
+        if not entries:
+            return
+        self.empty_sources.update(entries)
+        self.revision += 1
+        if self._journal is not None:
+            self.compact()
+
+    # Journal: add() schreibt nur den neuen Datensatz, compact() ersetzt den Snapshot
+
+    def attach_journal(self, path: str, compact_every: Optional[int] = None, fsync: bool = False):
+        """Protokolliert weitere add()-Aufrufe im Journal des Snapshots path
+
+        compact_every: nach so vielen Einträgen im Hintergrund kompaktieren (None = nur manuell).
+        Die Galerie muss den aktuellen Stand von path enthalten (GalleryDB.load(path)).
+        """
+        journal = GalleryJournal(path, fsync=fsync)
+        if journal.last_seq > self._journal_seq:
+            journal.close()
+            raise ValueError(f"Journal von {path} enthält Einträge, die in dieser Galerie fehlen; "
+                             f"zuerst GalleryDB.load({path!r}) verwenden")
+        journal.last_seq = self._journal_seq
+        self.close_journal()
+        self._journal = journal
+        self._compact_every = compact_every
+
+    def compact(self, background: bool = False):
+        """Schreibt einen neuen Snapshot mit allen Einträgen und löscht die eingearbeiteten Segmente"""
+        if self._journal is None:
+            raise ValueError("Kein Journal aktiv (attach_journal)")
+        self.wait_for_compaction()
+        journal = self._journal
+        seq = journal.rotate()
+        if self._mapped_path == os.path.abspath(journal.snapshot_path):
+            # Die eigenen memmaps müssen vor dem Ersetzen geschlossen werden, das geht nur im Vordergrund
+            snapshot, background = self, False
+        else:
+            snapshot = self._snapshot_copy(seq)
+
+        def run():
+            try:
+                snapshot.save(journal.snapshot_path)
+                journal.remove_through(seq)
+            except BaseException as e:
+                self._compaction_error = e
+
+        if background:
+            self._compaction = threading.Thread(target=run, name="gallery-compaction")
+            self._compaction.start()
+        else:
+            run()
+            self.wait_for_compaction()
+
+    def wait_for_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+        if self._compaction_error is not None:
+            error, self._compaction_error = self._compaction_error, None
+            raise error
+
+    def close_journal(self):
+        if self._journal is not None:
+            self.wait_for_compaction()
+            self._journal.close()
+            self._journal = None
+
+    def _snapshot_copy(self, journal_seq: int) -> 'GalleryDB':
+        """Flache Kopie des aktuellen Stands für das Schreiben im Hintergrund"""
+        snapshot = GalleryDB(precision=self.precision)
+        snapshot._people = {name: list(embs) for name, embs in self._people.items()}
+        snapshot._metadata = {name: list(items) for name, items in self.face_metadata.items()}
+        snapshot._journal_seq = journal_seq
+        snapshot.empty_sources = dict(self.empty_sources)
+        if self._proto_names is not None:
+            n = len(self._proto_names)
+            snapshot._proto_names = list(self._proto_names)
+            snapshot._proto_rows = dict(self._proto_rows)
+            snapshot._proto_sums = np.array(self._proto_sums[:n])
+            snapshot._proto_counts = np.array(self._proto_counts[:n])
+        return snapshot
+
+    # Prototypen: pro Person Summe der normalisierten Embeddings + Anzahl.
+    # Mittlere Cosine-Ähnlichkeit = Query · (Summe / Anzahl), also ein Skalarprodukt pro Person.
+
+    def _reset_prototypes(self):
+        """Verwirft die Prototypen; sie werden beim nächsten Match aus people aufgebaut"""
+        self._proto_names: Optional[List[str]] = None
+        self._proto_rows: Dict[str, int] = {}
+        self._proto_sums = np.zeros((0, 0), dtype=np.float32)
+        self._proto_counts = np.zeros(0, dtype=np.int64)
+        self._scores: Optional[QuantizedMatrix] = None  # quantisierte Prototyp-Mittel (nur float16/int8)
+        self._ann = None
+
+    def _build_prototypes(self):
+        if self._sqlite is not None and not self._sqlite_dirty:
+            # Prototypen liegen in der Datenbank, Embeddings müssen nicht geladen werden
+            names, sums, counts = self._sqlite.load_prototypes()
+            self._proto_names = names
+            self._proto_rows = {name: i for i, name in enumerate(names)}
+            self._proto_sums, self._proto_counts = sums, counts
+            return
+        names, sums, counts = [], [], []
+        for name, embs in self._people.items():
+            if len(embs) == 0:
+                continue
+            m = np.stack([np.asarray(e, dtype=np.float32).ravel() for e in embs])
+            m /= np.linalg.norm(m, axis=1, keepdims=True) + 1e-8
+            names.append(name)
+            sums.append(m.sum(axis=0))
+            counts.append(len(embs))
+        self._proto_names = names
+        self._proto_rows = {name: i for i, name in enumerate(names)}
+        self._proto_sums = np.stack(sums) if sums else np.zeros((0, 0), dtype=np.float32)
+        self._proto_counts = np.asarray(counts, dtype=np.int64)
+
+    def _add_to_prototype(self, name: str, emb: np.ndarray) -> Optional[int]:
+        """Aktualisiert den Prototyp einer Person inkrementell (O(D)); liefert die Zeile"""
+        v = emb.ravel()
+        v = v / (np.linalg.norm(v) + 1e-8)
+        if not self._proto_names:
+            self._proto_sums = np.zeros((16, v.shape[0]), dtype=np.float32)
+            self._proto_counts = np.zeros(16, dtype=np.int64)
+        elif v.shape[0] != self._proto_sums.shape[1]:
+            # Abweichende Dimension: beim nächsten Match aus people neu aufbauen
+            self._reset_prototypes()
+            return None
+        row = self._proto_rows.get(name)
+        if row is None:
+            row = len(self._proto_names)
+            if row == len(self._proto_sums):
+                self._proto_sums = np.concatenate([self._proto_sums, np.zeros_like(self._proto_sums)])
+                self._proto_counts = np.concatenate([self._proto_counts, np.zeros_like(self._proto_counts)])
+            self._proto_names.append(name)
+            self._proto_rows[name] = row
+        self._proto_sums[row] += v
+        self._proto_counts[row] += 1
+        return row
+
+    def _prototypes(self):
+        """(Namen, Summen-Matrix P×D, Anzahl je Person)"""
+        if self._proto_names is None:
+            self._build_prototypes()
+        n = len(self._proto_names)
+        return self._proto_names, self._proto_sums[:n], self._proto_counts[:n]
+
+    def set_precision(self, precision: str):
+        """Wechselt die Präzision für Scoring und Binärformat"""
+        self.precision = check_precision(precision)
+        self._scores = None
+
+    def _score_matrix(self) -> Optional[QuantizedMatrix]:
+        """Quantisierte Prototyp-Mittel für das Scoring (None bei float32)"""
+        if self.precision == 'float32':
+            return None
+        if self._scores is None:
+            names, sums, counts = self._prototypes()
+            if names:
+                self._scores = QuantizedMatrix.from_float(sums / counts[:, None], self.precision)
+        return self._scores
+
+    # Optionaler ANN-Index über die Prototypen (siehe gallery_index)
+
+    def enable_ann(self, backend: str = 'auto', **params):
+        """Aktiviert den ANN-Index für match_many (nprobe bzw. ef regeln Recall/Latenz)"""
+        self._ann_params = dict(params, backend=backend)
+        self._ann = None
+
+    def disable_ann(self):
+        self._ann_params = None
+        self._ann = None
+
+    def _ann_index(self):
+        """ANN-Index passend zu den aktuellen Prototypen (wird bei Bedarf aufgebaut)"""
+        names, sums, counts = self._prototypes()
+        if self._ann is None:
+            params = dict(self._ann_params)
+            self._ann = create_index(params.pop('backend'), **params)
+            if names:
+                self._ann.build(sums / counts[:, None])
+        return self._ann
+
+    def save_ann_index(self, path: str):
+        if self._ann_params is None:
+            raise ValueError("Kein ANN-Index aktiviert (enable_ann)")
+        names, _, _ = self._prototypes()
+        self._ann_index().save(path, names)
+
+    def load_ann_index(self, path: str):
+        """Lädt einen gespeicherten Index; seitdem hinzugekommene Personen werden nachgetragen"""
+        index, index_names = load_index(path)
+        names, sums, counts = self._prototypes()
+        if index_names != names[:len(index_names)]:
+            raise ValueError(f"ANN-Index {path} passt nicht zu dieser Galerie")
+        if len(names) > len(index_names):
+            rows = list(range(len(index_names), len(names)))
+            index.upsert(rows, sums[rows] / counts[rows, None])
+        self._ann = index
+        # Build-Parameter übernehmen, damit ein Neuaufbau (z.B. nach remove_sources) dieselben nutzt
+        self._ann_params = dict(index.params(), backend='hnswlib' if index.kind == 'hnsw' else 'numpy')
+
     def match(self, embedding: np.ndarray, threshold: float = 0.55):
-        best_name, best_sim = None, -1.0
-        for name, embs in self.people.items():
-            sims = [cosine_similarity(embedding, e) for e in embs]
-            if sims:
-                sim = float(np.mean(sims))
-                if sim > best_sim:
-                    best_sim, best_name = sim, name
-        if best_sim >= threshold:
-            return best_name, best_sim
-        return None, best_sim
+        return self.match_many([embedding], k=1, threshold=threshold)[0][0]
+
+    def match_many(self, embeddings, k: int = 1, threshold: Optional[float] = 0.55,
+                   exact: bool = False) -> List[List[Tuple[Optional[str], float]]]:
+        """Top-k Personen für einen N×D-Block von Query-Embeddings in einem Aufruf
+
+        Pro Query eine nach Ähnlichkeit absteigende Liste von (Name, Ähnlichkeit).
+        Wie bei match() ist der Name None, wenn die Ähnlichkeit unter threshold liegt;
+        ohne Personen in der Galerie wird (None, -1.0) geliefert. Mit aktivem
+        ANN-Index wird dieser verwendet, außer bei exact=True.
+        """
+        queries = [np.asarray(e, dtype=np.float32).ravel() for e in embeddings]
+        if not queries:
+            return []
+        names, sums, counts = self._prototypes()
+        if not names:
+            return [[(None, -1.0)] for _ in queries]
+        q = np.stack(queries)
+        q /= np.linalg.norm(q, axis=1, keepdims=True) + 1e-8
+        if self._ann_params is not None and not exact:
+            ids, scores = self._ann_index().search(q, max(1, k))
+            return [[(names[j] if threshold is None or s >= threshold else None, float(s))
+                     for j, s in zip(row_ids, row_scores) if j >= 0] or [(None, -1.0)]
+                    for row_ids, row_scores in zip(ids, scores)]
+        # Mittlere Cosine-Ähnlichkeit je Person über die Prototypen (ggf. auf der quantisierten Matrix)
+        scores = self._score_matrix()
+        person_sims = (q @ sums.T) / counts if scores is None else scores.dot(q)
+        k = max(1, min(k, len(names)))
+        if k == 1:
+            top = np.argmax(person_sims, axis=1)[:, None]
+        else:
+            top = np.argpartition(-person_sims, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(person_sims, top, axis=1), axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+        results = []
+        for row, idx in zip(person_sims, top):
+            hits = []
+            for j in idx:
+                sim = float(row[j])
+                hits.append((names[j] if threshold is None or sim >= threshold else None, sim))
+            results.append(hits)
+        return results
     
     def get_person_metadata(self, name: str) -> List[Dict]:
         """Gibt Metadaten für eine Person zurück"""
         return self.face_metadata.get(name, [])
 
-def build_gallery_from_folder(gallery_dir: str, det_size=(640,640)) -> 'GalleryDB':
-    engine = FaceEngine(det_size=det_size)
-    db = GalleryDB()
-    exts = (".jpg",".jpeg",".png",".bmp",".webp",".tif",".tiff")
-    for person in sorted(os.listdir(gallery_dir)):
-        person_dir = os.path.join(gallery_dir, person)
-        if not os.path.isdir(person_dir):
-            continue
-        paths = []
-        for ext in exts:
-            paths.extend(glob.glob(os.path.join(person_dir, f"*{ext}")))
-        for p in paths:
-            img = cv2.imread(p)
-            if img is None:
-                continue
-            faces = engine.analyze(img)
-            if not faces:
-                continue
-            faces.sort(key=lambda f: (f['bbox'][2]-f['bbox'][0])*(f['bbox'][3]-f['bbox'][1]), reverse=True)
-            
-            # Erweiterte Metadaten speichern
-            face_data = faces[0]
-            metadata = {
-                'age': face_data.get('age'),
-                'gender': face_data.get('gender'),
-                'quality_score': face_data.get('quality_score'),
-                'emotion': face_data.get('emotion'),
-                'eye_status': face_data.get('eye_status'),
-                'mouth_status': face_data.get('mouth_status'),
-                'source_image': p
-            }
-            
-            db.add(person, face_data["embedding"], metadata)
+def convert_gallery(src: str, dst: str, precision: Optional[str] = None) -> 'GalleryDB':
+    """Konvertiert eine Galerie (z. B. embeddings.pkl) ins Binärformat (optional quantisiert) oder nach SQLite"""
+    db = GalleryDB.load(src)
+    if precision:
+        db.set_precision(precision)
+    if is_sqlite_gallery(dst):
+        db.save_sqlite(dst)
+    else:
+        db.save_binary(dst)
     return db
+
+def __getattr__(name):
+    # build_gallery_from_folder lag früher hier; enrollment importiert dieses Modul, daher erst bei Zugriff laden
+    if name == 'build_gallery_from_folder':
+        from .enrollment import build_gallery_from_folder
+        return build_gallery_from_folder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,301 @@
+"""
+Approximative Nächste-Nachbarn-Suche über die Personen-Prototypen der GalleryDB
+
+IVFIndex: Inverted File in reinem NumPy (k-Means-Zentren, nprobe regelt Recall/Latenz).
+HNSWIndex: optional über hnswlib (ef regelt Recall/Latenz).
+Gespeichert werden die Prototypen (Mittel der normalisierten Embeddings) einer Person;
+die Scores sind damit dieselben wie im exakten Match-Pfad, nur werden nicht alle
+Personen bewertet.
+"""
+
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+INDEX_FORMAT_VERSION = 1
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / (np.linalg.norm(x, axis=-1, keepdims=True) + 1e-8)
+
+def _nearest_centroid(data: np.ndarray, centroids: np.ndarray, chunk: int = 16384) -> np.ndarray:
+    assign = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        assign[start:start + chunk] = np.argmax(data[start:start + chunk] @ centroids.T, axis=1)
+    return assign
+
+def _kmeans(data: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Sphärisches k-Means (Cosine) für die Grobquantisierung"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest_centroid(data, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        sums = centroids.copy()
+        sums[filled] = np.add.reduceat(data[np.argsort(assign, kind='stable')], starts[filled], axis=0)
+        # Leere Cluster mit zufälligen Punkten neu besetzen
+        if not filled.all():
+            sums[~filled] = data[rng.choice(len(data), int((~filled).sum()), replace=False)]
+        centroids = _normalize(sums).astype(np.float32)
+    return centroids
+
+class IVFIndex:
+    """Inverted-File-Index über Inner Product; nprobe = Anzahl durchsuchter Listen"""
+
+    kind = 'ivf'
+
+    def __init__(self, nlist: Optional[int] = None, nprobe: int = 8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self._nlist_param = nlist  # None = aus der Galeriegröße bestimmen
+        self.centroids: Optional[np.ndarray] = None
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._assign = np.zeros(0, dtype=np.int64)
+        self._size = 0
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def params(self) -> Dict:
+        """Parameter für create_index, mit denen sich der Index neu aufbauen lässt"""
+        return {'nlist': self._nlist_param, 'nprobe': self.nprobe}
+
+    def build(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        if n == 0:
+            return
+        nlist = min(self.nlist or max(1, int(4 * np.sqrt(n))), n)
+        directions = _normalize(vectors)
+        # Training auf höchstens 256 Punkten pro Liste
+        rng = np.random.default_rng(0)
+        train = directions if n <= 256 * nlist else directions[rng.choice(n, 256 * nlist, replace=False)]
+        self.centroids = _kmeans(train, nlist)
+        self.nlist = nlist
+        self._vectors = vectors.copy()
+        self._size = n
+        self._assign = _nearest_centroid(directions, self.centroids)
+        self._lists = [[] for _ in range(nlist)]
+        for i, c in enumerate(self._assign.tolist()):
+            self._lists[c].append(i)
+        self._list_arrays = {}
+
+    def upsert(self, ids, vectors):
+        """Fügt Vektoren ein bzw. ersetzt sie (ids fortlaufend ab 0, ohne Lücken)"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if self.centroids is None:
+            data = np.zeros((max(ids) + 1, vectors.shape[1]), dtype=np.float32)
+            if self._size:
+                data[:self._size] = self._vectors[:self._size]
+            data[list(ids)] = vectors
+            self.build(data)
+            return
+        for i, v in zip(ids, vectors):
+            i = int(i)
+            if i >= len(self._vectors):
+                grow = max(i + 1, 2 * len(self._vectors))
+                self._vectors = np.concatenate([self._vectors, np.zeros((grow - len(self._vectors), v.shape[0]), dtype=np.float32)])
+                self._assign = np.concatenate([self._assign, np.full(grow - len(self._assign), -1, dtype=np.int64)])
+            self._vectors[i] = v
+            c = int(np.argmax(self.centroids @ _normalize(v)))
+            old = int(self._assign[i]) if i < self._size else -1
+            if old != c:
+                if old >= 0:
+                    self._lists[old].remove(i)
+                    self._list_arrays.pop(old, None)
+                self._lists[c].append(i)
+                self._list_arrays.pop(c, None)
+                self._assign[i] = c
+            self._size = max(self._size, i + 1)
+
+    def _list_array(self, c: int) -> np.ndarray:
+        arr = self._list_arrays.get(c)
+        if arr is None:
+            arr = np.asarray(self._lists[c], dtype=np.int64)
+            self._list_arrays[c] = arr
+        return arr
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, scores) je Query, absteigend; fehlende Treffer als -1 / -inf"""
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        ids = np.full((len(q), k), -1, dtype=np.int64)
+        scores = np.full((len(q), k), -np.inf, dtype=np.float32)
+        if self.centroids is None:
+            return ids, scores
+        probe = min(self.nprobe, self.nlist)
+        coarse = q @ self.centroids.T
+        for row, (qv, cs) in enumerate(zip(q, coarse)):
+            clusters = np.argpartition(-cs, probe - 1)[:probe] if probe < len(cs) else range(len(cs))
+            cand = np.concatenate([self._list_array(int(c)) for c in clusters])
+            if len(cand) == 0:
+                continue
+            sims = self._vectors[cand] @ qv
+            n = min(k, len(cand))
+            top = np.argpartition(-sims, n - 1)[:n] if n < len(cand) else np.arange(len(cand))
+            top = top[np.argsort(-sims[top], kind='stable')]
+            ids[row, :n] = cand[top]
+            scores[row, :n] = sims[top]
+        return ids, scores
+
+    def save(self, path: str, names: List[str]):
+        with open(path, "wb") as f:
+            np.savez(f, version=INDEX_FORMAT_VERSION, kind=self.kind, nlist=self.nlist or 0, nprobe=self.nprobe,
+                     centroids=self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32),
+                     vectors=self._vectors[:self._size], assign=self._assign[:self._size],
+                     names=json.dumps(names), params=json.dumps(self.params()))
+
+    @staticmethod
+    def load(path: str) -> Tuple['IVFIndex', List[str]]:
+        with np.load(path) as data:
+            if int(data['version']) != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Nicht unterstützte Index-Version: {int(data['version'])}")
+            index = IVFIndex(**json.loads(str(data['params'])))
+            index.nlist = int(data['nlist']) or None
+            names = json.loads(str(data['names']))
+            if data['centroids'].size:
+                index.centroids = data['centroids']
+                index._vectors = data['vectors'].copy()
+                index._assign = data['assign'].copy()
+                index._size = len(index._vectors)
+                index._lists = [[] for _ in range(index.nlist)]
+                for i, c in enumerate(index._assign.tolist()):
+                    index._lists[c].append(i)
+        return index, names
+
+class HNSWIndex:
+    """HNSW-Graph über hnswlib (Inner Product); ef = Breite der Suche"""
+
+    kind = 'hnsw'
+
+    def __init__(self, ef: int = 64, M: int = 16, ef_construction: int = 200):
+        if not HNSWLIB_AVAILABLE:
+            raise ImportError("hnswlib nicht verfügbar. Installieren Sie: pip install hnswlib")
+        self.ef = ef
+        self.M = M
+        self.ef_construction = ef_construction
+        self._index = None
+        self._dim = 0
+
+    def __len__(self) -> int:
+        return self._index.get_current_count() if self._index is not None else 0
+
+    def params(self) -> Dict:
+        return {'ef': self.ef, 'M': self.M, 'ef_construction': self.ef_construction}
+
+    def _init(self, dim: int, capacity: int):
+        self._dim = dim
+        self._index = hnswlib.Index(space='ip', dim=dim)
+        self._index.init_index(max_elements=max(capacity, 16), ef_construction=self.ef_construction, M=self.M)
+
+    def build(self, vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        self._init(vectors.shape[1], 2 * len(vectors))
+        self._index.add_items(vectors, np.arange(len(vectors)))
+
+    def upsert(self, ids, vectors):
+        """Fügt Vektoren ein; vorhandene ids werden ersetzt"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if self._index is None:
+            self._init(vectors.shape[1], 2 * (max(ids) + 1))
+        needed = max(ids) + 1
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        self._index.add_items(vectors, np.asarray(ids, dtype=np.int64))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        ids = np.full((len(q), k), -1, dtype=np.int64)
+        scores = np.full((len(q), k), -np.inf, dtype=np.float32)
+        n = min(k, len(self))
+        if n == 0:
+            return ids, scores
+        self._index.set_ef(max(self.ef, n))
+        labels, distances = self._index.knn_query(q, k=n)
+        # hnswlib liefert für 'ip' die Distanz 1 - Skalarprodukt
+        ids[:, :n] = labels
+        scores[:, :n] = 1.0 - distances
+        return ids, scores
+
+    def save(self, path: str, names: List[str]):
+        self._index.save_index(path)
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_FORMAT_VERSION, "kind": self.kind, "dim": self._dim, "ef": self.ef,
+                       "M": self.M, "ef_construction": self.ef_construction, "names": names}, f)
+
+    @staticmethod
+    def load(path: str) -> Tuple['HNSWIndex', List[str]]:
+        with open(path + ".json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Nicht unterstützte Index-Version: {meta.get('version')}")
+        index = HNSWIndex(ef=meta["ef"], M=meta["M"], ef_construction=meta["ef_construction"])
+        index._dim = meta["dim"]
+        index._index = hnswlib.Index(space='ip', dim=meta["dim"])
+        index._index.load_index(path, max_elements=max(16, 2 * len(meta["names"])))
+        return index, meta["names"]
+
+ANN_BACKENDS = ('auto', 'numpy', 'hnswlib')
+
+def create_index(backend: str = 'auto', **params):
+    """Leerer ANN-Index; 'auto' nimmt hnswlib, falls installiert, sonst NumPy-IVF"""
+    if backend == 'auto':
+        backend = 'hnswlib' if HNSWLIB_AVAILABLE else 'numpy'
+    if backend == 'hnswlib':
+        return HNSWIndex(**params)
+    if backend == 'numpy':
+        return IVFIndex(**params)
+    raise ValueError(f"Unbekanntes ANN-Backend: {backend}")
+
+def load_index(path: str):
+    """Lädt einen gespeicherten Index; liefert (Index, Personennamen in Index-Reihenfolge)"""
+    if os.path.exists(path + ".json"):
+        return HNSWIndex.load(path)
+    return IVFIndex.load(path)
+
+def sample_queries(db, sample: int = 1000, seed: int = 0) -> List[np.ndarray]:
+    """Zufällige Auswahl gespeicherter Embeddings als Test-Queries"""
+    pool = [(name, i) for name, embs in db.people.items() for i in range(len(embs))]
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(pool), min(sample, len(pool)), replace=False) if pool else []
+    return [db.people[pool[p][0]][pool[p][1]] for p in picks]
+
+def evaluate_recall(db, queries=None, k: int = 1, sample: int = 1000, seed: int = 0) -> Dict:
+    """Recall@k des ANN-Pfads gegenüber dem exakten match_many, plus Latenz pro Query
+
+    Ohne queries werden bis zu sample gespeicherte Embeddings der Galerie verwendet.
+    """
+    if queries is None:
+        queries = sample_queries(db, sample, seed)
+    if len(queries) == 0:
+        return {"queries": 0, "k": k, "recall": None, "exact_ms": None, "ann_ms": None}
+    t0 = time.perf_counter()
+    exact = db.match_many(queries, k=k, threshold=None, exact=True)
+    t1 = time.perf_counter()
+    approx = db.match_many(queries, k=k, threshold=None)
+    t2 = time.perf_counter()
+    hits = 0
+    for e, a in zip(exact, approx):
+        expected = {name for name, _ in e}
+        hits += len(expected & {name for name, _ in a}) / max(1, len(expected))
+    n = len(queries)
+    return {
+        "queries": n,
+        "k": k,
+        "recall": hits / n,
+        "exact_ms": 1000.0 * (t1 - t0) / n,
+        "ann_ms": 1000.0 * (t2 - t1) / n,
+    }
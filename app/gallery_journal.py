@@ -0,0 +1,103 @@
+"""
+Append-only Journal für GalleryDB.add
+
+Neben dem Snapshot (embeddings.pkl bzw. *.gallery) liegen Segmente
+<snapshot>.journal.<erste Sequenznummer>. Jeder Datensatz trägt eine fortlaufende
+Sequenznummer und eine CRC32; ein abgebrochener Schreibvorgang am Segmentende wird
+beim Lesen ignoriert. Der Snapshot speichert die höchste enthaltene Sequenznummer
+(journal_seq), Leser wenden nur neuere Datensätze an. Beim Kompaktieren wird erst
+der neue Snapshot geschrieben und ersetzt (Pickle per os.replace) und danach die
+eingearbeiteten Segmente gelöscht. Liest ein Leser den alten Snapshot und sind die
+Segmente danach schon gelöscht, fehlen Sequenznummern; GalleryDB.load erkennt diese
+Lücke und lädt erneut, sodass es immer einen konsistenten Stand liefert.
+"""
+
+from __future__ import annotations
+import glob
+import os
+import pickle
+import struct
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+
+JOURNAL_SUFFIX = ".journal"
+_HEADER = struct.Struct("<IIQ")  # Länge, CRC32, Sequenznummer
+
+def segment_paths(snapshot_path: str) -> List[Tuple[int, str]]:
+    """(erste Sequenznummer, Pfad) aller Segmente, aufsteigend"""
+    base = snapshot_path.rstrip(os.sep) + JOURNAL_SUFFIX + "."
+    segments = []
+    for p in glob.glob(glob.escape(base) + "*"):
+        suffix = p[len(base):]
+        if suffix.isdigit():
+            segments.append((int(suffix), p))
+    return sorted(segments)
+
+def _read_segment(path: str) -> Iterator[Tuple[int, bytes]]:
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                return
+            length, crc, seq = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                # Unvollständiger Datensatz (Abbruch beim Schreiben): Rest ignorieren
+                return
+            yield seq, payload
+
+def read_journal(snapshot_path: str, after_seq: int = 0) -> Iterator[Tuple[int, str, np.ndarray, Optional[Dict]]]:
+    """Datensätze (seq, name, embedding, metadata) mit seq > after_seq in Schreibreihenfolge"""
+    for _, path in segment_paths(snapshot_path):
+        for seq, payload in _read_segment(path):
+            if seq > after_seq:
+                name, embedding, metadata = pickle.loads(payload)
+                yield seq, name, embedding, metadata
+
+class GalleryJournal:
+    """Schreibt add()-Datensätze an das aktuelle Segment eines Snapshots an"""
+
+    def __init__(self, snapshot_path: str, fsync: bool = False):
+        self.snapshot_path = snapshot_path
+        self.fsync = fsync
+        self.last_seq = 0
+        self.records_since_rotate = 0
+        for _, path in segment_paths(snapshot_path):
+            for seq, _ in _read_segment(path):
+                self.last_seq = max(self.last_seq, seq)
+        self._file = None
+
+    def append(self, name: str, embedding: np.ndarray, metadata: Optional[Dict] = None) -> int:
+        payload = pickle.dumps((name, np.asarray(embedding, dtype=np.float32), metadata),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        seq = self.last_seq + 1
+        if self._file is None:
+            path = f"{self.snapshot_path.rstrip(os.sep)}{JOURNAL_SUFFIX}.{seq:012d}"
+            self._file = open(path, "ab")
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload), seq) + payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.last_seq = seq
+        self.records_since_rotate += 1
+        return seq
+
+    def rotate(self) -> int:
+        """Schließt das aktuelle Segment; liefert die letzte vergebene Sequenznummer"""
+        self.close()
+        self.records_since_rotate = 0
+        return self.last_seq
+
+    def remove_through(self, seq: int):
+        """Löscht Segmente, deren Datensätze alle <= seq sind (nach dem Kompaktieren)"""
+        segments = segment_paths(self.snapshot_path)
+        for i, (first, path) in enumerate(segments):
+            next_first = segments[i + 1][0] if i + 1 < len(segments) else self.last_seq + 1
+            if next_first - 1 <= seq and (self._file is None or self._file.name != path):
+                os.remove(path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,155 @@
+"""
+Sharding einer GalleryDB nach Identität mit paralleler Scatter-Gather-Suche
+
+Personen werden per stabilem Hash (CRC32 des Namens) auf N Shards verteilt; jeder Shard
+ist eine eigene GalleryDB (gespeichert als memory-mapped *.gallery). match_many fragt alle
+Shards parallel ab und führt deren Top-k zusammen. merge_topk lässt sich auch für Shards
+auf anderen Hosts verwenden.
+"""
+
+from __future__ import annotations
+import json
+import os
+import zlib
+from collections import ChainMap
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from .face_recognizer import GalleryDB
+
+SHARDS_MANIFEST = "shards.json"
+SHARDS_FORMAT_VERSION = 1
+
+Matches = List[List[Tuple[Optional[str], float]]]
+
+def shard_of(name: str, n_shards: int) -> int:
+    """Shard-Nummer einer Person (unabhängig von PYTHONHASHSEED)"""
+    return zlib.crc32(name.encode("utf-8")) % n_shards
+
+def is_sharded_gallery(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, SHARDS_MANIFEST))
+
+def merge_topk(shard_results: List[Matches], k: int = 1, threshold: Optional[float] = 0.55) -> Matches:
+    """Führt die Top-k-Listen mehrerer Shards (mit threshold=None abgefragt) pro Query zusammen"""
+    merged = []
+    for per_query in zip(*shard_results):
+        hits = [hit for hits in per_query for hit in hits if hit[0] is not None]
+        hits.sort(key=lambda h: h[1], reverse=True)
+        hits = hits[:max(1, k)]
+        if not hits:
+            merged.append([(None, -1.0)])
+            continue
+        merged.append([(name if threshold is None or sim >= threshold else None, sim) for name, sim in hits])
+    return merged
+
+# Pro Worker-Prozess geladene Shards (memory-mapped, Seiten werden über den OS-Cache geteilt)
+_WORKER_SHARDS: Dict[str, GalleryDB] = {}
+
+def _match_shard_file(path: str, queries: np.ndarray, k: int) -> Matches:
+    db = _WORKER_SHARDS.get(path)
+    if db is None:
+        db = GalleryDB.load(path)
+        _WORKER_SHARDS[path] = db
+    return db.match_many(queries, k=k, threshold=None, exact=True)
+
+class ShardedGallery:
+    """Mehrere GalleryDB-Shards hinter der Match-API von GalleryDB"""
+
+    def __init__(self, shards: List[GalleryDB], workers: Optional[int] = None, executor: str = 'thread',
+                 paths: Optional[List[str]] = None):
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"Unbekannter Executor: {executor}")
+        if executor == 'process' and not paths:
+            raise ValueError("executor='process' benötigt gespeicherte Shards (ShardedGallery.load)")
+        self.shards = shards
+        self.paths = paths
+        self.workers = workers or min(len(shards), os.cpu_count() or 1)
+        self.executor = executor
+        self._pool = None
+
+    @property
+    def n_shards(self) -> int:
+        return len(self.shards)
+
+    @property
+    def people(self):
+        # Shards sind disjunkt, eine ChainMap reicht als gemeinsame Sicht
+        return ChainMap(*[s.people for s in self.shards])
+
+    @property
+    def face_metadata(self):
+        return ChainMap(*[s.face_metadata for s in self.shards])
+
+    @staticmethod
+    def split(db: GalleryDB, n_shards: int, **options) -> 'ShardedGallery':
+        """Verteilt die Personen einer Galerie auf n_shards Shards"""
+        shards = [GalleryDB(precision=db.precision) for _ in range(n_shards)]
+        parts: List[Dict] = [{} for _ in range(n_shards)]
+        metas: List[Dict] = [{} for _ in range(n_shards)]
+        for name, embs in db.people.items():
+            parts[shard_of(name, n_shards)][name] = list(embs)
+        for name, items in db.face_metadata.items():
+            metas[shard_of(name, n_shards)][name] = list(items)
+        for shard, people, metadata in zip(shards, parts, metas):
+            shard.people = people
+            shard.face_metadata = metadata
+        return ShardedGallery(shards, **options)
+
+    def save(self, path: str):
+        """Speichert jeden Shard als eigene Binärgalerie unter path/"""
+        os.makedirs(path, exist_ok=True)
+        files = [f"shard-{i:03d}.gallery" for i in range(self.n_shards)]
+        for shard, name in zip(self.shards, files):
+            shard.save_binary(os.path.join(path, name))
+        with open(os.path.join(path, SHARDS_MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"version": SHARDS_FORMAT_VERSION, "hash": "crc32", "shards": files}, f)
+        self.paths = [os.path.join(path, name) for name in files]
+
+    @staticmethod
+    def load(path: str, **options) -> 'ShardedGallery':
+        with open(os.path.join(path, SHARDS_MANIFEST), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version", 0) > SHARDS_FORMAT_VERSION:
+            raise ValueError(f"Shard-Format Version {manifest.get('version')} wird nicht unterstützt")
+        paths = [os.path.join(path, name) for name in manifest["shards"]]
+        return ShardedGallery([GalleryDB.load(p) for p in paths], paths=paths, **options)
+
+    def add(self, name: str, embedding: np.ndarray, metadata: Optional[Dict] = None):
+        self.shards[shard_of(name, self.n_shards)].add(name, embedding, metadata)
+
+    def _executor(self):
+        if self._pool is None:
+            pool_cls = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+            self._pool = pool_cls(max_workers=self.workers)
+        return self._pool
+
+    def match_many(self, embeddings, k: int = 1, threshold: Optional[float] = 0.55) -> Matches:
+        """Wie GalleryDB.match_many: alle Shards parallel abfragen, Top-k zusammenführen"""
+        queries = [np.asarray(e, dtype=np.float32).ravel() for e in embeddings]
+        if not queries:
+            return []
+        q = np.stack(queries)
+        if self.n_shards == 1 or self.workers == 1:
+            results = [s.match_many(q, k=k, threshold=None) for s in self.shards]
+        elif self.executor == 'process':
+            # Worker lesen die gespeicherten Shards: add() seit dem letzten save() ist dort nicht sichtbar
+            futures = [self._executor().submit(_match_shard_file, p, q, k) for p in self.paths]
+            results = [f.result() for f in futures]
+        else:
+            futures = [self._executor().submit(s.match_many, q, k, None) for s in self.shards]
+            results = [f.result() for f in futures]
+        return merge_topk(results, k=k, threshold=threshold)
+
+    def match(self, embedding: np.ndarray, threshold: float = 0.55):
+        return self.match_many([embedding], k=1, threshold=threshold)[0][0]
+
+    def get_person_metadata(self, name: str) -> List[Dict]:
+        return self.shards[shard_of(name, self.n_shards)].get_person_metadata(name)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,315 @@
+"""
+SQLite-Backend für GalleryDB (*.sqlite)
+
+Tabellen:
+    identities   id, name
+    faces        Embeddings als float32-Blob je Gesicht
+    metadata     face_metadata-Einträge mit indizierten Spalten (source_image, quality_score,
+                 age, gender, emotion) und dem vollständigen Eintrag als Pickle
+    prototypes   Summe der normalisierten Embeddings + Anzahl je Person
+
+Personen, Embeddings und Metadaten werden erst beim Zugriff geladen; add() schreibt
+direkt in die Datenbank. Reines Laden verändert die Datei nicht: WAL-Modus und Schema
+werden erst beim Anlegen bzw. beim ersten Schreiben gesetzt.
+"""
+
+from __future__ import annotations
+import json
+import os
+import pickle
+import sqlite3
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3")
+SQLITE_FORMAT_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS identities (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS faces (
+    id INTEGER PRIMARY KEY,
+    identity_id INTEGER NOT NULL REFERENCES identities(id),
+    embedding BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    id INTEGER PRIMARY KEY,
+    identity_id INTEGER NOT NULL REFERENCES identities(id),
+    face_id INTEGER REFERENCES faces(id),
+    source_image TEXT,
+    quality_score REAL,
+    age REAL,
+    gender TEXT,
+    emotion TEXT,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prototypes (
+    identity_id INTEGER PRIMARY KEY REFERENCES identities(id),
+    sum BLOB NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_faces_identity ON faces(identity_id);
+CREATE INDEX IF NOT EXISTS idx_metadata_identity ON metadata(identity_id);
+CREATE INDEX IF NOT EXISTS idx_metadata_source ON metadata(source_image);
+CREATE INDEX IF NOT EXISTS idx_metadata_quality ON metadata(quality_score);
+"""
+
+def is_sqlite_gallery(path: str) -> bool:
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\x00"
+    return path.lower().endswith(SQLITE_SUFFIXES)
+
+def _to_blob(v: np.ndarray) -> bytes:
+    return np.asarray(v, dtype=np.float32).ravel().tobytes()
+
+def _from_blob(b: bytes) -> np.ndarray:
+    return np.frombuffer(b, dtype=np.float32).copy()
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class SQLiteGalleryStore:
+    """Verbindung zu einer Galerie-Datenbank; Änderungen werden gesammelt committet"""
+
+    def __init__(self, path: str, commit_every: int = 256, create: bool = False):
+        self.path = path
+        self.commit_every = commit_every
+        self._pending = 0
+        self._writable = False
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        if create:
+            self._prepare_write()
+            self.conn.execute("INSERT OR IGNORE INTO info (key, value) VALUES ('version', ?)",
+                              (str(SQLITE_FORMAT_VERSION),))
+            self.conn.commit()
+        try:
+            row = self.conn.execute("SELECT value FROM info WHERE key = 'version'").fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+        if row is None:
+            self.conn.close()
+            raise ValueError(f"{path} ist keine Galerie-Datenbank")
+        if int(row[0]) > SQLITE_FORMAT_VERSION:
+            self.conn.close()
+            raise ValueError(f"Galerie-Datenbank Version {row[0]} wird nicht unterstützt")
+        self._ids: Dict[str, int] = {name: i for i, name in self.conn.execute("SELECT id, name FROM identities ORDER BY id")}
+
+    def _prepare_write(self):
+        """WAL-Modus und Schema vor dem ersten Schreiben"""
+        if not self._writable:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(_SCHEMA)
+            self._writable = True
+
+    def names(self) -> List[str]:
+        return list(self._ids)
+
+    def empty_sources(self) -> Dict[str, Dict]:
+        """Quellbilder ohne Gesicht (GalleryDB.empty_sources)"""
+        row = self.conn.execute("SELECT value FROM info WHERE key = 'empty_sources'").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def set_empty_sources(self, empty_sources: Dict[str, Dict]):
+        self._prepare_write()
+        self.conn.execute("INSERT OR REPLACE INTO info (key, value) VALUES ('empty_sources', ?)",
+                          (json.dumps(empty_sources),))
+
+    def identity_id(self, name: str, create: bool = False) -> Optional[int]:
+        identity = self._ids.get(name)
+        if identity is None and create:
+            identity = self.conn.execute("INSERT INTO identities (name) VALUES (?)", (name,)).lastrowid
+            self._ids[name] = identity
+        return identity
+
+    def embeddings(self, name: str) -> List[np.ndarray]:
+        identity = self._ids.get(name)
+        if identity is None:
+            return []
+        rows = self.conn.execute("SELECT embedding FROM faces WHERE identity_id = ? ORDER BY id", (identity,))
+        return [_from_blob(b) for (b,) in rows]
+
+    def metadata(self, name: str) -> List[Dict]:
+        identity = self._ids.get(name)
+        if identity is None:
+            return []
+        rows = self.conn.execute("SELECT data FROM metadata WHERE identity_id = ? ORDER BY id", (identity,))
+        return [pickle.loads(b) for (b,) in rows]
+
+    def _insert_metadata(self, identity: int, face_id: Optional[int], metadata: Dict):
+        self.conn.execute(
+            "INSERT INTO metadata (identity_id, face_id, source_image, quality_score, age, gender, emotion, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (identity, face_id, metadata.get('source_image'), _number(metadata.get('quality_score')),
+             _number(metadata.get('age')), metadata.get('gender'), metadata.get('emotion'),
+             pickle.dumps(metadata, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def add(self, name: str, embedding: np.ndarray, metadata: Optional[Dict] = None):
+        self._prepare_write()
+        identity = self.identity_id(name, create=True)
+        emb = np.asarray(embedding, dtype=np.float32).ravel()
+        face_id = self.conn.execute("INSERT INTO faces (identity_id, embedding) VALUES (?, ?)",
+                                    (identity, _to_blob(emb))).lastrowid
+        if metadata:
+            self._insert_metadata(identity, face_id, metadata)
+        v = emb / (np.linalg.norm(emb) + 1e-8)
+        row = self.conn.execute("SELECT sum, count FROM prototypes WHERE identity_id = ?", (identity,)).fetchone()
+        if row is None or len(row[0]) != len(_to_blob(v)):
+            self.conn.execute("INSERT OR REPLACE INTO prototypes (identity_id, sum, count) VALUES (?, ?, ?)",
+                              (identity, _to_blob(v), 1))
+        else:
+            self.conn.execute("UPDATE prototypes SET sum = ?, count = ? WHERE identity_id = ?",
+                              (_to_blob(_from_blob(row[0]) + v), row[1] + 1, identity))
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def replace_identity(self, name: str, embeddings: List[np.ndarray], metadata: List[Dict]):
+        """Schreibt alle Embeddings/Metadaten einer Person neu (z. B. nach Deduplizierung)"""
+        self._prepare_write()
+        identity = self.identity_id(name, create=True)
+        self.conn.execute("DELETE FROM metadata WHERE identity_id = ?", (identity,))
+        self.conn.execute("DELETE FROM faces WHERE identity_id = ?", (identity,))
+        self.conn.execute("DELETE FROM prototypes WHERE identity_id = ?", (identity,))
+        self.write_identity(name, embeddings, metadata)
+        self.commit()
+
+    def remove_identity(self, name: str):
+        identity = self._ids.pop(name, None)
+        if identity is None:
+            return
+        self._prepare_write()
+        for table in ("metadata", "faces", "prototypes"):
+            self.conn.execute(f"DELETE FROM {table} WHERE identity_id = ?", (identity,))
+        self.conn.execute("DELETE FROM identities WHERE id = ?", (identity,))
+        self.commit()
+
+    def write_identity(self, name: str, embeddings: List[np.ndarray], metadata: List[Dict]):
+        """Fügt eine Person gesammelt ein; Metadaten gleicher Länge werden den Gesichtern zugeordnet"""
+        self._prepare_write()
+        identity = self.identity_id(name, create=True)
+        face_ids = []
+        total = None
+        for e in embeddings:
+            emb = np.asarray(e, dtype=np.float32).ravel()
+            face_ids.append(self.conn.execute("INSERT INTO faces (identity_id, embedding) VALUES (?, ?)",
+                                              (identity, _to_blob(emb))).lastrowid)
+            v = emb / (np.linalg.norm(emb) + 1e-8)
+            total = v if total is None else total + v
+        aligned = len(metadata) == len(face_ids)
+        for i, item in enumerate(metadata):
+            self._insert_metadata(identity, face_ids[i] if aligned else None, item)
+        if total is not None:
+            self.conn.execute("INSERT OR REPLACE INTO prototypes (identity_id, sum, count) VALUES (?, ?, ?)",
+                              (identity, _to_blob(total), len(face_ids)))
+
+    def load_prototypes(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """(Namen, Summen P×D, Anzahl) aller Personen mit Embeddings"""
+        names, sums, counts = [], [], []
+        by_id = {i: name for name, i in self._ids.items()}
+        for identity, blob, count in self.conn.execute("SELECT identity_id, sum, count FROM prototypes ORDER BY identity_id"):
+            names.append(by_id[identity])
+            sums.append(_from_blob(blob))
+            counts.append(count)
+        matrix = np.stack(sums) if sums else np.zeros((0, 0), dtype=np.float32)
+        return names, matrix, np.asarray(counts, dtype=np.int64)
+
+    def find_faces(self, source_image: Optional[str] = None, min_quality: Optional[float] = None,
+                   name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Metadaten-Einträge über die indizierten Spalten suchen"""
+        clauses, params = [], []
+        if source_image is not None:
+            clauses.append("m.source_image = ?")
+            params.append(source_image)
+        if min_quality is not None:
+            clauses.append("m.quality_score >= ?")
+            params.append(min_quality)
+        if name is not None:
+            clauses.append("i.name = ?")
+            params.append(name)
+        sql = "SELECT i.name, m.data FROM metadata m JOIN identities i ON i.id = m.identity_id"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        return [{'name': n, **pickle.loads(b)} for n, b in self.conn.execute(sql + " ORDER BY m.id", params)]
+
+    def commit(self):
+        self.conn.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+class SQLitePeople(MutableMapping):
+    """people bzw. face_metadata als Sicht auf die Datenbank; Listen werden je Person beim Zugriff geladen"""
+
+    def __init__(self, store: SQLiteGalleryStore, loader):
+        self._store = store
+        self._loader = loader
+        self._lists: Dict[str, List] = {}
+        self._deleted = set()
+
+    def __getitem__(self, name):
+        lst = self._lists.get(name)
+        if lst is None:
+            if name in self._deleted or self._store.identity_id(name) is None:
+                raise KeyError(name)
+            lst = self._loader(name)
+            self._lists[name] = lst
+        return lst
+
+    def __setitem__(self, name, value):
+        self._lists[name] = value
+        self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._lists.pop(name, None)
+        self._deleted.add(name)
+
+    def __contains__(self, name):
+        return name not in self._deleted and (name in self._lists or self._store.identity_id(name) is not None)
+
+    def __iter__(self):
+        names = self._store.names()
+        known = set(names)
+        for name in names:
+            if name not in self._deleted:
+                yield name
+        for name in list(self._lists):
+            if name not in known and name not in self._deleted:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+def write_sqlite_gallery(path: str, names: Iterable[str], people, metadata: Dict[str, List[Dict]],
+                         empty_sources: Optional[Dict[str, Dict]] = None):
+    """Schreibt eine komplette Galerie in eine neue Datenbank (ersetzt eine vorhandene Datei)"""
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    store = SQLiteGalleryStore(tmp, create=True)
+    written = set()
+    for name in names:
+        store.write_identity(name, people.get(name, []), metadata.get(name, []))
+        written.add(name)
+    for name, items in metadata.items():
+        if name not in written:
+            store.write_identity(name, [], items)
+    if empty_sources:
+        store.set_empty_sources(empty_sources)
+    # Modus lässt sich nur außerhalb einer Transaktion wechseln
+    store.commit()
+    store.conn.execute("PRAGMA journal_mode=DELETE")
+    store.close()
+    # Verwaiste WAL-Dateien einer früheren Datenbank dürfen nicht auf die neue angewendet werden
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.replace(tmp, path)
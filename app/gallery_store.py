@@ -0,0 +1,221 @@
+"""
+Binäres Galerie-Format (Verzeichnis *.gallery)
+
+    manifest.json        Format-Version, Präzision, Dimension, Personennamen und Anzahl Embeddings je Person,
+                         Quellbilder ohne Gesicht (GalleryDB.empty_sources)
+    embeddings.npy       Matrix N×D (float32/float16/int8), Zeilen nach Person gruppiert (Reihenfolge wie im Manifest)
+    embeddings_scale.npy nur int8: Skalierung je Zeile
+    prototypes.npy       float32-Matrix P×D, Summe der normalisierten Embeddings je Person
+    scores.npy           nur float16/int8: quantisierte Prototyp-Mittel für das Scoring (+ scores_scale.npy)
+    metadata.pkl         face_metadata (wird erst beim ersten Zugriff geladen)
+
+embeddings.npy wird per np.memmap geöffnet: Laden kostet nur das Manifest, die Seiten
+teilen sich alle Prozesse über den OS-Cache.
+
+Das Ersetzen einer bestehenden Galerie ist nicht atomar: Verzeichnisse lassen sich nicht per
+rename überschreiben, daher wird das Ziel erst nach *.old verschoben und dann *.tmp an seine
+Stelle gesetzt. Dazwischen fehlt der Pfad kurz; GalleryDB.load wartet in diesem Fall und
+versucht es erneut. Bricht der Schreiber genau dort ab, stellt recover_binary_gallery (beim
+nächsten Schreiben bzw. Laden) *.old wieder her. Es darf nur einen Schreiber geben.
+Überschreibt ein Prozess die Galerie, die er selbst gemappt hat, schließt GalleryDB.save_binary
+die memmaps vor dem Ersetzen (unter Windows lassen sich gemappte Dateien nicht verschieben).
+"""
+
+from __future__ import annotations
+import json
+import os
+import pickle
+import shutil
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from .quantization import QuantizedMatrix, dequantize, quantize
+
+GALLERY_FORMAT = "face-gallery"
+GALLERY_FORMAT_VERSION = 2  # 2: Präzision float16/int8
+BINARY_GALLERY_SUFFIX = ".gallery"
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDINGS_SCALE_FILE = "embeddings_scale.npy"
+PROTOTYPES_FILE = "prototypes.npy"
+SCORES_FILE = "scores.npy"
+SCORES_SCALE_FILE = "scores_scale.npy"
+METADATA_FILE = "metadata.pkl"
+
+def is_binary_gallery(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+class MappedPeople(MutableMapping):
+    """people-Sicht auf die memory-mapped Matrix; Listen von Zeilen-Views entstehen erst beim Zugriff"""
+
+    def __init__(self, matrix: np.ndarray, names: List[str], counts: List[int], scales: Optional[np.ndarray] = None):
+        self._matrix = matrix
+        self._scales = scales
+        self._names = list(names)
+        self._rows: Dict[str, tuple] = {}
+        offset = 0
+        for name, count in zip(names, counts):
+            self._rows[name] = (offset, count)
+            offset += count
+        self._lists: Dict[str, List[np.ndarray]] = {}
+        self._deleted = set()
+
+    def __getitem__(self, name):
+        lst = self._lists.get(name)
+        if lst is None:
+            if name in self._deleted or name not in self._rows:
+                raise KeyError(name)
+            start, count = self._rows[name]
+            if self._matrix.dtype == np.float32:
+                lst = [self._matrix[i] for i in range(start, start + count)]
+            else:
+                # Quantisierte Zeilen werden beim Zugriff nach float32 zurückgerechnet
+                scales = self._scales[start:start + count] if self._scales is not None else None
+                lst = list(dequantize(self._matrix[start:start + count], scales))
+            self._lists[name] = lst
+        return lst
+
+    def __setitem__(self, name, value):
+        self._lists[name] = value
+        self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._lists.pop(name, None)
+        self._deleted.add(name)
+
+    def __contains__(self, name):
+        return name not in self._deleted and (name in self._rows or name in self._lists)
+
+    def __iter__(self):
+        for name in self._names:
+            if name not in self._deleted:
+                yield name
+        for name in list(self._lists):
+            if name not in self._rows:
+                yield name
+
+    def __len__(self):
+        extra = sum(1 for name in self._lists if name not in self._rows)
+        return len(self._rows) - len(self._deleted & self._rows.keys()) + extra
+
+def write_binary_gallery(path: str, names: List[str], groups: Iterable[List[np.ndarray]],
+                         prototypes: np.ndarray, metadata: Dict[str, List[Dict]],
+                         precision: str = 'float32', scores: Optional[QuantizedMatrix] = None,
+                         journal_seq: int = 0, empty_sources: Optional[Dict[str, Dict]] = None,
+                         replace: bool = True):
+    """Schreibt eine Galerie; groups liefert die Embeddings je Person in der Reihenfolge von names
+
+    Geschrieben wird in ein temporäres Verzeichnis, das erst am Ende das Ziel ersetzt
+    (zwei rename-Aufrufe, nicht atomar, siehe Modulbeschreibung). Mit replace=False bleibt
+    path.tmp liegen, bis replace_binary_gallery aufgerufen wird, z.B. nachdem die eigenen
+    memmaps auf path geschlossen sind (Windows kann gemappte Dateien nicht verschieben).
+    """
+    recover_binary_gallery(path)
+    groups = list(groups)
+    counts = [len(g) for g in groups]
+    dim = int(prototypes.shape[1]) if len(names) else 0
+    tmp = path.rstrip(os.sep) + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    store_dtype = quantize(np.zeros((1, 1), dtype=np.float32), precision)[0].dtype
+    row_scales = np.ones(sum(counts), dtype=np.float32) if precision == 'int8' else None
+    if sum(counts):
+        matrix = np.lib.format.open_memmap(os.path.join(tmp, EMBEDDINGS_FILE), mode="w+", dtype=store_dtype,
+                                           shape=(sum(counts), dim))
+        row = 0
+        for embs in groups:
+            if len(embs) == 0:
+                continue
+            data, scales = quantize(np.stack([np.asarray(e, dtype=np.float32).ravel() for e in embs]), precision)
+            matrix[row:row + len(data)] = data
+            if scales is not None:
+                row_scales[row:row + len(data)] = scales
+            row += len(data)
+        matrix.flush()
+        del matrix
+    else:
+        np.save(os.path.join(tmp, EMBEDDINGS_FILE), np.zeros((0, dim), dtype=store_dtype))
+    if row_scales is not None:
+        np.save(os.path.join(tmp, EMBEDDINGS_SCALE_FILE), row_scales)
+    if scores is not None:
+        data, scales = scores.rows()
+        np.save(os.path.join(tmp, SCORES_FILE), data)
+        if scales is not None:
+            np.save(os.path.join(tmp, SCORES_SCALE_FILE), scales)
+    np.save(os.path.join(tmp, PROTOTYPES_FILE), np.asarray(prototypes, dtype=np.float32).reshape(len(names), dim))
+    with open(os.path.join(tmp, METADATA_FILE), "wb") as f:
+        pickle.dump(metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"format": GALLERY_FORMAT, "version": GALLERY_FORMAT_VERSION, "dim": dim, "dtype": precision,
+                   "names": list(names), "counts": counts, "journal_seq": journal_seq,
+                   "empty_sources": empty_sources or {}}, f, ensure_ascii=False)
+    if replace:
+        replace_binary_gallery(path)
+
+def replace_binary_gallery(path: str):
+    """Ersetzt path durch das von write_binary_gallery geschriebene path.tmp"""
+    tmp = path.rstrip(os.sep) + ".tmp"
+    old = None
+    if os.path.exists(path):
+        old = path.rstrip(os.sep) + ".old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.replace(path, old)
+    os.replace(tmp, path)
+    if old:
+        shutil.rmtree(old)
+
+def recover_binary_gallery(path: str) -> bool:
+    """Stellt path aus path.old wieder her, falls ein Schreiber zwischen den beiden rename abgebrochen ist"""
+    old = path.rstrip(os.sep) + ".old"
+    if os.path.exists(path) or not is_binary_gallery(old):
+        return False
+    os.replace(old, path)
+    return True
+
+def read_manifest(path: str) -> Dict:
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != GALLERY_FORMAT:
+        raise ValueError(f"{path} ist keine Galerie im Binärformat")
+    if manifest.get("version", 0) > GALLERY_FORMAT_VERSION:
+        raise ValueError(f"Galerie-Version {manifest.get('version')} wird nicht unterstützt "
+                         f"(maximal {GALLERY_FORMAT_VERSION})")
+    return manifest
+
+def _load_mapped(path: str, mode: str) -> np.ndarray:
+    try:
+        return np.load(path, mmap_mode=mode)
+    except ValueError:
+        # Leere Matrix lässt sich nicht mappen
+        return np.load(path)
+
+def _load_optional(path: str, mode: str) -> Optional[np.ndarray]:
+    return _load_mapped(path, mode) if os.path.exists(path) else None
+
+def open_embeddings(path: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Embedding-Matrix als schreibgeschützte memmap (zero-copy) und ggf. int8-Skalierung"""
+    return (_load_mapped(os.path.join(path, EMBEDDINGS_FILE), "r"),
+            _load_optional(os.path.join(path, EMBEDDINGS_SCALE_FILE), "r"))
+
+def open_prototypes(path: str) -> np.ndarray:
+    # copy-on-write: Lesen teilt die Seiten, Änderungen bleiben im Prozess
+    return _load_mapped(os.path.join(path, PROTOTYPES_FILE), "c")
+
+def open_scores(path: str, precision: str) -> Optional[QuantizedMatrix]:
+    """Gespeicherte quantisierte Scoring-Matrix (copy-on-write), falls vorhanden"""
+    data = _load_optional(os.path.join(path, SCORES_FILE), "c")
+    if data is None:
+        return None
+    return QuantizedMatrix(precision, data, _load_optional(os.path.join(path, SCORES_SCALE_FILE), "c"))
+
+def read_metadata(path: str) -> Dict[str, List[Dict]]:
+    metadata_path = os.path.join(path, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return {}
+    with open(metadata_path, "rb") as f:
+        return pickle.load(f)
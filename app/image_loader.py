@@ -0,0 +1,91 @@
+"""
+Bild-Laden mit reduzierter JPEG-Dekodierung
+
+Für die Detection reicht meist eine verkleinerte Kopie. JPEGs werden dafür
+direkt im DCT-Bereich reduziert dekodiert (cv2.IMREAD_REDUCED_COLOR_2/4/8);
+die volle Auflösung wird erst nachgeladen, wenn sie gebraucht wird (z. B. für
+die Gesichts-Crops).
+"""
+
+from __future__ import annotations
+import zipfile
+from typing import Iterator, Optional, Tuple
+import numpy as np
+import cv2
+from PIL import Image
+
+JPEG_EXTS = (".jpg", ".jpeg", ".jpe", ".jfif")
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def image_size(path: str) -> Optional[Tuple[int, int]]:
+    """Liest (Breite, Höhe) aus dem Dateikopf, ohne das Bild zu dekodieren"""
+    try:
+        with Image.open(path) as im:
+            return im.size
+    except Exception:
+        return None
+
+def reduction_factor(full_side: float, target_side: float) -> int:
+    """Größter Faktor aus 8/4/2, bei dem full_side / Faktor >= target_side bleibt (sonst 1)"""
+    for factor in (8, 4, 2):
+        if full_side / factor >= target_side:
+            return factor
+    return 1
+
+def imread_reduced(path: str, factor: int = 1) -> Optional[np.ndarray]:
+    """Dekodiert ein Bild um factor verkleinert (nur JPEG, sonst volle Auflösung)"""
+    if factor == 1 or not path.lower().endswith(JPEG_EXTS):
+        return cv2.imread(path)
+    return cv2.imread(path, _REDUCED_FLAGS[factor])
+
+class LoadedImage:
+    """Arbeitskopie eines Bildes; scale = Arbeitskopie / Original"""
+
+    def __init__(self, path: str, image: np.ndarray, scale: float = 1.0):
+        self.path = path
+        self.image = image
+        self.scale = scale
+        self._full: Optional[np.ndarray] = None
+
+    def full(self) -> Optional[np.ndarray]:
+        """Volle Auflösung (wird beim ersten Aufruf dekodiert)"""
+        if self.scale == 1.0:
+            return self.image
+        if self._full is None:
+            self._full = cv2.imread(self.path)
+        return self._full
+
+def load_image(path: str, max_side: Optional[int] = None) -> Optional[LoadedImage]:
+    """Lädt ein Bild; JPEGs mit längster Seite > max_side werden reduziert dekodiert
+
+    Die Arbeitskopie behält mindestens max_side Pixel auf der längsten Seite.
+    """
+    factor = 1
+    if max_side and path.lower().endswith(JPEG_EXTS):
+        size = image_size(path)
+        if size:
+            factor = reduction_factor(max(size), max_side)
+    img = imread_reduced(path, factor)
+    if img is None:
+        return None
+    return LoadedImage(path, img, 1.0 / factor)
+
+def iter_zip_images(zf: zipfile.ZipFile,
+                    extensions: Tuple[str, ...] = IMAGE_EXTS) -> Iterator[Tuple[zipfile.ZipInfo, bytes, Optional[np.ndarray]]]:
+    """(Mitglied, Dateiinhalt, BGR-Bild oder None) je Bild im ZIP, ohne zu entpacken
+
+    Die Mitglieder werden nacheinander gelesen und im Speicher dekodiert, es liegt
+    immer nur eines im Speicher.
+    """
+    for info in zf.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(extensions):
+            continue
+        data = zf.read(info)
+        yield info, data, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
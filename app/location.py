@@ -1,6 +1,7 @@
 
 from __future__ import annotations
-from typing import Optional, Dict, Any
+import io
+from typing import Optional, Dict, Any, Union
 from PIL import Image, ExifTags
 from datetime import datetime
 import piexif
@@ -25,13 +26,13 @@ def extract_exif_gps(image_path: str) -> Optional[Dict[str, float]]:
     except Exception:
         return None
 
-def extract_comprehensive_metadata(image_path: str) -> Dict[str, Any]:
-    """Extrahierte umfassende Metadaten aus einem Bild"""
+def extract_comprehensive_metadata(image_path: Union[str, bytes]) -> Dict[str, Any]:
+    """Extrahierte umfassende Metadaten aus einem Bild (Pfad oder Dateiinhalt als bytes)"""
     metadata = {}
     
     try:
         # EXIF mit PIL
-        img = Image.open(image_path)
+        img = Image.open(io.BytesIO(image_path) if isinstance(image_path, bytes) else image_path)
         exif = img._getexif()
         if exif:
             exif_data = { ExifTags.TAGS.get(k,k): v for k,v in exif.items() }
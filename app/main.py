@@ -2,10 +2,15 @@
 from __future__ import annotations
 import argparse, os, json
 from typing import List, Dict, Any
-import cv2
 from tqdm import tqdm
 
-from app.face_recognizer import FaceEngine, GalleryDB, build_gallery_from_folder
+from app.face_recognizer import (EMBEDDING_PROFILES, ORT_EXECUTION_MODES, ORT_GRAPH_OPT_LEVELS, FaceEngine, GalleryDB,
+                                 convert_gallery)
+from app.enrollment import build_gallery_from_folder, build_gallery_from_mapping
+from app.gallery_index import ANN_BACKENDS, HNSWLIB_AVAILABLE, evaluate_recall
+from app.quantization import PRECISIONS, evaluate_precision
+from app.gallery_sqlite import is_sqlite_gallery
+from app.gallery_shards import ShardedGallery, is_sharded_gallery
 from app.location import extract_exif_gps, reverse_geocode
 
 def collect_images(path: str, recursive: bool=False) -> List[str]:
@@ -23,69 +28,286 @@ def collect_images(path: str, recursive: bool=False) -> List[str]:
     else:
         return [path]
 
+def add_decode_argument(parser: argparse.ArgumentParser):
+    parser.add_argument("--max-decode-side", type=int,
+                        help="Decode JPEGs reduced (1/2, 1/4, 1/8) for detection, keeping at least this longest side")
+
+def add_ort_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--intra-op-threads", type=int, help="ONNX Runtime intra-op threads (overrides config.yaml)")
+    parser.add_argument("--inter-op-threads", type=int, help="ONNX Runtime inter-op threads (overrides config.yaml)")
+    parser.add_argument("--execution-mode", choices=ORT_EXECUTION_MODES,
+                        help="ONNX Runtime execution mode (overrides config.yaml)")
+    parser.add_argument("--graph-optimization-level", choices=ORT_GRAPH_OPT_LEVELS,
+                        help="ONNX Runtime graph optimization level (overrides config.yaml)")
+
+def ort_options_from_args(args) -> Dict[str, Any]:
+    opts = {}
+    for key in ("intra_op_threads", "inter_op_threads", "execution_mode", "graph_optimization_level"):
+        if getattr(args, key) is not None:
+            opts[key] = getattr(args, key)
+    return opts
+
+def _load_for_append(path: str) -> GalleryDB:
+    """Bestehende DB laden; nur neue Gesichter werden geschrieben (Journal bzw. direkt in SQLite)"""
+    db = GalleryDB.load(path)
+    if not is_sqlite_gallery(path):
+        db.attach_journal(path)
+    return db
+
+def _finish_append(args, db: GalleryDB):
+    if is_sqlite_gallery(args.db):
+        # Neue Gesichter stehen schon in der Datenbank, Entfernungen (--incremental) schreibt erst save()
+        db.save(args.db)
+    elif args.compact:
+        db.compact()
+    db.close()
+    print(f"Updated gallery DB {args.db} ({len(db.people)} identities)")
+
 def cmd_enroll(args):
-    db = build_gallery_from_folder(args.gallery, det_size=(args.det, args.det))
+    existing = None
+    if (args.append or args.incremental) and os.path.exists(args.db):
+        existing = _load_for_append(args.db)
+    report = {}
+    db = build_gallery_from_folder(args.gallery, det_size=(args.det, args.det), profile=args.profile,
+                                   ort_options=ort_options_from_args(args), max_decode_side=args.max_decode_side,
+                                   db=existing, workers=args.workers, incremental=args.incremental,
+                                   content_hash=args.content_hash, report=report)
+    if args.incremental:
+        print(f"{report['images']} images: {report['embedded']} faces embedded, {report['skipped']} unchanged images skipped, "
+              f"{report['removed']} faces of changed or deleted images removed")
+    if existing is not None:
+        _finish_append(args, db)
+        return
+    os.makedirs(os.path.dirname(args.db) or ".", exist_ok=True)
+    db.save(args.db)
+    print(f"Saved gallery DB with {len(db.people)} identities to {args.db}")
+
+def cmd_enroll_mapping(args):
+    with open(args.mapping, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+    existing = _load_for_append(args.db) if args.append and os.path.exists(args.db) else None
+    report = {}
+    with tqdm(desc="Enrolling regions", unit="img") as pbar:
+        def progress(done, total):
+            pbar.total = total
+            pbar.update(done - pbar.n)
+        db = build_gallery_from_mapping(mapping, det_size=(args.det, args.det), profile=args.profile,
+                                        ort_options=ort_options_from_args(args), min_region_size=args.min_region_size,
+                                        clean_names=not args.keep_names, db=existing, workers=args.workers,
+                                        progress=progress, report=report, min_iou=args.min_iou)
+    print(f"{report['images']} images, {report['regions']} regions: {report['embedded']} faces embedded, "
+          f"{report['unmatched']} regions without a face, {report['too_small']} too small, "
+          f"{report['no_coords']} without coordinates, {report['missing_images'] + report['unreadable']} images missing or unreadable, "
+          f"{report['errors']} analysis errors")
+    if report['images'] and report['errors'] + report['unreadable'] == report['images']:
+        raise SystemExit(f"Alle {report['images']} Bilder sind fehlgeschlagen, {args.db} wurde nicht geschrieben")
+    if existing is not None:
+        _finish_append(args, db)
+        return
     os.makedirs(os.path.dirname(args.db) or ".", exist_ok=True)
     db.save(args.db)
     print(f"Saved gallery DB with {len(db.people)} identities to {args.db}")
 
 def cmd_annotate(args):
-    engine = FaceEngine(det_size=(args.det, args.det))
-    db = GalleryDB.load(args.db) if args.db and os.path.exists(args.db) else None
+    engine = FaceEngine(det_size=(args.det, args.det), ort_options=ort_options_from_args(args),
+                        max_detect_side=args.max_detect_side, tile_size=args.tile_size, tile_overlap=args.tile_overlap)
+    db = None
+    if args.db and is_sharded_gallery(args.db):
+        if args.ann_index:
+            raise SystemExit("--ann-index wird für geshardete Galerien nicht unterstützt")
+        db = ShardedGallery.load(args.db, workers=args.shard_workers, executor=args.shard_executor)
+    elif args.db and os.path.exists(args.db):
+        db = GalleryDB.load(args.db)
+    if db and args.ann_index:
+        db.load_ann_index(args.ann_index)
     images = collect_images(args.input, recursive=args.recursive)
     out_records: List[Dict[str, Any]] = []
-    for path in tqdm(images, desc="Annotating"):
-        img = cv2.imread(path)
-        if img is None:
-            continue
-        faces = engine.analyze(img)
-        persons = []
-        for f in faces:
-            name, sim = (None, None)
-            if db:
-                n, s = db.match(f["embedding"], threshold=args.threshold)
-                name, sim = (n, s)
-            persons.append({
-                "bbox": f["bbox"],
-                "prob": f["prob"],
-                "name": name,
-                "similarity": sim,
-                "age": f["age"],
-                "gender": f["gender"]
-            })
-        loc = extract_exif_gps(path)
-        addr = reverse_geocode(loc["lat"], loc["lon"]) if (loc and args.reverse_geocode) else None
-        record = {
-            "image": path,
-            "location": {**loc, "address": addr} if loc else None,
-            "persons": persons
-        }
-        out_records.append(record)
+    batch = max(1, args.batch)
+    with tqdm(total=len(images), desc="Annotating") as pbar:
+        for start in range(0, len(images), batch):
+            chunk = images[start:start + batch]
+            analyzed = engine.analyze_files(chunk, max_decode_side=args.max_decode_side)
+            for path, faces in zip(chunk, analyzed):
+                if faces is None:
+                    continue
+                out_records.append(_annotation_record(args, db, path, faces))
+            pbar.update(len(chunk))
 
     with open(args.out, "w", encoding="utf-8") as f:
         json.dump(out_records, f, ensure_ascii=False, indent=2)
     print(f"Wrote annotations for {len(out_records)} images to {args.out}")
 
+def _annotation_record(args, db, path: str, faces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    persons = []
+    matched = {}
+    if db:
+        idx = [i for i, f in enumerate(faces) if f["embedding"] is not None]
+        hits = db.match_many([faces[i]["embedding"] for i in idx], k=1, threshold=args.threshold)
+        matched = {i: h[0] for i, h in zip(idx, hits)}
+    for i, f in enumerate(faces):
+        name, sim = matched.get(i, (None, None))
+        persons.append({
+            "bbox": f["bbox"],
+            "prob": f["prob"],
+            "name": name,
+            "similarity": sim,
+            "age": f["age"],
+            "gender": f["gender"]
+        })
+    loc = extract_exif_gps(path)
+    addr = reverse_geocode(loc["lat"], loc["lon"]) if (loc and args.reverse_geocode) else None
+    return {
+        "image": path,
+        "location": {**loc, "address": addr} if loc else None,
+        "persons": persons
+    }
+
+def cmd_ann_index(args):
+    db = GalleryDB.load(args.db)
+    backend = args.backend
+    if backend == "auto":
+        backend = "hnswlib" if HNSWLIB_AVAILABLE else "numpy"
+    params = {"ef": args.ef} if backend == "hnswlib" else {"nprobe": args.nprobe, "nlist": args.nlist}
+    db.enable_ann(backend, **params)
+    out = args.out or args.db + ".ann"
+    db.save_ann_index(out)
+    print(f"Saved {backend} ANN index for {len(db.people)} identities to {out}")
+    report = evaluate_recall(db, k=args.k, sample=args.sample)
+    if report["queries"]:
+        print(f"Recall@{report['k']} vs. exact match: {report['recall']:.4f} over {report['queries']} queries "
+              f"(exact {report['exact_ms']:.3f} ms/query, ANN {report['ann_ms']:.3f} ms/query)")
+
+def cmd_convert_db(args):
+    db = convert_gallery(args.db, args.out, precision=args.precision)
+    print(f"Converted gallery DB with {len(db.people)} identities to {args.out} ({db.precision})")
+
+def cmd_precision_report(args):
+    db = GalleryDB.load(args.db)
+    for precision in args.precision:
+        r = evaluate_precision(db, precision, k=args.k, sample=args.sample)
+        line = f"{precision:8s} {r['embedding_mb']:10.1f} MB (float32: {r['embedding_mb_float32']:.1f} MB)"
+        if r["queries"]:
+            line += (f"  top-1 agreement {r['top1_agreement']:.4f}  recall@{r['k']} {r['recall']:.4f}"
+                     f"  score error mean {r['mean_abs_score_error']:.5f} / max {r['max_abs_score_error']:.5f}"
+                     f"  {r['quantized_ms']:.3f} ms/query (float32 {r['float32_ms']:.3f})")
+        print(line)
+
+def cmd_dedup_db(args):
+    db = GalleryDB.load(args.db)
+    report = db.deduplicate(threshold=args.threshold, max_per_identity=args.max_per_identity)
+    out = args.out or args.db
+    db.save(out)
+    db.close()
+    print(f"{report['identities']} identities: {report['before']} -> {report['after']} embeddings "
+          f"({report['duplicates_removed']} near-duplicates, {report['capped_removed']} over the per-identity cap removed)")
+    for name, (before, after) in sorted(report["per_identity"].items(), key=lambda x: x[1][0] - x[1][1], reverse=True)[:args.top]:
+        print(f"  {name}: {before} -> {after}")
+    print(f"Saved to {out}")
+
+def cmd_shard_db(args):
+    db = GalleryDB.load(args.db)
+    sharded = ShardedGallery.split(db, args.shards)
+    sharded.save(args.out)
+    sizes = ", ".join(str(len(s.people)) for s in sharded.shards)
+    print(f"Split gallery DB with {len(db.people)} identities into {args.shards} shards ({sizes}) under {args.out}")
+
 def build_parser():
     p = argparse.ArgumentParser(description="Photo metadata annotator")
     sub = p.add_subparsers(dest="cmd", required=True)
 
     p_enroll = sub.add_parser("enroll", help="Build face embedding database from gallery")
     p_enroll.add_argument("--gallery", required=True, help="Path to labeled gallery folder")
-    p_enroll.add_argument("--db", required=True, help="Output path to embeddings DB (pickle)")
+    p_enroll.add_argument("--db", required=True, help="Output path to embeddings DB (pickle; binary if it ends in .gallery, SQLite if .sqlite)")
     p_enroll.add_argument("--det", type=int, default=640, help="Detector size (square)")
+    p_enroll.add_argument("--profile", choices=EMBEDDING_PROFILES, default="detect+embed",
+                          help="Analysis profile (use 'full' to store age/gender/quality metadata)")
+    p_enroll.add_argument("--append", action="store_true",
+                          help="Add to an existing DB via its append-only journal instead of rewriting it")
+    p_enroll.add_argument("--compact", action="store_true", help="With --append: merge the journal into the DB afterwards")
+    p_enroll.add_argument("--incremental", action="store_true",
+                          help="Only embed new or changed images and drop faces of deleted images (updates an existing DB in place)")
+    p_enroll.add_argument("--content-hash", action="store_true",
+                          help="Also store a SHA-1 per image so copied or touched but unchanged files are recognised")
+    p_enroll.add_argument("--workers", type=int, default=1,
+                          help="Worker processes, each with its own model and share of the CPU cores (result is independent of this)")
+    add_decode_argument(p_enroll)
+    add_ort_arguments(p_enroll)
     p_enroll.set_defaults(func=cmd_enroll)
 
+    p_map = sub.add_parser("enroll-mapping", help="Build a gallery DB directly from a PBF-DAMS mapping JSON (region-guided, no ZIP)")
+    p_map.add_argument("--mapping", required=True, help="PBF-DAMS mapping JSON (image + regions with name and x_abs/y_abs/width_px/height_px)")
+    p_map.add_argument("--db", required=True, help="Output path to embeddings DB (pickle; binary if it ends in .gallery, SQLite if .sqlite)")
+    p_map.add_argument("--det", type=int, default=640, help="Detector size (square)")
+    p_map.add_argument("--profile", choices=EMBEDDING_PROFILES, default="detect+embed",
+                       help="Analysis profile (use 'full' to store age/gender/quality metadata)")
+    p_map.add_argument("--min-region-size", type=int, default=30, help="Skip regions narrower or lower than this (pixels)")
+    p_map.add_argument("--min-iou", type=float, default=0.3,
+                       help="Minimum overlap between region and detected face; regions below it count as without a face")
+    p_map.add_argument("--keep-names", action="store_true", help="Keep a leading ':' in region names")
+    p_map.add_argument("--workers", type=int, default=1, help="Worker processes, each with its own model and share of the CPU cores")
+    p_map.add_argument("--append", action="store_true", help="Add to an existing DB via its append-only journal instead of rewriting it")
+    p_map.add_argument("--compact", action="store_true", help="With --append: merge the journal into the DB afterwards")
+    add_ort_arguments(p_map)
+    p_map.set_defaults(func=cmd_enroll_mapping)
+
     p_annot = sub.add_parser("annotate", help="Annotate photos with faces, age/gender, and GPS location")
     p_annot.add_argument("--input", required=True, help="Image file or folder")
-    p_annot.add_argument("--db", required=False, help="Path to embeddings DB (pickle)")
+    p_annot.add_argument("--db", required=False, help="Path to embeddings DB (pickle, .gallery, .sqlite or a directory written by shard-db)")
     p_annot.add_argument("--out", required=True, help="Output JSON file")
     p_annot.add_argument("--recursive", action="store_true", help="Recurse into subfolders if input is a directory")
     p_annot.add_argument("--reverse-geocode", action="store_true", help="Convert GPS to address (internet required)")
     p_annot.add_argument("--threshold", type=float, default=0.55, help="Cosine similarity threshold for identity match")
     p_annot.add_argument("--det", type=int, default=640, help="Detector size (square)")
+    p_annot.add_argument("--batch", type=int, default=8, help="Images per batched recognition call")
+    p_annot.add_argument("--max-detect-side", type=int, help="Detect on a downscaled copy with this longest side (large scans)")
+    p_annot.add_argument("--tile-size", type=int, help="Additionally detect in overlapping tiles of this size (small faces in huge images)")
+    p_annot.add_argument("--tile-overlap", type=float, default=0.2, help="Tile overlap fraction")
+    p_annot.add_argument("--ann-index", help="Approximate nearest-neighbour index built with 'ann-index' for large galleries")
+    p_annot.add_argument("--shard-workers", type=int, help="With a sharded --db: shards searched in parallel (default: one per shard, at most CPU count)")
+    p_annot.add_argument("--shard-executor", choices=["thread", "process"], default="thread",
+                         help="With a sharded --db: search shards in threads or in worker processes")
+    add_decode_argument(p_annot)
+    add_ort_arguments(p_annot)
     p_annot.set_defaults(func=cmd_annotate)
 
+    p_ann = sub.add_parser("ann-index", help="Build an approximate nearest-neighbour index for a gallery DB and report its recall")
+    p_ann.add_argument("--db", required=True, help="Path to embeddings DB (pickle)")
+    p_ann.add_argument("--out", help="Output path of the index (default: <db>.ann)")
+    p_ann.add_argument("--backend", choices=ANN_BACKENDS, default="auto", help="'auto' uses hnswlib if installed, else NumPy IVF")
+    p_ann.add_argument("--nlist", type=int, help="IVF lists (default: 4*sqrt(identities))")
+    p_ann.add_argument("--nprobe", type=int, default=8, help="IVF lists searched per query (higher = better recall, slower)")
+    p_ann.add_argument("--ef", type=int, default=64, help="HNSW search width (higher = better recall, slower)")
+    p_ann.add_argument("--k", type=int, default=1, help="Recall@k to report")
+    p_ann.add_argument("--sample", type=int, default=1000, help="Stored embeddings used as recall queries")
+    p_ann.set_defaults(func=cmd_ann_index)
+
+    p_conv = sub.add_parser("convert-db", help="Convert an embeddings DB (pickle) to the memory-mapped binary format or SQLite")
+    p_conv.add_argument("--db", required=True, help="Input embeddings DB (pickle)")
+    p_conv.add_argument("--out", required=True, help="Output path, e.g. embeddings.gallery or embeddings.sqlite")
+    p_conv.add_argument("--precision", choices=PRECISIONS, help="Storage and scoring precision (int8 uses a per-vector scale)")
+    p_conv.set_defaults(func=cmd_convert_db)
+
+    p_prec = sub.add_parser("precision-report", help="Measure the accuracy drop of float16/int8 scoring against float32")
+    p_prec.add_argument("--db", required=True, help="Path to embeddings DB (pickle or .gallery)")
+    p_prec.add_argument("--precision", nargs="+", choices=PRECISIONS, default=["float16", "int8"], help="Precisions to compare")
+    p_prec.add_argument("--k", type=int, default=5, help="Recall@k to report")
+    p_prec.add_argument("--sample", type=int, default=1000, help="Stored embeddings used as queries")
+    p_prec.set_defaults(func=cmd_precision_report)
+
+    p_dedup = sub.add_parser("dedup-db", help="Remove near-duplicate embeddings and optionally cap embeddings per identity")
+    p_dedup.add_argument("--db", required=True, help="Path to embeddings DB (pickle or .gallery)")
+    p_dedup.add_argument("--out", help="Output path (default: overwrite --db)")
+    p_dedup.add_argument("--threshold", type=float, default=0.98, help="Cosine similarity above which embeddings count as duplicates")
+    p_dedup.add_argument("--max-per-identity", type=int, help="Keep at most this many diverse embeddings per identity (k-center)")
+    p_dedup.add_argument("--top", type=int, default=10, help="Identities to list with the most removals")
+    p_dedup.set_defaults(func=cmd_dedup_db)
+
+    p_shard = sub.add_parser("shard-db", help="Split a gallery DB into N memory-mapped shards by identity hash")
+    p_shard.add_argument("--db", required=True, help="Path to embeddings DB (pickle, .gallery or .sqlite)")
+    p_shard.add_argument("--out", required=True, help="Output directory for the shards")
+    p_shard.add_argument("--shards", type=int, default=4, help="Number of shards")
+    p_shard.set_defaults(func=cmd_shard_db)
+
     return p
 
 def main():
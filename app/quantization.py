@@ -0,0 +1,141 @@
+"""
+Quantisierte Speicherung von Embeddings: float16 oder int8 mit Skalierung je Vektor
+
+Das Scoring läuft blockweise direkt auf der gespeicherten Matrix; pro Block wird nur
+ein kleiner float32-Ausschnitt erzeugt, die Matrix selbst bleibt quantisiert.
+"""
+
+from __future__ import annotations
+import time
+from typing import Dict, Optional, Tuple
+import numpy as np
+from .gallery_index import sample_queries
+
+PRECISIONS = ('float32', 'float16', 'int8')
+_DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+
+def check_precision(precision: str) -> str:
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unbekannte Präzision: {precision} (erlaubt: {', '.join(PRECISIONS)})")
+    return precision
+
+def quantize(x: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Quantisiert die Zeilen von x; liefert (Daten, Skalierung je Zeile oder None)"""
+    x = np.asarray(x, dtype=np.float32)
+    if precision == 'int8':
+        scales = np.abs(x).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        data = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+        return data, scales.astype(np.float32)
+    return x.astype(_DTYPES[precision]), None
+
+def dequantize(data: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    out = np.asarray(data, dtype=np.float32)
+    if scales is not None:
+        out = out * (scales[:, None] if out.ndim == 2 else scales)
+    return out
+
+class QuantizedMatrix:
+    """Zeilenmatrix in float32/float16/int8 mit inkrementellem Schreiben einzelner Zeilen"""
+
+    def __init__(self, precision: str, data: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.precision = check_precision(precision)
+        self.data = data
+        self.scales = scales
+        self.size = len(data)
+
+    @staticmethod
+    def from_float(x: np.ndarray, precision: str) -> 'QuantizedMatrix':
+        data, scales = quantize(x, precision)
+        return QuantizedMatrix(precision, data, scales)
+
+    def set_row(self, i: int, v: np.ndarray):
+        if i >= len(self.data):
+            grow = max(i + 1, 2 * len(self.data))
+            data = np.zeros((grow, self.data.shape[1] if self.data.ndim == 2 else len(v)), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+            if self.scales is not None:
+                scales = np.ones(grow, dtype=np.float32)
+                scales[:self.size] = self.scales[:self.size]
+                self.scales = scales
+        d, s = quantize(np.asarray(v, dtype=np.float32).reshape(1, -1), self.precision)
+        self.data[i] = d[0]
+        if self.scales is not None:
+            self.scales[i] = s[0]
+        self.size = max(self.size, i + 1)
+
+    def rows(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        return self.data[:self.size], (self.scales[:self.size] if self.scales is not None else None)
+
+    def dot(self, q: np.ndarray, block: int = 4096) -> np.ndarray:
+        """q (N×D, float32) · Zeilenᵀ -> N×size"""
+        out = np.empty((len(q), self.size), dtype=np.float32)
+        for start in range(0, self.size, block):
+            end = min(start + block, self.size)
+            sims = q @ self.data[start:end].astype(np.float32).T
+            if self.scales is not None:
+                sims *= self.scales[start:end]
+            out[:, start:end] = sims
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        data, scales = self.rows()
+        return data.nbytes + (scales.nbytes if scales is not None else 0)
+
+def embedding_bytes(count: int, dim: int, precision: str) -> int:
+    """Speicherbedarf von count Embeddings der Dimension dim"""
+    per_vector = dim * np.dtype(_DTYPES[precision]).itemsize + (4 if precision == 'int8' else 0)
+    return count * per_vector
+
+def evaluate_precision(db, precision: str, queries=None, k: int = 1, sample: int = 1000, seed: int = 0) -> Dict:
+    """Genauigkeitsverlust des quantisierten Scorings gegenüber float32 auf der eigenen Galerie
+
+    Vergleicht Top-1-Übereinstimmung, Recall@k und Score-Abweichung des exakten Match-Pfads.
+    Ohne queries werden bis zu sample gespeicherte Embeddings der Galerie verwendet.
+    """
+    check_precision(precision)
+    if queries is None:
+        queries = sample_queries(db, sample, seed)
+    n_embeddings = sum(len(embs) for embs in db.people.values())
+    dim = next((len(np.ravel(embs[0])) for embs in db.people.values() if len(embs)), 0)
+    report = {
+        "precision": precision,
+        "queries": len(queries),
+        "k": k,
+        "embedding_mb": embedding_bytes(n_embeddings, dim, precision) / 2**20,
+        "embedding_mb_float32": embedding_bytes(n_embeddings, dim, 'float32') / 2**20,
+    }
+    if len(queries) == 0:
+        return report
+    original = db.precision
+    try:
+        db.set_precision('float32')
+        t0 = time.perf_counter()
+        reference = db.match_many(queries, k=k, threshold=None, exact=True)
+        t1 = time.perf_counter()
+        db.set_precision(precision)
+        db.match_many(queries[:1], k=1, threshold=None, exact=True)  # Matrix vorab quantisieren
+        t2 = time.perf_counter()
+        quantized = db.match_many(queries, k=k, threshold=None, exact=True)
+        t3 = time.perf_counter()
+    finally:
+        db.set_precision(original)
+    top1 = recall = 0.0
+    errors = []
+    for ref, qnt in zip(reference, quantized):
+        top1 += ref[0][0] == qnt[0][0]
+        expected = {name for name, _ in ref}
+        recall += len(expected & {name for name, _ in qnt}) / max(1, len(expected))
+        errors.append(abs(ref[0][1] - qnt[0][1]))
+    n = len(queries)
+    report.update({
+        "top1_agreement": top1 / n,
+        "recall": recall / n,
+        "mean_abs_score_error": float(np.mean(errors)),
+        "max_abs_score_error": float(np.max(errors)),
+        "float32_ms": 1000.0 * (t1 - t0) / n,
+        "quantized_ms": 1000.0 * (t3 - t2) / n,
+    })
+    return report
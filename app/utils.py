@@ -1,7 +1,7 @@
 
 from __future__ import annotations
 import numpy as np
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, List, Tuple
 import cv2
 from datetime import datetime
 
@@ -24,6 +24,52 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     b = b / (np.linalg.norm(b) + 1e-8)
     return float(np.dot(a, b))
 
+def box_iou(a, b) -> float:
+    """Intersection over Union zweier Boxen im Format [x1, y1, x2, y2]"""
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+def assign_regions_to_faces(region_boxes, face_boxes, min_iou: float = 0.1,
+                            max_center_offset: float = 0.5) -> List[Optional[int]]:
+    """Ordnet Regionen eindeutig erkannten Gesichtern zu (Index in face_boxes oder None)
+
+    Greedy nach absteigender IoU; Regionen ohne ausreichende Überlappung erhalten das
+    nächste noch freie Gesicht nur, wenn dessen Mittelpunkt höchstens max_center_offset
+    mal die längere Seite der Region entfernt liegt. Sonst bleibt die Region frei, statt
+    das Gesicht eines Nachbarn unter falschem Namen zu übernehmen.
+    """
+    pairs = sorted(
+        ((box_iou(r, f), ri, fi) for ri, r in enumerate(region_boxes) for fi, f in enumerate(face_boxes)),
+        reverse=True
+    )
+    assignment: List[Optional[int]] = [None] * len(region_boxes)
+    used = set()
+    for iou, ri, fi in pairs:
+        if iou < min_iou:
+            break
+        if assignment[ri] is None and fi not in used:
+            assignment[ri] = fi
+            used.add(fi)
+
+    # Fallback: nächstes freies Gesicht in der Nähe der Region
+    for ri, r in enumerate(region_boxes):
+        if assignment[ri] is not None:
+            continue
+        free = [fi for fi in range(len(face_boxes)) if fi not in used]
+        if not free:
+            break
+        rcx, rcy = (r[0] + r[2]) / 2, (r[1] + r[3]) / 2
+        dist = {i: np.hypot((face_boxes[i][0] + face_boxes[i][2]) / 2 - rcx,
+                            (face_boxes[i][1] + face_boxes[i][3]) / 2 - rcy) for i in free}
+        fi = min(free, key=dist.get)
+        if dist[fi] <= max_center_offset * max(r[2] - r[0], r[3] - r[1]):
+            assignment[ri] = fi
+            used.add(fi)
+    return assignment
+
 def assess_image_quality(image: np.ndarray) -> Dict[str, float]:
     """Bewertet die allgemeine Bildqualität"""
     try:
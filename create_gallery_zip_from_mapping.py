@@ -8,15 +8,17 @@ Die ZIP-Struktur entspricht den Anforderungen der Enroll-Seite:
 - etc.
 
 Für jede Region wird das Gesicht aus dem Bild ausgeschnitten und in den entsprechenden Personen-Ordner kopiert.
+Jedes Bild wird nur einmal dekodiert; die Crops werden in einem Prozess-Pool erzeugt und direkt
+in die ZIP-Datei geschrieben.
 """
 import json
 import os
 import zipfile
-import shutil
-import tempfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import cv2
-import numpy as np
-from pathlib import Path
+
+from app.image_loader import imread_reduced, reduction_factor
 
 def clean_person_name(name):
     """Bereinigt Personennamen (entfernt ':' am Anfang, etc.)"""
@@ -60,15 +62,107 @@ def extract_face_region(img, x_abs, y_abs, width_px, height_px, padding=0.1):
     
     return face_crop, (x1, y1, x2, y2)
 
-def create_gallery_zip_from_mapping(json_path, output_zip_path, extract_faces=True, min_face_size=30):
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def process_image_regions(image_path, jobs, extract_faces=True, min_crop_side=None):
+    """
+    Erzeugt alle Dateien eines Quellbilds; das Bild wird dafür genau einmal dekodiert.
+
+    jobs: Liste von (arcname, region). Liefert pro Job (arcname, Dateiinhalt oder None, Meldung).
+    """
+    if not extract_faces:
+        data = _read_bytes(image_path)
+        return [(arcname, data, f"  ✓ Bild kopiert: {arcname}") for arcname, _ in jobs]
+
+    # Reduziert dekodieren, soweit es die kleinste Region des Bildes erlaubt
+    factor = 1
+    sides = [min(r['width_px'], r['height_px']) for _, r in jobs if r.get('width_px') and r.get('height_px')]
+    if min_crop_side and sides and len(sides) == len(jobs):
+        factor = reduction_factor(min(sides), min_crop_side)
+    img = imread_reduced(image_path, factor)
+    if img is None:
+        return [(arcname, None, f"  ⚠️  Konnte Bild nicht laden: {image_path}") for arcname, _ in jobs]
+
+    results = []
+    original = None
+    for arcname, region in jobs:
+        x_abs = region.get('x_abs')
+        y_abs = region.get('y_abs')
+        width_px = region.get('width_px')
+        height_px = region.get('height_px')
+
+        if None in [x_abs, y_abs, width_px, height_px]:
+            # Falls Koordinaten fehlen, das ganze Bild übernehmen
+            original = original or _read_bytes(image_path)
+            results.append((arcname, original, f"  ℹ️  Ganze Bild kopiert (Koordinaten fehlen): {arcname}"))
+            continue
+
+        face_crop, bbox = extract_face_region(
+            img, x_abs / factor, y_abs / factor, width_px / factor, height_px / factor, padding=0.1
+        )
+        if face_crop.size == 0:
+            # Fallback: ganzes Bild übernehmen
+            original = original or _read_bytes(image_path)
+            results.append((arcname, original, f"  ⚠️  Leere Region: {arcname}"))
+            continue
+
+        crop_h, crop_w = face_crop.shape[:2]
+        # Überspringe zu kleine Crops (weniger als 50x50 Pixel)
+        if crop_h < 50 or crop_w < 50:
+            results.append((arcname, None, f"  ⚠️  Gesicht zu klein ({crop_w}x{crop_h}px): {arcname}. Überspringe."))
+            continue
+
+        ok, buf = cv2.imencode('.jpg', face_crop)
+        if not ok:
+            results.append((arcname, None, f"  ❌ Konnte Crop nicht kodieren: {arcname}"))
+            continue
+        results.append((arcname, buf.tobytes(), f"  ✓ Gesicht extrahiert: {arcname} ({crop_w}x{crop_h}px)"))
+    return results
+
+def _process_image_safe(image_path, jobs, extract_faces, min_crop_side):
+    try:
+        return process_image_regions(image_path, jobs, extract_faces, min_crop_side)
+    except Exception as e:
+        return [(arcname, None, f"  ❌ Fehler bei {image_path}: {e}") for arcname, _ in jobs]
+
+def _iter_image_results(image_jobs, extract_faces, min_crop_side, workers):
+    """Ergebnisse pro Bild, sobald sie vorliegen; höchstens 2 Bilder pro Worker gleichzeitig in Arbeit"""
+    items = list(image_jobs.items())
+    if workers <= 1:
+        for image_path, jobs in items:
+            yield _process_image_safe(image_path, jobs, extract_faces, min_crop_side)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        next_item = 0
+        while next_item < len(items) or pending:
+            while next_item < len(items) and len(pending) < 2 * workers:
+                image_path, jobs = items[next_item]
+                pending.add(pool.submit(_process_image_safe, image_path, jobs, extract_faces, min_crop_side))
+                next_item += 1
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield future.result()
+
+def create_gallery_zip_from_mapping(json_path, output_zip_path, extract_faces=True, min_face_size=30, min_crop_side=None,
+                                    workers=None, compression=zipfile.ZIP_DEFLATED):
     """
     Erstellt eine Galerie-ZIP aus einer PBF-DAMS Zuordnungs-JSON.
     
+    Jedes Quellbild wird einmal dekodiert (alle seine Regionen gemeinsam, in einem
+    Prozess-Pool), die Crops werden direkt in die ZIP-Datei geschrieben.
+
     Args:
         json_path: Pfad zur JSON-Datei
         output_zip_path: Pfad für die Ausgabe-ZIP-Datei
         extract_faces: Wenn True, schneidet Gesichter aus. Wenn False, kopiert ganze Bilder.
         min_face_size: Minimale Gesichtsgröße in Pixel
+        min_crop_side: Wenn gesetzt, werden JPEGs reduziert dekodiert (1/2, 1/4, 1/8),
+            solange die kürzere Seite der kleinsten Region mindestens so viele Pixel behält.
+        workers: Anzahl Prozesse (Standard: CPU-Kerne, 1 = ohne Pool)
+        compression: zipfile.ZIP_DEFLATED oder zipfile.ZIP_STORED (JPEGs sind bereits komprimiert)
     """
     
     print(f"Lade JSON-Datei: {json_path}")
@@ -80,11 +174,11 @@ def create_gallery_zip_from_mapping(json_path, output_zip_path, extract_faces=Tr
     images_with_regions = 0
     total_regions = 0
     unique_persons = set()
-    processed_images = {}
     skipped_regions = 0
     
-    # Sammle alle Personen und ihre Regionen
-    person_regions = {}  # person_name -> [(image_path, region_data, bbox), ...]
+    # Regionen pro Person (für Dateinamen und Übersicht) und pro Quellbild (für die Verarbeitung)
+    person_regions = {}  # person_name -> Anzahl Regionen
+    image_jobs = {}  # image_path -> [(arcname, region), ...]
     
     print(f"\nAnalysiere {total_images} Bilder...")
     
@@ -130,15 +224,12 @@ def create_gallery_zip_from_mapping(json_path, output_zip_path, extract_faces=Tr
                     skipped_regions += 1
                     continue
             
-            # Region zur Liste hinzufügen
-            if clean_name not in person_regions:
-                person_regions[clean_name] = []
-            
-            person_regions[clean_name].append({
-                'image_path': image_path,
-                'region': region,
-                'original_name': person_name
-            })
+            # Dateiname für das Gesicht: laufende Nummer pro Person
+            idx = person_regions.get(clean_name, 0)
+            person_regions[clean_name] = idx + 1
+            base_name = os.path.splitext(os.path.basename(image_path))[0]
+            arcname = f"{clean_name}/{base_name}_{idx+1:03d}.jpg"
+            image_jobs.setdefault(image_path, []).append((arcname, region))
     
     print(f"\nStatistiken:")
     print(f"  - Bilder mit Regionen: {images_with_regions}")
@@ -153,110 +244,35 @@ def create_gallery_zip_from_mapping(json_path, output_zip_path, extract_faces=Tr
     # Zeige Personen-Übersicht
     print(f"\nGefundene Personen ({len(unique_persons)}):")
     for person_name in sorted(unique_persons):
-        region_count = len(person_regions[person_name])
+        region_count = person_regions.get(person_name, 0)
         print(f"  - {person_name}: {region_count} Region(en)")
     
-    # Erstelle temporäres Verzeichnis
-    print(f"\nErstelle temporäres Verzeichnis...")
-    with tempfile.TemporaryDirectory() as tmpdir:
-        
-        # Verarbeite jede Person
-        for person_name, regions_list in person_regions.items():
-            person_dir = os.path.join(tmpdir, person_name)
-            os.makedirs(person_dir, exist_ok=True)
-            
-            print(f"\nVerarbeite {person_name} ({len(regions_list)} Regionen)...")
-            
-            for idx, region_data in enumerate(regions_list):
-                image_path = region_data['image_path']
-                region = region_data['region']
-                
-                try:
-                    # Bild laden
-                    img = cv2.imread(image_path)
-                    if img is None:
-                        print(f"  ⚠️  Konnte Bild nicht laden: {image_path}")
-                        continue
-                    
-                    # Dateiname für das Gesicht
-                    base_name = os.path.splitext(os.path.basename(image_path))[0]
-                    face_filename = f"{base_name}_{idx+1:03d}.jpg"
-                    face_path = os.path.join(person_dir, face_filename)
-                    
-                    if extract_faces:
-                        # Gesicht aus Region ausschneiden
-                        x_abs = region.get('x_abs')
-                        y_abs = region.get('y_abs')
-                        width_px = region.get('width_px')
-                        height_px = region.get('height_px')
-                        
-                        if None in [x_abs, y_abs, width_px, height_px]:
-                            # Falls Koordinaten fehlen, kopiere das ganze Bild
-                            shutil.copy2(image_path, face_path)
-                            print(f"  ℹ️  Ganze Bild kopiert (Koordinaten fehlen): {face_filename}")
-                        else:
-                            # Gesicht ausschneiden
-                            face_crop, bbox = extract_face_region(
-                                img, x_abs, y_abs, width_px, height_px, padding=0.1
-                            )
-                            
-                            if face_crop.size > 0:
-                                crop_h, crop_w = face_crop.shape[:2]
-                                # Überspringe zu kleine Crops (weniger als 50x50 Pixel)
-                                if crop_h < 50 or crop_w < 50:
-                                    print(f"  ⚠️  Gesicht zu klein ({crop_w}x{crop_h}px): {face_filename}. Überspringe.")
-                                    continue
-                                
-                                cv2.imwrite(face_path, face_crop)
-                                print(f"  ✓ Gesicht extrahiert: {face_filename} ({crop_w}x{crop_h}px)")
-                            else:
-                                print(f"  ⚠️  Leere Region: {face_filename}")
-                                # Fallback: Kopiere ganzes Bild
-                                shutil.copy2(image_path, face_path)
-                    else:
-                        # Kopiere das ganze Bild
-                        shutil.copy2(image_path, face_path)
-                        print(f"  ✓ Bild kopiert: {face_filename}")
-                
-                except Exception as e:
-                    print(f"  ❌ Fehler bei {image_path}: {e}")
+    # Bilder verarbeiten und direkt in die ZIP schreiben
+    workers = workers or os.cpu_count() or 1
+    print(f"\nErstelle ZIP-Datei: {output_zip_path} ({len(image_jobs)} Bilder, {workers} Prozess(e))")
+    files_per_person = Counter()
+    written_bytes = 0
+    failed = 0
+    with zipfile.ZipFile(output_zip_path, 'w', compression) as zipf:
+        for results in _iter_image_results(image_jobs, extract_faces, min_crop_side, workers):
+            for arcname, content, message in results:
+                print(message)
+                if content is None:
+                    failed += 1
                     continue
-        
-        # Erstelle ZIP-Datei
-        print(f"\nErstelle ZIP-Datei: {output_zip_path}")
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(tmpdir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # Relativer Pfad innerhalb der ZIP
-                    arcname = os.path.relpath(file_path, tmpdir)
-                    zipf.write(file_path, arcname)
-                    print(f"  + {arcname}")
-        
-        # Statistiken nach Verarbeitung
-        print(f"\n✅ ZIP-Datei erstellt: {output_zip_path}")
-        
-        # Prüfe was in der ZIP ist
-        with zipfile.ZipFile(output_zip_path, 'r') as zipf:
-            file_list = zipf.namelist()
-            persons_in_zip = set()
-            total_files = 0
-            
-            for file_path in file_list:
-                if '/' in file_path:
-                    person_name = file_path.split('/')[0]
-                    persons_in_zip.add(person_name)
-                    total_files += 1
-            
-            print(f"\nZIP-Inhalt:")
-            print(f"  - Personen: {len(persons_in_zip)}")
-            print(f"  - Dateien gesamt: {total_files}")
-            
-            for person_name in sorted(persons_in_zip):
-                person_files = [f for f in file_list if f.startswith(f"{person_name}/")]
-                print(f"  - {person_name}: {len(person_files)} Datei(en)")
-        
-        return True
+                zipf.writestr(arcname, content)
+                files_per_person[arcname.split('/')[0]] += 1
+                written_bytes += len(content)
+    
+    print(f"\n✅ ZIP-Datei erstellt: {output_zip_path}")
+    print(f"\nZIP-Inhalt:")
+    print(f"  - Personen: {len(files_per_person)}")
+    print(f"  - Dateien gesamt: {sum(files_per_person.values())} ({written_bytes / 2**20:.1f} MB unkomprimiert)")
+    print(f"  - Übersprungen/fehlgeschlagen: {failed}")
+    for person_name in sorted(files_per_person):
+        print(f"  - {person_name}: {files_per_person[person_name]} Datei(en)")
+    
+    return True
 
 def main():
     import argparse
@@ -291,6 +307,23 @@ def main():
         default=30,
         help='Minimale Gesichtsgröße in Pixel (Standard: 30)'
     )
+    parser.add_argument(
+        '--min-crop-side',
+        type=int,
+        default=None,
+        help='JPEGs reduziert dekodieren, solange die Region mindestens so viele Pixel behält (z.B. 256)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Anzahl paralleler Prozesse (Standard: Anzahl CPU-Kerne)'
+    )
+    parser.add_argument(
+        '--store',
+        action='store_true',
+        help='Dateien ohne Deflate speichern (JPEGs sind bereits komprimiert; schneller)'
+    )
     
     args = parser.parse_args()
     
@@ -300,7 +333,10 @@ def main():
         json_path=args.json_path,
         output_zip_path=args.output,
         extract_faces=extract_faces,
-        min_face_size=args.min_face_size
+        min_face_size=args.min_face_size,
+        min_crop_side=args.min_crop_side,
+        workers=args.workers,
+        compression=zipfile.ZIP_STORED if args.store else zipfile.ZIP_DEFLATED
     )
     
     if success:
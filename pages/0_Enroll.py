@@ -9,7 +9,8 @@ import sys
 # Füge app-Verzeichnis zum Python-Pfad hinzu
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
 
-from app.face_recognizer import FaceEngine, GalleryDB
+from app.face_recognizer import GalleryDB, get_face_engine
+from app.image_loader import iter_zip_images
 from app.location import extract_comprehensive_metadata
 from streamlit_styles import apply_custom_css
 
@@ -24,7 +25,7 @@ with st.sidebar:
     extract_exif = st.checkbox("EXIF-Metadaten extrahieren", value=False, help="Erfasst Kamera-Daten, GPS und Zeitstempel für verbesserte Erkennung")
 
 if "engine_enroll" not in st.session_state or st.session_state.get("det_enroll") != det:
-    st.session_state["engine_enroll"] = FaceEngine(det_size=(det, det))
+    st.session_state["engine_enroll"] = get_face_engine(det_size=(det, det))
     st.session_state["det_enroll"] = det
 
 tab_zip, tab_manual, tab_converted, tab_pbf_processor, tab_mapping = st.tabs(["Galerie-ZIP hochladen", "Manuell pro Person", "Aus konvertierten Daten", "PBF-DAMS Processor", "Aus Zuordnungs-Datei"])
@@ -34,83 +35,79 @@ with tab_zip:
     st.markdown("*Hinweis: Wenn EXIF-Metadaten aktiviert sind, werden auch Bilder ohne erkannte Gesichter verarbeitet.*")
     zip_file = st.file_uploader("Galerie-ZIP auswählen", type=["zip"])
     if zip_file is not None:
-        with tempfile.TemporaryDirectory() as tmpdir:
-            z = zipfile.ZipFile(zip_file)
-            z.extractall(tmpdir)
-            db = GalleryDB()
-            count_imgs = 0
-            exif_count = 0
-            faces_found = 0
-            no_faces_with_exif = 0
-            for root, dirs, files in os.walk(tmpdir):
-                for fn in files:
-                    if fn.lower().endswith((".jpg",".jpeg",".png",".bmp",".webp",".tif",".tiff")):
-                        p = os.path.join(root, fn)
-                        img = cv2.imread(p)
-                        if img is None:
-                            continue
-                        
-                        # Prüfe Bildgröße - OpenCV benötigt gültige Dimensionen
-                        h, w = img.shape[:2]
-                        if h < 50 or w < 50:
-                            st.warning(f"Bild zu klein ({w}x{h}px): {fn}. Überspringe.")
-                            continue
-                        
-                        try:
-                            faces = st.session_state["engine_enroll"].analyze(img)
-                        except Exception as e:
-                            st.warning(f"Fehler beim Analysieren von {fn}: {e}. Überspringe.")
-                            continue
-                        person = os.path.basename(os.path.dirname(p))
-                        
-                        # EXIF-Metadaten extrahieren wenn aktiviert
-                        metadata = None
-                        if extract_exif:
-                            try:
-                                exif_data = extract_comprehensive_metadata(p)
-                                if exif_data:
-                                    metadata = {
-                                        'exif': exif_data,
-                                        'source_image': fn
-                                    }
-                                    exif_count += 1
-                            except Exception as e:
-                                pass
-                        
-                        # Gesichter gefunden - wie bisher verarbeiten
-                        if faces:
-                            faces.sort(key=lambda f: (f['bbox'][2]-f['bbox'][0])*(f['bbox'][3]-f['bbox'][1]), reverse=True)
-                            if extract_exif and metadata:
-                                # Erweitere Metadaten mit Gesichtsattributen
-                                metadata.update({
-                                    'age': faces[0].get('age'),
-                                    'gender': faces[0].get('gender'),
-                                    'quality_score': faces[0].get('quality_score'),
-                                    'emotion': faces[0].get('emotion'),
-                                    'eye_status': faces[0].get('eye_status'),
-                                    'mouth_status': faces[0].get('mouth_status')
-                                })
-                            db.add(person, faces[0]["embedding"], metadata)
-                            faces_found += 1
-                            count_imgs += 1
-                        # Keine Gesichter, aber EXIF-Daten vorhanden
-                        elif extract_exif and metadata:
-                            # Erstelle Dummy-Embedding für Metadaten-Speicherung
-                            dummy_embedding = np.zeros((512,), dtype=np.float32)
-                            db.add(person, dummy_embedding, metadata)
-                            no_faces_with_exif += 1
-                            count_imgs += 1
+        # Mitglieder einzeln lesen und im Speicher dekodieren: kein Entpacken in ein Temp-Verzeichnis
+        z = zipfile.ZipFile(zip_file)
+        db = GalleryDB()
+        count_imgs = 0
+        exif_count = 0
+        faces_found = 0
+        no_faces_with_exif = 0
+        for info, data, img in iter_zip_images(z):
+            fn = os.path.basename(info.filename)
+            if img is None:
+                continue
             
-            success_msg = f"Verarbeitet: {count_imgs} Bild(er), davon {faces_found} mit Gesichtern"
+            # Prüfe Bildgröße - OpenCV benötigt gültige Dimensionen
+            h, w = img.shape[:2]
+            if h < 50 or w < 50:
+                st.warning(f"Bild zu klein ({w}x{h}px): {fn}. Überspringe.")
+                continue
+            
+            try:
+                faces = st.session_state["engine_enroll"].analyze(img)
+            except Exception as e:
+                st.warning(f"Fehler beim Analysieren von {fn}: {e}. Überspringe.")
+                continue
+            person = os.path.basename(os.path.dirname(info.filename))
+            
+            # EXIF-Metadaten extrahieren wenn aktiviert
+            metadata = None
             if extract_exif:
-                success_msg += f", {exif_count} mit EXIF-Metadaten"
-                if no_faces_with_exif > 0:
-                    success_msg += f" ({no_faces_with_exif} ohne Gesichter)"
-            st.success(success_msg)
+                try:
+                    exif_data = extract_comprehensive_metadata(data)
+                    if exif_data:
+                        metadata = {
+                            'exif': exif_data,
+                            'source_image': fn
+                        }
+                        exif_count += 1
+                except Exception as e:
+                    pass
             
-            b = io.BytesIO()
-            pickle.dump({"people": db.people, "metadata": db.face_metadata}, b, protocol=pickle.HIGHEST_PROTOCOL)
-            st.download_button("embeddings.pkl herunterladen", data=b.getvalue(), file_name="embeddings.pkl", mime="application/octet-stream")
+            # Gesichter gefunden - wie bisher verarbeiten
+            if faces:
+                faces.sort(key=lambda f: (f['bbox'][2]-f['bbox'][0])*(f['bbox'][3]-f['bbox'][1]), reverse=True)
+                if extract_exif and metadata:
+                    # Erweitere Metadaten mit Gesichtsattributen
+                    metadata.update({
+                        'age': faces[0].get('age'),
+                        'gender': faces[0].get('gender'),
+                        'quality_score': faces[0].get('quality_score'),
+                        'emotion': faces[0].get('emotion'),
+                        'eye_status': faces[0].get('eye_status'),
+                        'mouth_status': faces[0].get('mouth_status')
+                    })
+                db.add(person, faces[0]["embedding"], metadata)
+                faces_found += 1
+                count_imgs += 1
+            # Keine Gesichter, aber EXIF-Daten vorhanden
+            elif extract_exif and metadata:
+                # Erstelle Dummy-Embedding für Metadaten-Speicherung
+                dummy_embedding = np.zeros((512,), dtype=np.float32)
+                db.add(person, dummy_embedding, metadata)
+                no_faces_with_exif += 1
+                count_imgs += 1
+
+        success_msg = f"Verarbeitet: {count_imgs} Bild(er), davon {faces_found} mit Gesichtern"
+        if extract_exif:
+            success_msg += f", {exif_count} mit EXIF-Metadaten"
+            if no_faces_with_exif > 0:
+                success_msg += f" ({no_faces_with_exif} ohne Gesichter)"
+        st.success(success_msg)
+        
+        b = io.BytesIO()
+        pickle.dump({"people": db.people, "metadata": db.face_metadata}, b, protocol=pickle.HIGHEST_PROTOCOL)
+        st.download_button("embeddings.pkl herunterladen", data=b.getvalue(), file_name="embeddings.pkl", mime="application/octet-stream")
 
 with tab_manual:
     st.markdown("Name eingeben, Bilder hochladen, **Hinzufügen** klicken.")
@@ -200,9 +197,14 @@ with tab_manual:
         st.success(msg)
     if st.session_state["manual_db"].people:
         st.info(f"Aktueller DB-Status: {len(st.session_state['manual_db'].people)} Personen.")
-        b = io.BytesIO()
-        pickle.dump({"people": st.session_state["manual_db"].people, "metadata": st.session_state["manual_db"].face_metadata}, b, protocol=pickle.HIGHEST_PROTOCOL)
-        st.download_button("embeddings.pkl herunterladen", data=b.getvalue(), file_name="embeddings.pkl", mime="application/octet-stream")
+        # Nur neu serialisieren, wenn sich die DB seit dem letzten Rerun geändert hat
+        manual_db = st.session_state["manual_db"]
+        if st.session_state.get("manual_db_bytes_revision") != (id(manual_db), manual_db.revision):
+            b = io.BytesIO()
+            pickle.dump({"people": manual_db.people, "metadata": manual_db.face_metadata}, b, protocol=pickle.HIGHEST_PROTOCOL)
+            st.session_state["manual_db_bytes"] = b.getvalue()
+            st.session_state["manual_db_bytes_revision"] = (id(manual_db), manual_db.revision)
+        st.download_button("embeddings.pkl herunterladen", data=st.session_state["manual_db_bytes"], file_name="embeddings.pkl", mime="application/octet-stream")
 
 with tab_converted:
     st.markdown("**Daten aus PBF-DAMS:**")
@@ -576,50 +578,49 @@ with tab_pbf_processor:
                                         continue
                                     
                                     try:
-                                        faces = st.session_state["engine_enroll"].analyze(img)
+                                        faces = st.session_state["engine_enroll"].analyze(img, min_quality=face_threshold)
                                     except Exception as e:
                                         st.warning(f"Fehler beim Analysieren von {os.path.basename(image_path)}: {e}")
                                         continue
                                     
-                                    for face in faces:
-                                        if face.get('quality_score', 0.5) >= face_threshold:
-                                            total_faces += 1
-                                            
-                                            # Automatische Personenerkennung
-                                            recognized_name, similarity = reference_db.match(
-                                                face['embedding'], 
-                                                threshold=recognition_threshold
-                                            )
-                                            
-                                            # Gesicht ausschneiden für Vorschau
-                                            bbox = face['bbox']
-                                            x1, y1, x2, y2 = map(int, bbox)
-                                            face_crop = img[y1:y2, x1:x2]
-                                            face_rgb = cv2.cvtColor(face_crop, cv2.COLOR_BGR2RGB)
-                                            
-                                            if recognized_name:
-                                                recognized_count += 1
-                                                recognition_stats[recognized_name] = recognition_stats.get(recognized_name, 0) + 1
-                                                final_name = recognized_name
-                                                status = "recognized"
-                                            else:
-                                                unknown_count += 1
-                                                final_name = f"Unknown_{unknown_count}"
-                                                status = "unknown"
-                                                similarity = 0.0
-                                            
-                                            st.session_state.recognized_faces.append({
-                                                'image_path': image_path,
-                                                'embedding': face['embedding'],
-                                                'face_image': face_rgb,
-                                                'quality': face.get('quality_score', 0.5),
-                                                'age': face.get('age'),
-                                                'gender': face.get('gender'),
-                                                'bbox': bbox,
-                                                'recognized_name': final_name,
-                                                'similarity': similarity,
-                                                'status': status
-                                            })
+                                    faces = [face for face in faces if face.get('quality_score', 0.5) >= face_threshold]
+                                    # Automatische Personenerkennung für alle Gesichter des Bildes in einem Aufruf
+                                    matches = reference_db.match_many([face['embedding'] for face in faces], k=1,
+                                                                      threshold=recognition_threshold)
+                                    for face, hits in zip(faces, matches):
+                                        total_faces += 1
+                                        
+                                        recognized_name, similarity = hits[0]
+                                        
+                                        # Gesicht ausschneiden für Vorschau
+                                        bbox = face['bbox']
+                                        x1, y1, x2, y2 = map(int, bbox)
+                                        face_crop = img[y1:y2, x1:x2]
+                                        face_rgb = cv2.cvtColor(face_crop, cv2.COLOR_BGR2RGB)
+                                        
+                                        if recognized_name:
+                                            recognized_count += 1
+                                            recognition_stats[recognized_name] = recognition_stats.get(recognized_name, 0) + 1
+                                            final_name = recognized_name
+                                            status = "recognized"
+                                        else:
+                                            unknown_count += 1
+                                            final_name = f"Unknown_{unknown_count}"
+                                            status = "unknown"
+                                            similarity = 0.0
+                                        
+                                        st.session_state.recognized_faces.append({
+                                            'image_path': image_path,
+                                            'embedding': face['embedding'],
+                                            'face_image': face_rgb,
+                                            'quality': face.get('quality_score', 0.5),
+                                            'age': face.get('age'),
+                                            'gender': face.get('gender'),
+                                            'bbox': bbox,
+                                            'recognized_name': final_name,
+                                            'similarity': similarity,
+                                            'status': status
+                                        })
                                 
                                 processed += 1
                             
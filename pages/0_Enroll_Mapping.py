@@ -3,7 +3,7 @@ PBF-DAMS Mapping zu Embeddings Converter
 
 Erstellt Embeddings direkt aus PBF-DAMS-Zuordnungsdateien mit vorhandenen Personen-Namen und Koordinaten.
 """
-import io, os, pickle
+import io, os, pickle, time
 import streamlit as st
 import numpy as np
 import cv2
@@ -13,7 +13,8 @@ import json
 # Füge app-Verzeichnis zum Python-Pfad hinzu
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
 
-from app.face_recognizer import FaceEngine, GalleryDB
+from app.face_recognizer import GalleryDB, get_face_engine
+from app.utils import assign_regions_to_faces
 from streamlit_styles import apply_custom_css
 
 # Wende kleinere Schriftgrößen an
@@ -24,10 +25,23 @@ st.caption("Erstellt Embeddings direkt aus PBF-DAMS-Zuordnungsdateien mit vorhan
 
 with st.sidebar:
     det = st.slider("Detector size", 320, 1024, 640, 64)
+    profile = st.selectbox(
+        "Analyseprofil",
+        ["detect+embed", "full"],
+        index=0,
+        help="'detect+embed' berechnet nur Embeddings (schnell). 'full' ergänzt Alter, Geschlecht und Qualität in den Metadaten."
+    )
+    region_guided = st.checkbox(
+        "Nur in Regionen suchen",
+        value=False,
+        help="Detektiert nur in gepolsterten Ausschnitten um die bekannten Regionen statt im ganzen Bild (schneller bei großen Bildern)"
+    )
 
-if "engine_mapping" not in st.session_state or st.session_state.get("det_mapping") != det:
-    st.session_state["engine_mapping"] = FaceEngine(det_size=(det, det))
+if ("engine_mapping" not in st.session_state or st.session_state.get("det_mapping") != det
+        or st.session_state.get("profile_mapping") != profile):
+    st.session_state["engine_mapping"] = get_face_engine(det_size=(det, det), profile=profile)
     st.session_state["det_mapping"] = det
+    st.session_state["profile_mapping"] = profile
 
 st.success("""
 **Perfekt für Ihre faces_20251127_141817.json!**
@@ -130,6 +144,8 @@ if mapping_file is not None:
             if st.button("Embeddings aus Zuordnungen erstellen", key="create_from_pbf_mapping"):
                 progress_bar = st.progress(0)
                 status_text = st.empty()
+                throughput_text = st.empty()
+                engine = st.session_state["engine_mapping"]
                 
                 db = GalleryDB()
                 processed_regions = 0
@@ -137,7 +153,10 @@ if mapping_file is not None:
                 errors = 0
                 filtered_too_small = 0
                 filtered_no_coords = 0
+                unmatched_regions = 0
+                images_analyzed = 0
                 person_counts = {}
+                t_start = time.perf_counter()
                 
                 for img_idx, item in enumerate(data):
                     if processed_regions >= max_regions:
@@ -155,163 +174,117 @@ if mapping_file is not None:
                     status_text.text(f"Verarbeite Bild {img_idx+1}/{total_images}: {os.path.basename(image_path)}")
                     
                     # Bild laden
-                    if os.path.exists(image_path):
-                        img = cv2.imread(image_path)
-                        if img is None:
+                    if not os.path.exists(image_path):
+                        continue
+                    img = cv2.imread(image_path)
+                    if img is None:
+                        continue
+                    
+                    # Prüfe Bildgröße - OpenCV benötigt gültige Dimensionen
+                    h_img, w_img = img.shape[:2]
+                    if h_img < 50 or w_img < 50:
+                        continue
+                    
+                    # Regionen des Bildes sammeln und filtern (noch ohne Analyse)
+                    pending = []  # (person_name, region, [x1, y1, x2, y2])
+                    for region in regions:
+                        if processed_regions + len(pending) >= max_regions:
+                            break
+                        if not isinstance(region, dict):
+                            continue
+                        
+                        # Person-Name extrahieren
+                        person_name = region.get('name')
+                        if not person_name:
+                            continue
+                        
+                        # Name bereinigen
+                        if clean_names and person_name.startswith(':'):
+                            person_name = person_name[1:]
+                        
+                        # Koordinaten extrahieren
+                        x_abs = region.get('x_abs')
+                        y_abs = region.get('y_abs')
+                        width_px = region.get('width_px')
+                        height_px = region.get('height_px')
+                        
+                        if None in [x_abs, y_abs, width_px, height_px]:
+                            filtered_no_coords += 1
                             continue
                         
-                        # Prüfe Bildgröße - OpenCV benötigt gültige Dimensionen
-                        h_img, w_img = img.shape[:2]
-                        if h_img < 50 or w_img < 50:
+                        # Größenfilter
+                        if width_px < min_region_size or height_px < min_region_size:
+                            filtered_too_small += 1
                             continue
                         
-                        for region in regions:
-                            if processed_regions >= max_regions:
-                                break
-                            
-                            try:
-                                if not isinstance(region, dict):
-                                    continue
-                                
-                                # Person-Name extrahieren
-                                person_name = region.get('name')
-                                if not person_name:
-                                    continue
-                                
-                                # Name bereinigen
-                                if clean_names and person_name.startswith(':'):
-                                    person_name = person_name[1:]
-                                
-                                # Koordinaten extrahieren
-                                x_abs = region.get('x_abs')
-                                y_abs = region.get('y_abs')
-                                width_px = region.get('width_px')
-                                height_px = region.get('height_px')
-                                
-                                if None in [x_abs, y_abs, width_px, height_px]:
-                                    filtered_no_coords += 1
-                                    continue
-                                
-                                # Größenfilter
-                                if width_px < min_region_size or height_px < min_region_size:
-                                    filtered_too_small += 1
-                                    continue
-                                
-                                # Bounding Box berechnen
-                                x1 = int(x_abs)
-                                y1 = int(y_abs)
-                                x2 = int(x_abs + width_px)
-                                y2 = int(y_abs + height_px)
-                                
-                                # Grenzen prüfen
-                                h, w = img.shape[:2]
-                                x1 = max(0, min(x1, w-1))
-                                y1 = max(0, min(y1, h-1))
-                                x2 = max(x1+1, min(x2, w))
-                                y2 = max(y1+1, min(y2, h))
-                                
-                                # Gesicht ausschneiden für Vorschau
-                                face_crop = img[y1:y2, x1:x2]
-                                
-                                if face_crop.size > 0:
-                                    # WICHTIG: Analysiere das VOLLSTÄNDIGE Bild, nicht den Crop
-                                    # Dies stellt sicher, dass die Embeddings kompatibel sind
-                                    try:
-                                        faces = st.session_state["engine_mapping"].analyze(img)
-                                    except Exception as e:
-                                        errors += 1
-                                        if errors <= 3:
-                                            st.error(f"Fehler beim Analysieren von {os.path.basename(image_path)}: {e}")
-                                        continue
-                                    
-                                    if faces and len(faces) > 0:
-                                        # Finde das Gesicht, das am besten zu den Koordinaten passt
-                                        best_face = None
-                                        best_overlap = 0
-                                        
-                                        target_center_x = (x1 + x2) / 2
-                                        target_center_y = (y1 + y2) / 2
-                                        
-                                        for face in faces:
-                                            fx1, fy1, fx2, fy2 = face['bbox']
-                                            face_center_x = (fx1 + fx2) / 2
-                                            face_center_y = (fy1 + fy2) / 2
-                                            
-                                            # Berechne Überlappung der Bounding Boxen
-                                            overlap_x = max(0, min(x2, fx2) - max(x1, fx1))
-                                            overlap_y = max(0, min(y2, fy2) - max(y1, fy1))
-                                            overlap_area = overlap_x * overlap_y
-                                            
-                                            # Berechne Fläche der Region
-                                            region_area = (x2 - x1) * (y2 - y1)
-                                            
-                                            # Berechne IoU (Intersection over Union)
-                                            if region_area > 0:
-                                                iou = overlap_area / region_area
-                                                if iou > best_overlap:
-                                                    best_overlap = iou
-                                                    best_face = face
-                                        
-                                        # Falls kein überlappendes Gesicht gefunden, nimm das Gesicht mit dem geringsten Abstand zum Zentrum
-                                        if best_face is None or best_overlap < 0.1:
-                                            best_face = None
-                                            min_distance = float('inf')
-                                            for face in faces:
-                                                fx1, fy1, fx2, fy2 = face['bbox']
-                                                face_center_x = (fx1 + fx2) / 2
-                                                face_center_y = (fy1 + fy2) / 2
-                                                
-                                                distance = np.sqrt((face_center_x - target_center_x)**2 + (face_center_y - target_center_y)**2)
-                                                if distance < min_distance:
-                                                    min_distance = distance
-                                                    best_face = face
-                                        
-                                        # Falls immer noch kein Gesicht gefunden, nimm das beste basierend auf Qualität
-                                        if best_face is None:
-                                            best_face = max(faces, key=lambda f: f.get('quality_score', 0))
-                                        
-                                        # Metadaten erstellen
-                                        metadata = {
-                                            'source_image': os.path.basename(image_path),
-                                            'source': 'pbf_dams_mapping',
-                                            'bbox': [x1, y1, x2, y2],
-                                            'region_type': region.get('type'),
-                                            'quality_score': best_face.get('quality_score'),
-                                            'age': best_face.get('age'),
-                                            'gender': best_face.get('gender'),
-                                            'original_coords': {
-                                                'x_rel': region.get('x_rel'),
-                                                'y_rel': region.get('y_rel'),
-                                                'width_rel': region.get('width_rel'),
-                                                'height_rel': region.get('height_rel')
-                                            }
-                                        }
-                                        
-                                        # Prüfe Embedding-Format
-                                        embedding = best_face['embedding']
-                                        if not isinstance(embedding, np.ndarray):
-                                            embedding = np.array(embedding, dtype=np.float32)
-                                        
-                                        # Normalisiere Embedding für Konsistenz
-                                        embedding = embedding.astype(np.float32)
-                                        embedding_norm = np.linalg.norm(embedding)
-                                        if embedding_norm > 0:
-                                            embedding = embedding / embedding_norm
-                                        
-                                        db.add(person_name, embedding, metadata)
-                                        successful_embeddings += 1
-                                        person_counts[person_name] = person_counts.get(person_name, 0) + 1
-                                
-                                processed_regions += 1
-                                
-                            except Exception as e:
-                                errors += 1
-                                if errors <= 3:  # Zeige nur erste 3 Fehler
-                                    st.error(f"Fehler bei Region in {os.path.basename(image_path)}: {e}")
+                        # Bounding Box berechnen und auf Bildgrenzen beschränken
+                        x1 = max(0, min(int(x_abs), w_img-1))
+                        y1 = max(0, min(int(y_abs), h_img-1))
+                        x2 = max(x1+1, min(int(x_abs + width_px), w_img))
+                        y2 = max(y1+1, min(int(y_abs + height_px), h_img))
+                        pending.append((person_name, region, [x1, y1, x2, y2]))
                     
-                    # Progress aktualisieren
-                    progress = min(processed_regions / max_regions, (img_idx + 1) / total_images)
-                    progress_bar.progress(progress)
+                    if not pending:
+                        continue
+                    
+                    # Einmalige Analyse pro Bild, danach Zuordnung aller Regionen
+                    boxes = [bbox for _, _, bbox in pending]
+                    try:
+                        if region_guided:
+                            region_faces = engine.analyze_regions(img, boxes)
+                        else:
+                            faces = engine.analyze(img)
+                            assignment = assign_regions_to_faces(boxes, [f['bbox'] for f in faces])
+                            region_faces = [faces[i] if i is not None else None for i in assignment]
+                    except Exception as e:
+                        errors += 1
+                        if errors <= 3:  # Zeige nur erste 3 Fehler
+                            st.error(f"Fehler beim Analysieren von {os.path.basename(image_path)}: {e}")
+                        continue
+                    
+                    images_analyzed += 1
+                    processed_regions += len(pending)
+                    
+                    for (person_name, region, bbox), face in zip(pending, region_faces):
+                        if face is None:
+                            unmatched_regions += 1
+                            continue
+                        
+                        # Metadaten erstellen
+                        metadata = {
+                            'source_image': os.path.basename(image_path),
+                            'source': 'pbf_dams_mapping',
+                            'bbox': bbox,
+                            'region_type': region.get('type'),
+                            'quality_score': face.get('quality_score'),
+                            'age': face.get('age'),
+                            'gender': face.get('gender'),
+                            'original_coords': {
+                                'x_rel': region.get('x_rel'),
+                                'y_rel': region.get('y_rel'),
+                                'width_rel': region.get('width_rel'),
+                                'height_rel': region.get('height_rel')
+                            }
+                        }
+                        
+                        # Normalisiere Embedding für Konsistenz
+                        embedding = np.asarray(face['embedding'], dtype=np.float32)
+                        embedding_norm = np.linalg.norm(embedding)
+                        if embedding_norm > 0:
+                            embedding = embedding / embedding_norm
+                        
+                        db.add(person_name, embedding, metadata)
+                        successful_embeddings += 1
+                        person_counts[person_name] = person_counts.get(person_name, 0) + 1
+                    
+                    # Progress und Durchsatz aktualisieren
+                    progress = max(processed_regions / max_regions, (img_idx + 1) / total_images)
+                    progress_bar.progress(min(progress, 1.0))
+                    elapsed = max(time.perf_counter() - t_start, 1e-6)
+                    throughput_text.text(
+                        f"{images_analyzed} Bilder analysiert · {processed_regions} Regionen · "
+                        f"{images_analyzed / elapsed:.2f} Bilder/s · {processed_regions / elapsed:.1f} Regionen/s"
+                    )
                 
                 status_text.text("Verarbeitung abgeschlossen!")
                 
@@ -363,6 +336,8 @@ if mapping_file is not None:
                         st.write(f"- Herausgefiltert (fehlende Koordinaten): {filtered_no_coords} Regionen")
                         if filtered_too_small > 0:
                             st.warning(f"💡 **Tipp:** {filtered_too_small} Regionen wurden herausgefiltert, weil sie kleiner als {min_region_size} Pixel sind. Setzen Sie den Wert niedriger (z.B. 30 Pixel) für mehr Ergebnisse.")
+                    if unmatched_regions > 0:
+                        st.write(f"- Kein passendes Gesicht erkannt: {unmatched_regions} Regionen")
                 
                 else:
                     st.error("Keine Embeddings erfolgreich erstellt.")
@@ -376,6 +351,8 @@ if mapping_file is not None:
                         st.metric("Fehlende Koordinaten", filtered_no_coords)
                     with col3:
                         st.metric("Verarbeitungsfehler", errors)
+                    if unmatched_regions > 0:
+                        st.warning(f"In {unmatched_regions} Regionen wurde kein passendes Gesicht erkannt.")
                     
                     if filtered_too_small > 0:
                         st.error(f"**Hauptproblem:** {filtered_too_small} Regionen wurden herausgefiltert, weil Min. Regionsgröße ({min_region_size} Pixel) zu hoch ist!")
@@ -14,7 +14,8 @@ import joblib
 # Füge app-Verzeichnis zum Python-Pfad hinzu
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
 
-from app.face_recognizer import FaceEngine, GalleryDB
+from app.face_recognizer import GalleryDB, get_face_engine
+from app.gallery_store import MANIFEST_FILE, is_binary_gallery
 from app.location import extract_exif_gps, reverse_geocode, extract_comprehensive_metadata, get_location_details
 from streamlit_styles import apply_custom_css
 
@@ -80,6 +81,12 @@ with st.sidebar:
     # Datei-Upload
     st.subheader("Dateien")
     gallery_file = st.file_uploader("Embeddings DB (embeddings.pkl)", type=["pkl"], key="db_upload")
+    gallery_path = st.text_input(
+        "oder Galerie auf dem Server (.gallery)",
+        value="",
+        key="db_server_path",
+        help="Pfad zu einer mit 'convert-db' erzeugten Binärgalerie. Sie wird per memmap geöffnet und von allen Sitzungen gemeinsam genutzt."
+    ).strip()
     training_identity_file = st.file_uploader(
         "Trainings-Identitäten (JSON/PKL)",
         type=["json", "pkl"],
@@ -100,20 +107,36 @@ with st.sidebar:
     """)
 
 if "engine_annot" not in st.session_state or st.session_state.get("det_annot_state") != det:
-    st.session_state["engine_annot"] = FaceEngine(det_size=(det, det))
+    st.session_state["engine_annot"] = get_face_engine(det_size=(det, det))
     st.session_state["det_annot_state"] = det
 
 TRAINING_EMBEDDING_KEYS = ["embedding", "face_embedding", "vector", "face_vector"]
 TRAINING_NAME_KEYS = ["identifier", "person_identifier", "name", "label", "person_label"]
 
 
-def merge_gallery_databases(target: GalleryDB, source: GalleryDB):
-    """Fügt alle Personen aus source in target ein."""
+@st.cache_resource(show_spinner=False)
+def load_shared_gallery(path: str, snapshot_mtime: int) -> GalleryDB:
+    """Öffnet eine Binärgalerie einmal pro Prozess; snapshot_mtime lädt nach einem Neuschreiben neu"""
+    return GalleryDB.load(path)
+
+
+def copy_gallery(source: GalleryDB) -> GalleryDB:
+    """Eigene, veränderbare Kopie (die geteilte Galerie darf nicht verändert werden)"""
+    gallery = GalleryDB(precision=source.precision)
+    gallery.people = {name: list(embs) for name, embs in source.people.items()}
+    gallery.face_metadata = {name: list(items) for name, items in source.face_metadata.items()}
+    return gallery
+
+
+def merge_gallery_databases(target: GalleryDB, source: GalleryDB, dedup_threshold: float = 0.98,
+                            max_per_identity: Optional[int] = None) -> Dict[str, Any]:
+    """Fügt alle Personen aus source in target ein und entfernt dabei Beinahe-Duplikate."""
     for name, embeddings in source.people.items():
         for emb in embeddings:
             target.add(name, emb)
         if name in source.face_metadata:
             target.face_metadata.setdefault(name, []).extend(source.face_metadata[name])
+    return target.deduplicate(dedup_threshold, max_per_identity, names=list(source.people.keys()))
 
 
 def _extract_person_name(person: Dict[str, Any]) -> Optional[str]:
@@ -437,13 +460,33 @@ if gallery_file is not None:
         st.error(f"Fehler beim Laden der Embeddings: {e}")
         st.info("Mögliche Ursachen: Datei ist beschädigt, falsches Format, oder Datei ist leer.")
 
+shared_db = False
+if db is None and gallery_path:
+    if not is_binary_gallery(gallery_path):
+        st.error(f"Keine Binärgalerie gefunden: {gallery_path}")
+    else:
+        try:
+            manifest_mtime = os.stat(os.path.join(gallery_path, MANIFEST_FILE)).st_mtime_ns
+            db = load_shared_gallery(gallery_path, manifest_mtime)
+            shared_db = True
+            st.success(f"Server-Galerie geladen: {len(db.people)} Personen ({db.precision}, memory-mapped).")
+        except Exception as e:
+            st.error(f"Fehler beim Laden der Server-Galerie: {e}")
+
 if training_identity_file is not None:
     training_db = load_training_identity_file(training_identity_file)
     if training_db:
         if db is None:
             db = training_db
         else:
-            merge_gallery_databases(db, training_db)
+            if shared_db:
+                db = copy_gallery(db)
+                shared_db = False
+            dedup_report = merge_gallery_databases(db, training_db)
+            removed = dedup_report["duplicates_removed"] + dedup_report["capped_removed"]
+            if removed:
+                st.info(f"Beim Zusammenführen {removed} nahezu identische Embeddings entfernt "
+                        f"({dedup_report['before']} → {dedup_report['after']}).")
         total_identities = sum(len(v) for v in training_db.people.values())
         st.success(f"Trainings-Identitäten geladen ({len(training_db.people)} Personen / {total_identities} Embeddings).")
         st.info("Diese Personen wurden im Train-Modul gelernt und können jetzt automatisch erkannt werden.")
@@ -940,7 +983,8 @@ if files:
             faces = enhanced_engine.analyze_with_metadata(img_bgr, extract_comprehensive_metadata(image))
         else:
             # Standard Engine verwenden
-            faces = st.session_state["engine_annot"].analyze(img_bgr)
+            # Größen- und Qualitätsfilter vor der Recognition anwenden
+            faces = st.session_state["engine_annot"].analyze(img_bgr, min_face_area=min_face_size, min_quality=min_quality)
         
         # Erweiterte Qualitätsfilter anwenden
         filtered_faces = []
@@ -973,11 +1017,16 @@ if files:
                 filtered_faces.append(f)
         
         persons = []
-        for f in filtered_faces:
+        top_matches = []
+        if db and len(db.people) > 0:
+            # Personenerkennung für alle Gesichter des Bildes in einem Aufruf (Top 3 für Debug-Info)
+            top_matches = db.match_many([f["embedding"] for f in filtered_faces], k=3, threshold=None)
+        for f_idx, f in enumerate(filtered_faces):
             name, sim = (None, None)
             if db and len(db.people) > 0:
-                # Personenerkennung durchführen
-                n, s = db.match(f["embedding"], threshold=threshold)
+                n, s = top_matches[f_idx][0]
+                if s < threshold:
+                    n = None
                 name, sim = (n, s)
                 
                 # Debug-Info: Zeige auch wenn keine Person erkannt wurde (für erstes Gesicht)
@@ -987,20 +1036,8 @@ if files:
                         st.info(f"💡 **Tipp:** Threshold ist zu hoch! Setzen Sie ihn auf {s:.2f} oder niedriger, um diese Person zu erkennen.")
                         
                         # Zeige Top 3 ähnlichste Personen
-                        if db and hasattr(db, 'people'):
-                            similarities = []
-                            for person_name, embeddings_list in db.people.items():
-                                for emb in embeddings_list:
-                                    if hasattr(emb, 'shape') and emb.shape == f["embedding"].shape:
-                                        try:
-                                            sim = 1 - np.linalg.norm(f["embedding"] - emb)
-                                            similarities.append((person_name, sim))
-                                        except:
-                                            pass
-                            
-                            if similarities:
-                                similarities.sort(key=lambda x: x[1], reverse=True)
-                                st.info(f"**Top 3 ähnlichste Personen:** {', '.join([f'{name} ({sim:.3f})' for name, sim in similarities[:3]])}")
+                        similarities = top_matches[f_idx]
+                        st.info(f"**Top 3 ähnlichste Personen:** {', '.join([f'{top_name} ({top_sim:.3f})' for top_name, top_sim in similarities])}")
                     elif s is not None and s == 0:
                         st.warning("⚠️ **Debug:** Keine Ähnlichkeit gefunden (0.0). Embeddings scheinen nicht kompatibel zu sein.")
                         st.info("💡 **Mögliche Ursachen:**")
@@ -40,7 +40,7 @@ except ImportError:
 # Import für Metadaten-Extraktion und Face Engine
 try:
     from app.location import extract_comprehensive_metadata
-    from app.face_recognizer import FaceEngine
+    from app.face_recognizer import get_face_engine
     LOCATION_ENGINE_AVAILABLE = True
 except ImportError:
     LOCATION_ENGINE_AVAILABLE = False
@@ -727,7 +727,7 @@ else:
         
         # Face Engine initialisieren
         if "training_engine" not in st.session_state:
-            st.session_state["training_engine"] = FaceEngine(det_size=(640, 640))
+            st.session_state["training_engine"] = get_face_engine(det_size=(640, 640))
         
         # Progress bar für Foto-Verarbeitung
         progress_bar = st.progress(0)
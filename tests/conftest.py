@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from app.face_recognizer import GalleryDB
+
+
+@pytest.fixture
+def make_gallery():
+    """Galerie mit people Personen, je per_person Embeddings um ein zufälliges Zentrum
+
+    Namen p00, p01, … (bei mehr Personen entsprechend breiter); mit sources bekommt jedes
+    Gesicht die Metadaten {'source_image': '<Name>_<i>.jpg'}.
+    """
+    def make(people=20, per_person=4, dim=32, spread=0.5, seed=0, precision="float32", sources=False):
+        rng = np.random.default_rng(seed)
+        width = max(2, len(str(people - 1)))
+        db = GalleryDB(precision=precision)
+        for p in range(people):
+            name = f"p{p:0{width}d}"
+            center = rng.standard_normal(dim).astype(np.float32)
+            for i in range(per_person):
+                db.add(name, center + spread * rng.standard_normal(dim).astype(np.float32),
+                       {"source_image": f"{name}_{i}.jpg"} if sources else None)
+        return db
+    return make
+
+
+@pytest.fixture
+def make_queries():
+    """n verrauschte Kopien zufällig gewählter Galerie-Embeddings"""
+    def make(db, n=30, noise=0.3, seed=1):
+        rng = np.random.default_rng(seed)
+        embs = [np.asarray(e, dtype=np.float32) for embs in db.people.values() for e in embs]
+        picks = rng.choice(len(embs), n, replace=False)
+        return [embs[i] + noise * rng.standard_normal(embs[i].shape).astype(np.float32) for i in picks]
+    return make
+
+
+@pytest.fixture
+def assert_same_matches():
+    """Gleiche Namen und Scores (bis atol) für zwei match_many-Ergebnisse"""
+    def check(got, expected, atol=1e-5):
+        assert len(got) == len(expected)
+        for g, e in zip(got, expected):
+            assert [n for n, _ in g] == [n for n, _ in e]
+            np.testing.assert_allclose([s for _, s in g], [s for _, s in e], atol=atol)
+    return check
+
+
+@pytest.fixture
+def assert_same_gallery():
+    """Gleiche Personen (Reihenfolge), Embeddings bis tolerance relativ zum Zeilenbetrag und Metadaten"""
+    def check(got, expected, tolerance=0.0):
+        assert list(got.people) == list(expected.people)
+        for name, embs in expected.people.items():
+            want = np.stack([np.asarray(e, dtype=np.float32) for e in embs])
+            have = np.stack([np.asarray(e, dtype=np.float32) for e in got.people[name]])
+            assert have.shape == want.shape
+            assert np.all(np.abs(have - want) <= tolerance * np.abs(want).max(axis=1, keepdims=True))
+            assert got.face_metadata.get(name, []) == expected.face_metadata.get(name, [])
+    return check
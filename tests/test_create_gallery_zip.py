@@ -0,0 +1,96 @@
+import json
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+import create_gallery_zip_from_mapping as gallery_zip
+
+
+def photo(path, size=(800, 1200)):
+    """Bild mit vier einfarbigen Quadranten (BGR), damit Crops ihre Herkunft zeigen"""
+    h, w = size
+    img = np.zeros((h, w, 3), dtype=np.uint8)
+    img[:h // 2, :w // 2] = (0, 0, 200)
+    img[:h // 2, w // 2:] = (0, 200, 0)
+    img[h // 2:, :w // 2] = (200, 0, 0)
+    cv2.imwrite(str(path), img, [cv2.IMWRITE_JPEG_QUALITY, 100])
+    return str(path)
+
+
+def region(name, x, y, w, h):
+    return {'name': name, 'x_abs': x, 'y_abs': y, 'width_px': w, 'height_px': h}
+
+
+@pytest.fixture
+def counted_decodes(monkeypatch):
+    calls = []
+    imread_reduced = gallery_zip.imread_reduced
+
+    def counting(path, factor=1):
+        calls.append(factor)
+        return imread_reduced(path, factor)
+
+    monkeypatch.setattr(gallery_zip, "imread_reduced", counting)
+    return calls
+
+
+def decode(content):
+    return cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_image_decoded_once_for_all_regions(tmp_path, counted_decodes):
+    path = photo(tmp_path / "foto.jpg")
+    jobs = [("anna/foto_001.jpg", region(":anna", 100, 100, 200, 200)),
+            ("bernd/foto_001.jpg", region(":bernd", 800, 100, 200, 200)),
+            ("klein/foto_001.jpg", region(":klein", 100, 500, 30, 30)),
+            ("ohne/foto_001.jpg", {'name': "ohne"})]
+    results = gallery_zip.process_image_regions(path, jobs)
+    assert counted_decodes == [1]
+    assert [arcname for arcname, _, _ in results] == [arcname for arcname, _ in jobs]
+    anna, bernd, klein, ohne = (content for _, content, _ in results)
+    # 10 % Rand je Seite
+    assert decode(anna).shape == (240, 240, 3)
+    np.testing.assert_allclose(decode(anna)[120, 120], (0, 0, 200), atol=8)
+    np.testing.assert_allclose(decode(bernd)[120, 120], (0, 200, 0), atol=8)
+    assert klein is None
+    with open(path, "rb") as f:
+        assert ohne == f.read()
+
+
+def test_reduced_decode_keeps_crop_content(tmp_path, counted_decodes):
+    path = photo(tmp_path / "foto.jpg")
+    jobs = [("anna/foto_001.jpg", region(":anna", 100, 100, 400, 400))]
+    [(_, full, _)] = gallery_zip.process_image_regions(path, jobs)
+    [(_, reduced, _)] = gallery_zip.process_image_regions(path, jobs, min_crop_side=100)
+    assert counted_decodes == [1, 4]
+    assert decode(full).shape == (480, 480, 3) and decode(reduced).shape == (120, 120, 3)
+    np.testing.assert_allclose(decode(reduced)[60, 60], decode(full)[240, 240], atol=8)
+
+
+def test_unreadable_image_fails_only_its_jobs(tmp_path):
+    broken = tmp_path / "kaputt.jpg"
+    broken.write_bytes(b"keine JPEG-Daten")
+    results = gallery_zip._process_image_safe(str(broken), [("anna/kaputt_001.jpg", region("anna", 0, 0, 60, 60))],
+                                              True, None)
+    assert [(arcname, content) for arcname, content, _ in results] == [("anna/kaputt_001.jpg", None)]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_zip_from_mapping(tmp_path, workers):
+    first, second = photo(tmp_path / "eins.jpg"), photo(tmp_path / "zwei.jpg")
+    broken = tmp_path / "kaputt.jpg"
+    broken.write_bytes(b"keine JPEG-Daten")
+    mapping = [{'image': first, 'regions': [region(":anna", 100, 100, 200, 200), region(":bernd", 800, 100, 200, 200)]},
+               {'image': second, 'regions': [region(":anna", 100, 500, 200, 200), region(":zwerg", 0, 0, 10, 10)]},
+               {'image': str(broken), 'regions': [region(":bernd", 0, 0, 60, 60)]},
+               {'image': str(tmp_path / "fehlt.jpg"), 'regions': [region(":anna", 0, 0, 60, 60)]}]
+    json_path = tmp_path / "mapping.json"
+    json_path.write_text(json.dumps(mapping), encoding="utf-8")
+    out = str(tmp_path / "gallery.zip")
+    assert gallery_zip.create_gallery_zip_from_mapping(str(json_path), out, workers=workers,
+                                                       compression=zipfile.ZIP_STORED)
+    with zipfile.ZipFile(out) as zf:
+        assert sorted(zf.namelist()) == ["anna/eins_001.jpg", "anna/zwei_002.jpg", "bernd/eins_001.jpg"]
+        np.testing.assert_allclose(decode(zf.read("anna/zwei_002.jpg"))[120, 120], (200, 0, 0), atol=8)
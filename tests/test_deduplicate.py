@@ -0,0 +1,35 @@
+import numpy as np
+
+from app.face_recognizer import GalleryDB, select_representatives
+
+
+def test_max_keep_does_not_pick_duplicates():
+    a, b = np.eye(8, dtype=np.float32)[:2]
+    # Nur zwei verschiedene Vektoren; threshold >= 1 lässt die Kopien im ersten Schritt durch
+    embs = [a, a, b, a, b]
+    kept = select_representatives(embs, threshold=1.01, max_keep=4)
+    assert len(kept) == 2
+    assert {tuple(embs[i]) for i in kept} == {tuple(a), tuple(b)}
+
+
+def test_max_keep_prefers_diverse_representatives():
+    rng = np.random.default_rng(5)
+    base = rng.standard_normal(16).astype(np.float32)
+    far = -base
+    embs = [base + 0.01 * rng.standard_normal(16).astype(np.float32) for _ in range(4)] + [far]
+    kept = select_representatives(embs, threshold=0.999, max_keep=2)
+    assert len(kept) == 2 and 4 in kept
+
+
+def test_zero_vectors_are_kept():
+    embs = [np.ones(4, dtype=np.float32), np.zeros(4, dtype=np.float32), np.ones(4, dtype=np.float32)]
+    assert select_representatives(embs, threshold=0.98) == [0, 1]
+
+
+def test_deduplicate_caps_identity():
+    db = GalleryDB()
+    for v in np.eye(6, dtype=np.float32)[:3]:
+        db.add("anna", v)
+        db.add("anna", v)
+    db.deduplicate(threshold=1.01, max_per_identity=5)
+    assert len(db.people["anna"]) == 3
@@ -0,0 +1,276 @@
+import numpy as np
+from insightface.app.common import Face
+from insightface.model_zoo.attribute import Attribute
+
+from app.face_recognizer import FaceEngine
+
+
+class StubSession:
+    """Liefert (R-lastig, B-lastig, Alter) aus dem Blob, damit die Kanalreihenfolge sichtbar wird"""
+
+    def __init__(self):
+        self.batches = []
+
+    def run(self, output_names, feed):
+        blob = feed["data"]
+        self.batches.append(blob.shape[0])
+        preds = np.stack([blob[:, 0].mean(axis=(1, 2)), blob[:, 2].mean(axis=(1, 2)), blob[:, 1].mean(axis=(1, 2)) / 255.0],
+                         axis=1)
+        return [preds]
+
+
+def stub_genderage():
+    # Wie insightface Attribute nach __init__, aber ohne ONNX-Modell (und ohne swapRB-Attribut)
+    model = Attribute.__new__(Attribute)
+    model.session = StubSession()
+    model.taskname = "genderage"
+    model.input_size = (96, 96)
+    model.input_shape = ["None", 3, 96, 96]
+    model.input_name = "data"
+    model.output_names = ["fc1"]
+    model.input_mean = 0.0
+    model.input_std = 1.0
+    return model
+
+
+def test_genderage_batched_matches_attribute_get():
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 255, size=(200, 240, 3), dtype=np.uint8)
+    img[:, :, 2] = 250  # starkes Rot (BGR), Blau bleibt zufällig
+    boxes = [[20, 30, 90, 110], [120, 40, 200, 150], [60, 100, 130, 190]]
+
+    engine = FaceEngine.__new__(FaceEngine)
+    engine.batch_size = 64
+    batched = [Face(bbox=np.array(b, dtype=np.float32)) for b in boxes]
+    model = stub_genderage()
+    engine._genderage_batched(model, [(img, f) for f in batched])
+    assert model.session.batches == [len(boxes)]
+
+    reference = stub_genderage()
+    for box, face in zip(boxes, batched):
+        ref = Face(bbox=np.array(box, dtype=np.float32))
+        reference.get(img, ref)
+        assert face["gender"] == ref["gender"]
+        assert face["age"] == ref["age"]
+
+
+class StubCascade:
+    """Zählt Lade- und Erkennungsaufrufe; liefert je Cascade-Typ eine feste Anzahl Treffer"""
+
+    loaded = []
+    calls = []
+    hits = {"haarcascade_eye.xml": 2, "haarcascade_eye_tree_eyeglasses.xml": 0, "haarcascade_smile.xml": 1}
+
+    def __init__(self, path):
+        import os
+
+        self.name = os.path.basename(path)
+        StubCascade.loaded.append(self.name)
+
+    def detectMultiScale(self, gray, scale_factor, min_neighbors):
+        StubCascade.calls.append((self.name, gray.shape, gray.ndim))
+        return [(0, 0, 1, 1)] * self.hits[self.name]
+
+
+def test_cascades_loaded_once_and_face_parts_shared(monkeypatch):
+    import cv2
+
+    monkeypatch.setattr(cv2, "CascadeClassifier", StubCascade, raising=False)
+    StubCascade.loaded, StubCascade.calls = [], []
+    engine = FaceEngine.__new__(FaceEngine)
+    engine._cascades = None
+    img = np.random.default_rng(0).integers(0, 255, (200, 200, 3), dtype=np.uint8)
+    boxes = [[10, 20, 90, 120], [100, 50, 180, 150]]
+    results = [engine._extract_face_attributes(Face(bbox=np.array(b, dtype=np.float32), kps=None), img, b)
+               for b in boxes]
+    assert sorted(StubCascade.loaded) == sorted(StubCascade.hits)
+    # Jede Cascade genau einmal pro Gesicht, auf dem Graustufen-ROI der Box
+    assert len(StubCascade.calls) == 3 * len(boxes)
+    assert {shape for _, shape, _ in StubCascade.calls} == {(100, 80)}
+    assert {ndim for _, _, ndim in StubCascade.calls} == {2}
+    assert [r["emotion"] for r in results] == ["happy", "happy"]
+    assert all(r["eye_status"] in ("open", "closed") for r in results)
+
+
+class BlobDetector:
+    """Detektor-Stub: jede helle Fläche im Eingabebild ist ein Gesicht (am Bildrand abgeschnitten)"""
+
+    nms_thresh = 0.4
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        import cv2
+
+        n, _, stats, _ = cv2.connectedComponentsWithStats((img[:, :, 0] > 0).astype(np.uint8))
+        boxes = [[x, y, x + w, y + h, 0.9] for x, y, w, h, _ in stats[1:]]
+        bboxes = np.array(boxes, dtype=np.float32).reshape(-1, 5)
+        kpss = np.stack([np.tile(b[:2], (5, 1)) for b in bboxes]) if len(bboxes) else np.zeros((0, 5, 2), np.float32)
+        return bboxes, kpss
+
+
+class ScoredDetector(BlobDetector):
+    """Wie BlobDetector, Detection-Score aus dem Grauwert der Fläche (255 -> 1.0)"""
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        bboxes, kpss = super().detect(img, input_size, max_num, metric)
+        for b in bboxes:
+            b[4] = img[int(b[1]), int(b[0]), 0] / 255.0
+        return bboxes, kpss
+
+
+def scene(*boxes, size=1000):
+    img = np.zeros((size, size, 3), dtype=np.uint8)
+    for x1, y1, x2, y2 in boxes:
+        img[y1:y2, x1:x2] = 255
+    return img
+
+
+def blob_engine(detector):
+    """FaceEngine mit Stub-Detektor; die 'Modelle' halten fest, auf welchem Bild sie liefen"""
+    import threading
+    from types import SimpleNamespace
+
+    engine = FaceEngine.__new__(FaceEngine)
+    engine.app = SimpleNamespace(det_model=detector)
+    engine.lock = threading.RLock()
+    engine.extract_attributes = False
+    engine.max_detect_side = None
+    engine.tile_size = None
+    engine.tile_overlap = 0.25
+
+    def run_face_models(items):
+        for img, face in items:
+            x1, y1, x2, y2 = face.bbox.astype(int).tolist()
+            face.embedding = np.array([img.shape[1], img.shape[0], img[y1:y2, x1:x2].mean()], dtype=np.float32)
+
+    engine._run_face_models = run_face_models
+    return engine
+
+
+def test_prefilters_drop_faces_before_recognition():
+    engine = blob_engine(ScoredDetector())
+    embedded = []
+    run_face_models = engine._run_face_models
+
+    def counting(items):
+        embedded.extend(face.bbox.astype(int).tolist() for _, face in items)
+        run_face_models(items)
+
+    engine._run_face_models = counting
+    img = scene((10, 10, 110, 110), (200, 10, 220, 30), size=400)
+    img[300:380, 300:380] = 100  # großes Gesicht mit niedrigem Score
+    [faces] = engine.analyze_batch([img], min_det_score=0.5, min_face_area=1000)
+    assert [f["bbox"] for f in faces] == [[10, 10, 110, 110]]
+    assert embedded == [[10, 10, 110, 110]]
+
+    embedded.clear()
+    engine._assess_face_quality = lambda img, bbox, landmarks, gray=None: 0.9 if bbox[0] == 10 else 0.1
+    [faces] = engine.analyze_batch([img], min_quality=0.5)
+    assert embedded == [[10, 10, 110, 110]]
+
+
+def region_engine(detections):
+    """FaceEngine ohne Modelle: _detect liefert feste Boxen (Koordinaten des Ausschnitts)"""
+    import threading
+
+    engine = FaceEngine.__new__(FaceEngine)
+    engine.lock = threading.RLock()
+    engine.extract_attributes = False
+
+    def detect(crop, input_size=None):
+        return [Face(bbox=np.array(b, dtype=np.float32), kps=None, det_score=0.9) for b in detections(crop)]
+
+    def run_face_models(items):
+        for _, face in items:
+            face.embedding = np.ones(4, dtype=np.float32)
+
+    engine._detect = detect
+    engine._run_face_models = run_face_models
+    return engine
+
+
+def test_analyze_regions_rejects_neighbouring_face():
+    img = np.zeros((300, 300, 3), dtype=np.uint8)
+    # Region 100..150 ohne eigenes Gesicht; im gepolsterten Ausschnitt liegt nur ein Nachbargesicht am Rand
+    engine = region_engine(lambda crop: [[0, 0, 20, 20]])
+    assert engine.analyze_regions(img, [[100, 100, 150, 150]]) == [None]
+    assert engine.analyze_regions(img, [[100, 100, 150, 150]], min_iou=0.0)[0] is not None
+
+
+def test_analyze_regions_keeps_overlapping_face():
+    img = np.zeros((300, 300, 3), dtype=np.uint8)
+    # Ausschnitt beginnt bei (75, 75); Gesicht 105..150 im Original
+    engine = region_engine(lambda crop: [[0, 0, 20, 20], [30, 30, 75, 75]])
+    result = engine.analyze_regions(img, [[100, 100, 150, 150]])[0]
+    assert result["bbox"] == [105, 105, 150, 150]
+    assert result["region_iou"] > 0.3
+
+
+class TileDetector(BlobDetector):
+    """Sieht nur Eingaben bis max_input_side, wie kleine Gesichter nach dem Herunterskalieren des Gesamtbilds"""
+
+    def __init__(self, max_input_side):
+        self.max_input_side = max_input_side
+
+    def detect(self, img, input_size=None, max_num=0, metric='default'):
+        if max(img.shape[:2]) > self.max_input_side:
+            return np.zeros((0, 5), dtype=np.float32), np.zeros((0, 5, 2), dtype=np.float32)
+        return super().detect(img, input_size, max_num, metric)
+
+
+def tiled_engine(detector, tile_size=400, tile_overlap=0.25):
+    engine = blob_engine(detector)
+    engine.tile_size = tile_size
+    engine.tile_overlap = tile_overlap
+    return engine
+
+
+def test_tiled_detection_maps_tiles_to_image_coordinates():
+    # Kacheln bei 0, 300, 600; das Gesamtbild sieht der Stub nicht
+    faces = [(120, 650, 200, 730), (720, 820, 790, 900)]
+    engine = tiled_engine(TileDetector(max_input_side=400))
+    found = sorted(f.bbox.astype(int).tolist() for f in engine._detect(scene(*faces)))
+    assert found == sorted(list(b) for b in faces)
+    kps = [f.kps[0].astype(int).tolist() for f in engine._detect(scene(*faces))]
+    assert sorted(kps) == sorted([b[0], b[1]] for b in faces)
+
+
+def test_tiled_detection_drops_faces_cut_by_tile_edges():
+    # 350..450 wird von der rechten Kante der ersten Kachel (400) geschnitten, liegt aber ganz in der zweiten
+    face = (350, 100, 450, 180)
+    engine = tiled_engine(TileDetector(max_input_side=400))
+    assert [f.bbox.astype(int).tolist() for f in engine._detect(scene(face))] == [list(face)]
+
+    # Mit globalem Durchlauf: Teilbox [1000,2000,1200,2160] hätte IoU ~0.23 mit der vollen Box
+    face = (1000, 2000, 1400, 2400)
+    engine = tiled_engine(BlobDetector(), tile_size=1200, tile_overlap=0.2)
+    found = engine._detect(scene(face, size=3000))
+    assert [f.bbox.astype(int).tolist() for f in found] == [list(face)]
+
+
+def test_analyze_files_uses_full_resolution_for_crops(tmp_path):
+    import cv2
+
+    face = (400, 240, 960, 800)
+    path = str(tmp_path / "gross.jpg")
+    cv2.imwrite(path, scene(face, size=1600)[:1200], [cv2.IMWRITE_JPEG_QUALITY, 100])
+    engine = blob_engine(BlobDetector())
+    full, reduced = [engine.analyze_files([path], max_decode_side=side)[0] for side in (None, 400)]
+    assert len(full) == len(reduced) == 1
+    # Box in Originalkoordinaten (Detection auf 1/4), Embedding aus der vollen Auflösung
+    np.testing.assert_allclose(reduced[0]["bbox"], face, atol=4)
+    assert reduced[0]["embedding"][:2].tolist() == [1600, 1200]
+    np.testing.assert_allclose(reduced[0]["embedding"], full[0]["embedding"], rtol=0.02)
+    assert engine.analyze_files([str(tmp_path / "fehlt.jpg")]) == [None]
+
+
+def test_embedding_profile_records_quality(tmp_path):
+    import cv2
+
+    path = str(tmp_path / "bild.png")
+    cv2.imwrite(path, scene((100, 100, 300, 300), size=400))
+    engine = blob_engine(BlobDetector())
+    [face] = engine.analyze_files([path])[0]
+    assert 0.0 <= face["quality_score"] <= 1.0
+    # Vorfilter-Qualität wird wiederverwendet statt neu berechnet
+    engine._assess_face_quality = lambda *args: 0.25
+    assert engine.analyze_files([path], min_quality=0.2)[0][0]["quality_score"] == 0.25
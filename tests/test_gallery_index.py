@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from app.face_recognizer import GalleryDB
+from app.gallery_index import IVFIndex, evaluate_recall
+
+
+def test_ivf_full_probe_is_exact(make_gallery, assert_same_matches):
+    db = make_gallery(people=400, per_person=2, spread=0.3)
+    db.enable_ann('numpy', nlist=16, nprobe=16)
+    report = evaluate_recall(db, k=5, sample=100)
+    assert report["recall"] == 1.0
+    qs = [db.people[name][0] for name in list(db.people)[:20]]
+    assert_same_matches(db.match_many(qs, k=3, threshold=None), db.match_many(qs, k=3, threshold=None, exact=True))
+
+
+def test_ivf_default_recall(make_gallery):
+    db = make_gallery(people=400, per_person=2, spread=0.3)
+    db.enable_ann('numpy')
+    assert evaluate_recall(db, k=1, sample=200)["recall"] >= 0.9
+
+
+def test_index_round_trip_and_new_people(make_gallery, tmp_path):
+    db = make_gallery(people=100, per_person=2, spread=0.3)
+    db.enable_ann('numpy', nlist=8, nprobe=8)
+    path = str(tmp_path / "index.npz")
+    db.save_ann_index(path)
+    rng = np.random.default_rng(7)
+    added = rng.standard_normal(32).astype(np.float32)
+    db.add("neu", added)
+    db.load_ann_index(path)
+    assert db.match(added, threshold=0.9)[0] == "neu"
+    assert evaluate_recall(db, k=3, sample=50)["recall"] == 1.0
+
+
+def test_loaded_index_keeps_build_params(make_gallery, tmp_path):
+    db = make_gallery(people=60, per_person=2, spread=0.3)
+    db.enable_ann('numpy', nlist=6, nprobe=2)
+    path = str(tmp_path / "index.npz")
+    db.save_ann_index(path)
+    loaded = make_gallery(people=60, per_person=2, spread=0.3)
+    loaded.load_ann_index(path)
+    assert loaded._ann_params == {'backend': 'numpy', 'nlist': 6, 'nprobe': 2}
+    loaded._reset_prototypes()  # erzwingt einen Neuaufbau wie nach remove_sources
+    loaded.match_many([np.ones(32, dtype=np.float32)])
+    assert (loaded._ann_index().nlist, loaded._ann_index().nprobe) == (6, 2)
+
+
+def test_index_rejects_other_gallery(make_gallery, tmp_path):
+    db = make_gallery(people=20, per_person=2, spread=0.3)
+    db.enable_ann('numpy')
+    path = str(tmp_path / "index.npz")
+    db.save_ann_index(path)
+    other = GalleryDB()
+    other.add("jemand", np.ones(32, dtype=np.float32))
+    with pytest.raises(ValueError):
+        other.load_ann_index(path)
+
+
+def test_ivf_upsert_before_build():
+    index = IVFIndex(nlist=2, nprobe=2)
+    index.upsert([0, 1], np.eye(2, 4, dtype=np.float32))
+    ids, scores = index.search(np.eye(2, 4, dtype=np.float32), 1)
+    assert ids[:, 0].tolist() == [0, 1]
+    np.testing.assert_allclose(scores[:, 0], [1.0, 1.0])
+
+
+def test_hnsw_recall(make_gallery):
+    pytest.importorskip("hnswlib")
+    db = make_gallery(people=400, per_person=2, spread=0.3)
+    db.enable_ann('hnswlib', ef=128)
+    assert evaluate_recall(db, k=1, sample=200)["recall"] >= 0.95
@@ -0,0 +1,111 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from app import face_recognizer
+from app.face_recognizer import GalleryDB
+from app.gallery_journal import GalleryJournal, segment_paths
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).standard_normal(16).astype(np.float32)
+
+
+@pytest.fixture
+def journaled(tmp_path):
+    path = str(tmp_path / "embeddings.pkl")
+    base = GalleryDB()
+    base.add("anna", embedding(0), {"source_image": "a0.jpg"})
+    base.save(path)
+    db = GalleryDB.load(path)
+    db.attach_journal(path)
+    for i in range(1, 6):
+        db.add("anna" if i % 2 else "bernd", embedding(i), {"source_image": f"x{i}.jpg"})
+    db.close_journal()
+    return path, db
+
+
+def test_load_replays_journal(journaled, assert_same_gallery):
+    path, db = journaled
+    assert_same_gallery(GalleryDB.load(path), db)
+
+
+def test_truncated_record_after_crash_is_ignored(journaled):
+    path, db = journaled
+    _, segment = segment_paths(path)[-1]
+    with open(segment, "r+b") as f:
+        f.truncate(os.path.getsize(segment) - 3)
+    loaded = GalleryDB.load(path)
+    assert sum(len(e) for e in loaded.people.values()) == 5
+    assert loaded._journal_seq == 4
+    # Weiterschreiben nach dem Absturz setzt hinter dem letzten gültigen Datensatz fort
+    loaded.attach_journal(path)
+    loaded.add("carla", embedding(99))
+    loaded.close_journal()
+    assert "carla" in GalleryDB.load(path).people
+
+
+def test_compact_writes_snapshot_and_removes_segments(journaled, assert_same_gallery):
+    path, db = journaled
+    db = GalleryDB.load(path)
+    db.attach_journal(path)
+    db.compact()
+    db.wait_for_compaction()
+    db.close_journal()
+    assert segment_paths(path) == []
+    with open(path, "rb") as f:
+        assert pickle.load(f)["journal_seq"] == 5
+    assert_same_gallery(GalleryDB.load(path), db)
+
+
+def test_gap_in_journal_is_detected(journaled):
+    path, _ = journaled
+    db = GalleryDB._load_snapshot(path)
+    journal = GalleryJournal(path)
+    assert journal.last_seq == 5
+    # Snapshot ohne die Datensätze 1..5, Segment mit 1..5 gelöscht, neues mit 6: Lücke
+    for _, segment in segment_paths(path):
+        os.remove(segment)
+    journal.append("dora", embedding(7))
+    journal.close()
+    assert not db._replay_journal(path)
+
+
+def test_load_retries_when_compaction_races(journaled, monkeypatch):
+    path, db = journaled
+    calls = []
+    original = face_recognizer.read_journal
+
+    def racing_read_journal(p, after_seq=0):
+        calls.append(after_seq)
+        if len(calls) == 1:
+            # Ein anderer Prozess kompaktiert zwischen Snapshot und Journal
+            other = GalleryDB.load(path)
+            other.attach_journal(path)
+            other.add("emil", embedding(42))
+            other.compact()
+            other.wait_for_compaction()
+            other.close_journal()
+        return original(p, after_seq)
+
+    monkeypatch.setattr(face_recognizer, "read_journal", racing_read_journal)
+    loaded = GalleryDB.load(path)
+    assert calls[0] == 0 and calls[-1] == 6
+    assert "emil" in loaded.people
+    assert sum(len(e) for e in loaded.people.values()) == 7
+
+
+def test_failed_save_keeps_previous_snapshot(journaled, assert_same_gallery, monkeypatch):
+    path, db = journaled
+    before = GalleryDB.load(path)
+
+    def broken_dump(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(face_recognizer.pickle, "dump", broken_dump)
+    with pytest.raises(OSError):
+        db.save(path)
+    monkeypatch.undo()
+    assert_same_gallery(GalleryDB.load(path), before)
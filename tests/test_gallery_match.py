@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from app.face_recognizer import GalleryDB
+from app.utils import cosine_similarity
+
+
+def loop_match(db, embedding, threshold=0.55):
+    """Ursprüngliche Schleife: mittlere Cosine-Ähnlichkeit je Person"""
+    best_name, best_sim = None, -1.0
+    for name, embs in db.people.items():
+        sims = [cosine_similarity(embedding, e) for e in embs]
+        if sims:
+            sim = float(np.mean(sims))
+            if sim > best_sim:
+                best_sim, best_name = sim, name
+    if best_sim >= threshold:
+        return best_name, best_sim
+    return None, best_sim
+
+
+def loop_topk(db, embedding, k):
+    sims = {name: float(np.mean([cosine_similarity(embedding, e) for e in embs])) for name, embs in db.people.items()}
+    return sorted(sims.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+@pytest.mark.parametrize("threshold", [0.0, 0.55, 0.99])
+def test_match_equals_loop(make_gallery, make_queries, threshold):
+    db = make_gallery()
+    for q in make_queries(db):
+        name, sim = db.match(q, threshold=threshold)
+        expected_name, expected_sim = loop_match(db, q, threshold)
+        assert name == expected_name
+        assert sim == pytest.approx(expected_sim, abs=1e-5)
+
+
+def test_match_many_equals_single_match(make_gallery, make_queries):
+    db = make_gallery()
+    qs = make_queries(db)
+    for hits, q in zip(db.match_many(qs, k=1), qs):
+        name, sim = db.match(q)
+        assert hits[0][0] == name
+        assert hits[0][1] == pytest.approx(sim, abs=1e-6)
+
+
+def test_match_many_topk_equals_loop(make_gallery, make_queries, assert_same_matches):
+    db = make_gallery()
+    qs = make_queries(db)
+    assert_same_matches(db.match_many(qs, k=5, threshold=None), [loop_topk(db, q, 5) for q in qs])
+
+
+def test_empty_gallery():
+    assert GalleryDB().match(np.ones(8, dtype=np.float32)) == (None, -1.0)
+    assert GalleryDB().match_many([]) == []
+
+
+def fresh_copy(db, precision="float32"):
+    copy = GalleryDB(precision=precision)
+    copy.people = {name: list(embs) for name, embs in db.people.items()}
+    return copy
+
+
+def test_prototypes_follow_incremental_adds(make_gallery, make_queries, assert_same_matches):
+    db = make_gallery(people=5)
+    qs = make_queries(db, n=10)
+    db.match_many(qs)  # Prototypen aufbauen, danach inkrementell pflegen
+    rng = np.random.default_rng(2)
+    for name in ("p01", "p03", "neu"):
+        db.add(name, rng.standard_normal(32).astype(np.float32))
+    db.add("leer", np.zeros(32, dtype=np.float32))
+    got = db.match_many(qs, k=3, threshold=None)
+    assert_same_matches(got, fresh_copy(db).match_many(qs, k=3, threshold=None))
+    for q, hits in zip(qs, got):
+        assert [n for n, _ in hits] == [n for n, _ in loop_topk(db, q, 3)]
+
+
+def test_prototypes_follow_removals(make_gallery, make_queries):
+    db = make_gallery(people=5, sources=True)
+    qs = make_queries(db, n=10)
+    db.match_many(qs)
+    db.remove_sources(["p02_0.jpg", "p02_1.jpg", "p02_2.jpg", "p02_3.jpg", "p04_1.jpg"])
+    assert "p02" not in db.people
+    for q, hits in zip(qs, db.match_many(qs, k=2, threshold=None)):
+        assert [n for n, _ in hits] == [n for n, _ in loop_topk(db, q, 2)]
+
+
+@pytest.mark.parametrize("precision,tolerance", [("float16", 1e-3), ("int8", 2e-2)])
+def test_quantized_scoring_matches_float32(make_gallery, make_queries, precision, tolerance):
+    db = make_gallery()
+    quantized = fresh_copy(db, precision)
+    qs = make_queries(db)
+    exact = db.match_many(qs, k=3, threshold=None)
+    approx = quantized.match_many(qs, k=3, threshold=None)
+    assert [e[0][0] for e in exact] == [a[0][0] for a in approx]
+    for e, a in zip(exact, approx):
+        sims = dict(e)
+        for name, sim in a:
+            if name in sims:
+                assert abs(sim - sims[name]) <= tolerance
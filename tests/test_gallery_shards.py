@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from app.gallery_shards import ShardedGallery, is_sharded_gallery, merge_topk, shard_of
+
+
+def test_shard_of_is_stable():
+    assert shard_of("anna", 4) == shard_of("anna", 4)
+    assert {shard_of(f"p{i}", 4) for i in range(50)} == {0, 1, 2, 3}
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_split_matches_unsharded(make_gallery, make_queries, assert_same_matches, workers):
+    db = make_gallery(people=30, per_person=3, dim=16, spread=0.4, sources=True)
+    sharded = ShardedGallery.split(db, 4, workers=workers)
+    assert sorted(sharded.people) == sorted(db.people)
+    assert sum(len(s.people) for s in sharded.shards) == len(db.people)
+    qs = make_queries(db, noise=0.2)
+    for threshold in (None, 0.7):
+        assert_same_matches(sharded.match_many(qs, k=3, threshold=threshold),
+                            db.match_many(qs, k=3, threshold=threshold))
+    assert sharded.get_person_metadata("p05") == db.get_person_metadata("p05")
+    sharded.close()
+
+
+def test_merge_topk():
+    a = [[("anna", 0.9), ("bernd", 0.4)], [(None, -1.0)]]
+    b = [[("carla", 0.6)], [("dora", 0.3)]]
+    assert merge_topk([a, b], k=2, threshold=0.5) == [[("anna", 0.9), ("carla", 0.6)], [(None, 0.3)]]
+    assert merge_topk([[[(None, -1.0)]], [[(None, -1.0)]]], k=1) == [[(None, -1.0)]]
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_save_load_round_trip(make_gallery, make_queries, assert_same_matches, tmp_path, executor):
+    db = make_gallery(people=30, per_person=3, dim=16, spread=0.4, sources=True)
+    path = str(tmp_path / "shards")
+    ShardedGallery.split(db, 3).save(path)
+    assert is_sharded_gallery(path)
+    loaded = ShardedGallery.load(path, workers=2, executor=executor)
+    qs = make_queries(db, noise=0.2)
+    assert_same_matches(loaded.match_many(qs, k=2, threshold=None), db.match_many(qs, k=2, threshold=None))
+    loaded.close()
+
+
+def test_add_routes_to_owning_shard(make_gallery):
+    sharded = ShardedGallery.split(make_gallery(people=5, per_person=3, dim=16, spread=0.4, sources=True), 3, workers=1)
+    emb = np.ones(16, dtype=np.float32)
+    sharded.add("neu", emb)
+    assert "neu" in sharded.shards[shard_of("neu", 3)].people
+    assert sharded.match(emb, threshold=0.99)[0] == "neu"
@@ -0,0 +1,86 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from app.face_recognizer import GalleryDB
+
+
+def make_db(path):
+    rng = np.random.default_rng(1)
+    db = GalleryDB()
+    base = rng.standard_normal(16).astype(np.float32)
+    other = rng.standard_normal(16).astype(np.float32)
+    for i in range(4):
+        # Zwei praktisch identische Paare für Anna
+        db.add("anna", base + (i // 2) * other + 1e-4 * i,
+               {"source_image": f"anna{i}.jpg", "quality_score": 0.5 + i / 10})
+    db.add("bernd", rng.standard_normal(16).astype(np.float32), {"source_image": "bernd.jpg", "quality_score": 0.9})
+    db.save(path)
+    return db
+
+
+def counts(db):
+    return {name: len(embs) for name, embs in db.people.items()}
+
+
+def test_round_trip(tmp_path, assert_same_gallery, assert_same_matches):
+    path = str(tmp_path / "g.sqlite")
+    original = make_db(path)
+    loaded = GalleryDB.load(path)
+    assert_same_gallery(loaded, original, tolerance=1e-6)
+    assert [f["source_image"] for f in loaded.find_faces(min_quality=0.75)] == ["anna3.jpg", "bernd.jpg"]
+    q = np.stack(original.people["bernd"])
+    assert_same_matches(loaded.match_many(q, k=2, threshold=None), original.match_many(q, k=2, threshold=None))
+    loaded.close()
+
+
+def test_loading_leaves_file_unchanged(tmp_path):
+    path = tmp_path / "g.sqlite"
+    make_db(str(path))
+    before = path.read_bytes()
+    db = GalleryDB.load(str(path))
+    assert counts(db) == {"anna": 4, "bernd": 1}
+    assert len(db.find_faces(min_quality=0.0)) == 5
+    db.match(np.ones(16, dtype=np.float32))
+    db.close()
+    assert path.read_bytes() == before
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["g.sqlite"]
+    with sqlite3.connect(str(path)) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+
+
+def test_missing_database_is_not_created(tmp_path):
+    path = tmp_path / "missing.sqlite"
+    with pytest.raises(FileNotFoundError):
+        GalleryDB.load(str(path))
+    assert not path.exists()
+
+
+def test_dedup_to_other_file_leaves_source_untouched(tmp_path):
+    src, out = str(tmp_path / "g.sqlite"), str(tmp_path / "dedup.sqlite")
+    make_db(src)
+    db = GalleryDB.load(src)
+    report = db.deduplicate(threshold=0.98)
+    assert report["duplicates_removed"] == 2
+    db.save(out)
+    db.close()
+    assert counts(GalleryDB.load(src)) == {"anna": 4, "bernd": 1}
+    deduped = GalleryDB.load(out)
+    assert counts(deduped) == {"anna": 2, "bernd": 1}
+    assert len(deduped.face_metadata["anna"]) == 2
+
+
+def test_changes_reach_own_database_only_on_save(tmp_path):
+    path = str(tmp_path / "g.sqlite")
+    make_db(path)
+    db = GalleryDB.load(path)
+    assert db.remove_sources(["bernd.jpg", "anna0.jpg"]) == 2
+    assert counts(db) == {"anna": 3}
+    assert [f["source_image"] for f in db.find_faces(name="anna")] == ["anna1.jpg", "anna2.jpg", "anna3.jpg"]
+    assert counts(GalleryDB.load(path)) == {"anna": 4, "bernd": 1}
+    db.save(path)
+    db.close()
+    reloaded = GalleryDB.load(path)
+    assert counts(reloaded) == {"anna": 3}
+    assert reloaded.match(np.asarray(reloaded.people["anna"][0]), threshold=0.0)[0] == "anna"
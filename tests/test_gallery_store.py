@@ -0,0 +1,105 @@
+import functools
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from app.face_recognizer import GalleryDB
+
+# Größter erlaubter Fehler je Präzision, relativ zum Betrag der Zeile
+TOLERANCE = {"float32": 1e-6, "float16": 1e-3, "int8": 1e-2}
+
+
+@pytest.fixture
+def small_gallery(make_gallery):
+    return functools.partial(make_gallery, people=3, per_person=2, seed=3, sources=True)
+
+
+@pytest.mark.parametrize("precision", ["float32", "float16", "int8"])
+def test_binary_round_trip(small_gallery, assert_same_gallery, tmp_path, precision):
+    path = str(tmp_path / "g.gallery")
+    original = small_gallery(precision=precision)
+    original.save(path)
+    loaded = GalleryDB.load(path)
+    assert loaded.precision == precision
+    assert_same_gallery(loaded, original, TOLERANCE[precision])
+    q = np.stack(original.people["p02"])
+    assert [m[0][0] for m in loaded.match_many(q, threshold=None)] == ["p02", "p02"]
+    loaded.close()
+
+
+def test_pickle_round_trip(small_gallery, assert_same_gallery, tmp_path):
+    path = str(tmp_path / "g.pkl")
+    original = small_gallery()
+    original.save(path)
+    assert_same_gallery(GalleryDB.load(path), original, TOLERANCE["float32"])
+
+
+def test_binary_save_replaces_existing(small_gallery, tmp_path):
+    path = str(tmp_path / "g.gallery")
+    small_gallery().save(path)
+    db = small_gallery()
+    db.add("dora", np.ones(32, dtype=np.float32))
+    db.save(path)
+    assert "dora" in GalleryDB.load(path).people
+    assert not os.path.exists(path + ".old") and not os.path.exists(path + ".tmp")
+
+
+def test_load_recovers_interrupted_swap(small_gallery, assert_same_gallery, tmp_path):
+    path = str(tmp_path / "g.gallery")
+    original = small_gallery()
+    original.save(path)
+    # Abbruch zwischen den beiden rename: nur noch g.gallery.old ist vorhanden
+    shutil.move(path, path + ".old")
+    loaded = GalleryDB.load(path, retries=1)
+    assert_same_gallery(loaded, original, TOLERANCE["float32"])
+    assert not os.path.exists(path + ".old")
+
+
+def mapped_files():
+    with open("/proc/self/maps", encoding="utf-8") as f:
+        return {line.split(None, 5)[5].strip() for line in f if len(line.split(None, 5)) == 6}
+
+
+@pytest.fixture
+def windows_replace(monkeypatch):
+    """os.replace/os.rename wie unter Windows: gemappte Dateien lassen sich nicht verschieben"""
+    if not os.path.exists("/proc/self/maps"):
+        pytest.skip("benötigt /proc/self/maps")
+
+    def strict(move):
+        def wrapper(src, dst):
+            prefix = os.path.abspath(src) + os.sep
+            if any(f.startswith(prefix) for f in mapped_files()):
+                raise PermissionError(f"{src} ist noch gemappt")
+            move(src, dst)
+        return wrapper
+
+    monkeypatch.setattr(os, "replace", strict(os.replace))
+    monkeypatch.setattr(os, "rename", strict(os.rename))
+
+
+@pytest.mark.parametrize("precision", ["float32", "int8"])
+def test_save_over_mapped_gallery(small_gallery, tmp_path, windows_replace, precision):
+    path = str(tmp_path / "g.gallery")
+    small_gallery(precision=precision).save(path)
+    db = GalleryDB.load(path)
+    db.match_many([np.ones(32, dtype=np.float32)])
+    db.remove_sources(["p00_0.jpg"])
+    db.save(path)
+    assert [len(db.people[name]) for name in db.people] == [1, 2, 2]
+    assert db.match(np.stack(db.people["p01"])[0], threshold=0.9)[0] == "p01"
+    assert [len(embs) for embs in GalleryDB.load(path).people.values()] == [1, 2, 2]
+
+
+def test_compact_mapped_gallery(small_gallery, tmp_path, windows_replace):
+    path = str(tmp_path / "g.gallery")
+    small_gallery().save(path)
+    db = GalleryDB.load(path)
+    db.attach_journal(path)
+    db.add("dora", np.ones(32, dtype=np.float32))
+    db.compact(background=True)
+    db.close_journal()
+    assert "dora" in GalleryDB.load(path).people
+    assert db.match(np.ones(32, dtype=np.float32), threshold=0.99)[0] == "dora"
@@ -0,0 +1,61 @@
+import io
+import os
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+from app.image_loader import iter_zip_images
+
+
+def encoded(ext, value):
+    return cv2.imencode(ext, np.full((60, 80, 3), value, dtype=np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def gallery_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("anna/", b"")
+        zf.writestr("anna/1.PNG", encoded(".png", 10))
+        zf.writestr("bernd/2.jpg", encoded(".jpg", 200))
+        zf.writestr("bernd/liesmich.txt", b"kein Bild")
+        zf.writestr("bernd/kaputt.jpg", b"keine JPEG-Daten")
+    buf.seek(0)
+    return zipfile.ZipFile(buf)
+
+
+def test_zip_members_are_decoded_one_at_a_time(gallery_zip, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    reads = []
+    read = gallery_zip.read
+
+    def counting_read(info):
+        reads.append(info.filename)
+        return read(info)
+
+    monkeypatch.setattr(gallery_zip, "read", counting_read)
+
+    members = iter_zip_images(gallery_zip)
+    info, data, img = next(members)
+    assert reads == ["anna/1.PNG"]
+    assert os.path.basename(os.path.dirname(info.filename)) == "anna"
+    assert data == gallery_zip.open("anna/1.PNG").read()
+    assert img.shape == (60, 80, 3) and int(img[0, 0, 0]) == 10
+
+    rest = list(members)
+    assert [i.filename for i, _, _ in rest] == ["bernd/2.jpg", "bernd/kaputt.jpg"]
+    assert abs(int(rest[0][2][0, 0, 0]) - 200) <= 2
+    assert rest[1][2] is None
+    # Nichts entpackt
+    assert os.listdir(tmp_path) == []
+
+
+def test_exif_from_member_bytes_matches_file(gallery_zip, tmp_path):
+    pytest.importorskip("exifread")
+    from app.location import extract_comprehensive_metadata
+
+    path = tmp_path / "2.jpg"
+    path.write_bytes(gallery_zip.read("bernd/2.jpg"))
+    assert extract_comprehensive_metadata(path.read_bytes()) == extract_comprehensive_metadata(str(path))
@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.enrollment import build_gallery_from_folder, gallery_tasks, plan_incremental_enrollment, source_fingerprint
+from app.face_recognizer import GalleryDB
+
+
+@pytest.fixture
+def gallery(tmp_path):
+    root = tmp_path / "gallery"
+    for person, files in {"anna": ["1.jpg", "2.jpg"], "bernd": ["1.jpg"]}.items():
+        (root / person).mkdir(parents=True)
+        for fn in files:
+            (root / person / fn).write_bytes(f"{person}/{fn}".encode())
+    return root
+
+
+def enrolled(gallery_dir):
+    """Galerie wie nach build_gallery_from_folder (absolute source_image mit Fingerabdruck)"""
+    db = GalleryDB()
+    for i, (person, p) in enumerate(gallery_tasks(os.path.abspath(gallery_dir))):
+        db.add(person, np.full(4, i + 1, dtype=np.float32), {'source_image': p, 'source_fingerprint': source_fingerprint(p)})
+    return db
+
+
+def test_unchanged_gallery_needs_no_work_from_any_cwd(gallery, monkeypatch):
+    db = enrolled(gallery)
+    for cwd, gallery_dir in [(gallery.parent, "gallery"), (gallery, "."), (gallery / "anna", str(gallery))]:
+        monkeypatch.chdir(cwd)
+        todo, stale = plan_incremental_enrollment(db, gallery_dir, gallery_tasks(gallery_dir))
+        assert (todo, stale) == ([], [])
+
+
+def test_changed_new_and_deleted_images(gallery, tmp_path):
+    db = enrolled(gallery)
+    other = str(tmp_path / "elsewhere.jpg")
+    db.add("carla", np.ones(4, dtype=np.float32), {'source_image': other})
+    (gallery / "anna" / "2.jpg").write_bytes(b"changed content")
+    (gallery / "bernd" / "2.jpg").write_bytes(b"new")
+    os.remove(gallery / "bernd" / "1.jpg")
+
+    todo, stale = plan_incremental_enrollment(db, str(gallery), gallery_tasks(str(gallery)))
+    assert [(person, os.path.basename(p)) for person, p in todo] == [("anna", "2.jpg"), ("bernd", "2.jpg")]
+    # Gesichter außerhalb des Galerieordners bleiben unangetastet
+    assert sorted(os.path.relpath(p, gallery) for p in stale) == [os.path.join("anna", "2.jpg"), os.path.join("bernd", "1.jpg")]
+
+    assert db.remove_sources(stale) == 2
+    assert {name: len(embs) for name, embs in db.people.items()} == {"anna": 1, "carla": 1}
+
+
+def test_remove_sources_warns_about_unaligned_metadata():
+    db = GalleryDB()
+    db.add("anna", np.ones(4, dtype=np.float32), {'source_image': "a.jpg"})
+    db.add("anna", np.ones(4, dtype=np.float32))  # ohne Metadaten: Zuordnung nicht mehr eindeutig
+    with pytest.warns(UserWarning, match="anna"):
+        assert db.remove_sources(["a.jpg"]) == 0
+    assert len(db.people["anna"]) == 2
+
+
+class CountingEngine:
+    """Merkt sich analysierte Bilder; Bilder mit 'leer' im Namen enthalten kein Gesicht"""
+
+    analyzed = []
+
+    def __init__(self, det_size=None, profile=None, ort_options=None):
+        pass
+
+    def analyze_files(self, paths, max_decode_side=None):
+        CountingEngine.analyzed.extend(os.path.basename(p) for p in paths)
+        return [[] if "leer" in p else [{'bbox': [0, 0, 4, 4], 'embedding': np.ones(4, dtype=np.float32)}]
+                for p in paths]
+
+
+def enroll_incremental(gallery, db):
+    CountingEngine.analyzed = []
+    report = {}
+    db = build_gallery_from_folder(str(gallery), db=db, incremental=True, engine_factory=CountingEngine, report=report)
+    return db, report, CountingEngine.analyzed
+
+
+@pytest.mark.parametrize("suffix", [".pkl", ".gallery", ".sqlite"])
+def test_images_without_faces_are_not_reanalyzed(gallery, tmp_path, suffix):
+    (gallery / "bernd" / "leer.jpg").write_bytes(b"kein Gesicht")
+    path = str(tmp_path / f"db{suffix}")
+    db, report, analyzed = enroll_incremental(gallery, GalleryDB())
+    assert sorted(analyzed) == ["1.jpg", "1.jpg", "2.jpg", "leer.jpg"] and report['embedded'] == 3
+    db.save(path)
+
+    db, report, analyzed = enroll_incremental(gallery, GalleryDB.load(path))
+    assert analyzed == [] and report['skipped'] == 4
+
+    # Neues Bild ohne Gesicht wird im Journal-Betrieb per Kompaktierung festgehalten
+    (gallery / "anna" / "leer.jpg").write_bytes(b"auch leer")
+    db = GalleryDB.load(path)
+    if suffix != ".sqlite":
+        db.attach_journal(path)
+    db, report, analyzed = enroll_incremental(gallery, db)
+    assert analyzed == ["leer.jpg"]
+    if suffix == ".sqlite":
+        db.save(path)
+    db.close()
+
+    # Geändertes bzw. gelöschtes Bild ohne Gesicht: neu einlesen bzw. Vermerk entfernen
+    (gallery / "anna" / "leer.jpg").write_bytes(b"jetzt anders")
+    os.remove(gallery / "bernd" / "leer.jpg")
+    db, report, analyzed = enroll_incremental(gallery, GalleryDB.load(path))
+    assert analyzed == ["leer.jpg"]
+    assert sorted(os.path.relpath(p, gallery) for p in db.empty_sources) == [os.path.join("anna", "leer.jpg")]
+    assert {name: len(embs) for name, embs in db.people.items()} == {"anna": 2, "bernd": 1}
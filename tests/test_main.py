@@ -0,0 +1,38 @@
+import pytest
+
+from app.enrollment import build_gallery_from_folder
+from app.face_recognizer import GalleryDB
+from app.main import build_parser
+
+
+@pytest.mark.parametrize("command", [["enroll", "--gallery", "g"], ["enroll-mapping", "--mapping", "m.json"]])
+def test_enroll_rejects_profile_without_embeddings(command, capsys):
+    with pytest.raises(SystemExit):
+        build_parser().parse_args(command + ["--db", "g.pkl", "--profile", "detect"])
+    assert "invalid choice: 'detect'" in capsys.readouterr().err
+    assert build_parser().parse_args(command + ["--db", "g.pkl", "--profile", "full"]).profile == "full"
+
+
+def test_build_gallery_rejects_detect_profile(tmp_path):
+    with pytest.raises(ValueError, match="keine Embeddings"):
+        build_gallery_from_folder(str(tmp_path), profile="detect")
+
+
+def test_enroll_mapping_fails_when_every_image_fails(tmp_path, monkeypatch, capsys):
+    import app.main as main
+
+    def build(mapping, report=None, **kwargs):
+        report.update({'images': 2, 'regions': 3, 'embedded': 0, 'unmatched': 0, 'too_small': 0,
+                       'no_coords': 0, 'missing_images': 0, 'unreadable': 1, 'errors': 1})
+        return GalleryDB()
+
+    mapping = tmp_path / "m.json"
+    mapping.write_text("[]")
+    db = tmp_path / "g.pkl"
+    monkeypatch.setattr(main, "build_gallery_from_mapping", build)
+    args = build_parser().parse_args(["enroll-mapping", "--mapping", str(mapping), "--db", str(db)])
+    with pytest.raises(SystemExit) as exc:
+        args.func(args)
+    assert exc.value.code != 0
+    assert "1 analysis errors" in capsys.readouterr().out
+    assert not db.exists()
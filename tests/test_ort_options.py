@@ -0,0 +1,65 @@
+import sys
+
+import onnx
+import onnxruntime as ort
+import pytest
+from onnx import TensorProto, helper
+
+from app.face_recognizer import apply_session_options, build_session_options, load_ort_config
+
+
+def identity_model(path):
+    graph = helper.make_graph([helper.make_node("Identity", ["x"], ["y"])], "identity",
+                              [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1])],
+                              [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1])])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+    return path
+
+
+class StubModel:
+    def __init__(self, model_file):
+        self.model_file = model_file
+        self.session = ort.InferenceSession(model_file, providers=["CPUExecutionProvider"])
+
+
+class StubApp:
+    def __init__(self, model_file):
+        self.models = {"detection": StubModel(model_file)}
+
+
+def test_build_session_options():
+    assert build_session_options({}) is None
+    opts = build_session_options({'intra_op_threads': 3, 'inter_op_threads': 2, 'execution_mode': 'parallel',
+                                  'graph_optimization_level': 'basic', 'thread_affinity': "1;2"})
+    assert opts.intra_op_num_threads == 3
+    assert opts.inter_op_num_threads == 2
+    assert opts.execution_mode == ort.ExecutionMode.ORT_PARALLEL
+    assert opts.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_BASIC
+    assert opts.get_session_config_entry('session.intra_op_thread_affinities') == "1;2"
+
+
+def test_thread_affinity_requires_intra_op_threads():
+    with pytest.raises(ValueError):
+        build_session_options({'inter_op_threads': 2, 'thread_affinity': "1;2"})
+
+
+def test_apply_session_options_recreates_sessions(tmp_path):
+    app = StubApp(identity_model(str(tmp_path / "identity.onnx")))
+    apply_session_options(app, build_session_options({'intra_op_threads': 2, 'inter_op_threads': 1}))
+    session = app.models["detection"].session
+    assert session.get_session_options().intra_op_num_threads == 2
+    assert session.get_session_options().inter_op_num_threads == 1
+    assert session.get_providers() == ["CPUExecutionProvider"]
+    assert session.run(None, {"x": [1.5]})[0].tolist() == [1.5]
+
+
+def test_load_ort_config(tmp_path, monkeypatch):
+    path = tmp_path / "config.yaml"
+    path.write_text("credentials: {}\nonnxruntime:\n  intra_op_threads: 4\n  execution_mode: null\n", encoding="utf-8")
+    assert load_ort_config(str(path)) == {'intra_op_threads': 4}
+    assert load_ort_config(str(tmp_path / "fehlt.yaml")) == {}
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    with pytest.warns(UserWarning, match="onnxruntime"):
+        assert load_ort_config(str(path)) == {}
@@ -0,0 +1,106 @@
+import os
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+
+from app.enrollment import build_gallery_from_folder, build_gallery_from_mapping
+
+
+def _embedding(data: bytes) -> np.ndarray:
+    return np.random.default_rng(zlib.crc32(data)).standard_normal(8).astype(np.float32)
+
+
+class StubEngine:
+    """Ersetzt FaceEngine in den Worker-Prozessen; Embedding abgeleitet aus dem Bildinhalt"""
+
+    def __init__(self, det_size=(640, 640), profile='detect+embed', ort_options=None):
+        self.det_size = det_size
+
+    def analyze_files(self, paths, max_decode_side=None):
+        results = []
+        for p in paths:
+            with open(p, "rb") as f:
+                data = f.read()
+            # Bilder mit "leer" im Namen enthalten kein Gesicht
+            faces = [] if "leer" in os.path.basename(p) else [
+                {'bbox': [0, 0, 10, 10], 'embedding': _embedding(data), 'quality_score': 0.5},
+                {'bbox': [0, 0, 4, 4], 'embedding': -_embedding(data), 'quality_score': 0.1},
+            ]
+            results.append(faces)
+        return results
+
+    def analyze_regions(self, img_bgr, boxes, min_iou=0.3):
+        faces = []
+        for x1, y1, x2, y2 in boxes:
+            crop = np.ascontiguousarray(img_bgr[y1:y2, x1:x2])
+            faces.append({'embedding': _embedding(crop.tobytes()), 'region_iou': 1.0} if crop.mean() > 20 else None)
+        return faces
+
+
+@pytest.fixture
+def gallery(tmp_path):
+    rng = np.random.default_rng(0)
+    for person in ("anna", "bernd", "carla"):
+        os.makedirs(tmp_path / person)
+        for i in range(5):
+            img = rng.integers(0, 255, (24, 24, 3), dtype=np.uint8)
+            cv2.imwrite(str(tmp_path / person / f"{i}.png"), img)
+    cv2.imwrite(str(tmp_path / "bernd" / "leer.png"), np.zeros((8, 8, 3), dtype=np.uint8))
+    return str(tmp_path)
+
+
+def test_folder_result_independent_of_workers(gallery, assert_same_gallery):
+    reports = [{}, {}]
+    serial = build_gallery_from_folder(gallery, chunk_size=2, workers=1, engine_factory=StubEngine, report=reports[0])
+    parallel = build_gallery_from_folder(gallery, chunk_size=2, workers=2, engine_factory=StubEngine, report=reports[1])
+    assert_same_gallery(serial, parallel)
+    assert reports[0] == reports[1] == {'images': 16, 'embedded': 15, 'skipped': 0, 'removed': 0}
+
+
+def test_mapping_result_independent_of_workers(gallery, assert_same_gallery):
+    mapping = []
+    for person in ("anna", "bernd", "carla"):
+        for i in range(5):
+            regions = [{'name': f":{person}", 'x_abs': 2, 'y_abs': 2, 'width_px': 20, 'height_px': 20},
+                       {'name': "klein", 'x_abs': 0, 'y_abs': 0, 'width_px': 5, 'height_px': 5}]
+            mapping.append({'image': os.path.join(gallery, person, f"{i}.png"), 'regions': regions})
+    mapping.append({'image': os.path.join(gallery, "bernd", "leer.png"),
+                    'regions': [{'name': "niemand", 'x_abs': 0, 'y_abs': 0, 'width_px': 8, 'height_px': 8}]})
+    reports = [{}, {}]
+    serial = build_gallery_from_mapping(mapping, chunk_size=3, workers=1, engine_factory=StubEngine,
+                                        min_region_size=6, report=reports[0])
+    parallel = build_gallery_from_mapping(mapping, chunk_size=3, workers=2, engine_factory=StubEngine,
+                                          min_region_size=6, report=reports[1])
+    assert_same_gallery(serial, parallel)
+    assert sorted(serial.people) == ["anna", "bernd", "carla"]
+    assert reports[0] == reports[1]
+    assert reports[0]['embedded'] == 15 and reports[0]['unmatched'] == 1 and reports[0]['too_small'] == 15
+
+
+class FailingEngine(StubEngine):
+    def analyze_regions(self, img_bgr, boxes, min_iou=0.3):
+        if img_bgr.mean() > 100:
+            raise cv2.error("Inferenz fehlgeschlagen")
+        if img_bgr.mean() < 1:
+            raise TypeError("Programmierfehler")
+        return super().analyze_regions(img_bgr, boxes, min_iou)
+
+
+def test_mapping_counts_and_logs_image_errors(tmp_path, caplog):
+    from app.enrollment import _mapping_records
+
+    region = {'x_abs': 0, 'y_abs': 0, 'width_px': 8, 'height_px': 8}
+    hell, normal, leer = (str(tmp_path / f"{n}.png") for n in ("hell", "normal", "leer"))
+    cv2.imwrite(hell, np.full((8, 8, 3), 200, dtype=np.uint8))
+    cv2.imwrite(normal, np.full((8, 8, 3), 50, dtype=np.uint8))
+    cv2.imwrite(leer, np.zeros((8, 8, 3), dtype=np.uint8))
+    tasks = [(hell, [("anna", region)]), (normal, [("bernd", region)])]
+    records, stats = _mapping_records(FailingEngine(), tasks)
+    assert [r[0] for r in records] == ["bernd"]
+    assert stats['errors'] == 1
+    assert hell in caplog.text
+    # Programmierfehler werden nicht als Bildfehler gezählt
+    with pytest.raises(TypeError):
+        _mapping_records(FailingEngine(), [(leer, [("carla", region)])])
@@ -0,0 +1,22 @@
+from app.utils import assign_regions_to_faces
+
+
+def test_assign_by_iou_is_unique():
+    regions = [[100, 100, 200, 200], [130, 130, 230, 230], [400, 100, 500, 200]]
+    faces = [[405, 95, 505, 195], [105, 105, 205, 205]]
+    assert assign_regions_to_faces(regions, faces) == [1, None, 0]
+
+
+def test_region_without_face_stays_unassigned():
+    # Region links ohne erkanntes Gesicht, Nachbargesicht 300 px daneben
+    regions = [[100, 100, 200, 200], [400, 100, 500, 200]]
+    faces = [[400, 100, 500, 200], [700, 100, 800, 200]]
+    assert assign_regions_to_faces(regions, faces) == [None, 0]
+
+
+def test_nearby_face_without_overlap_is_assigned():
+    # Kleines Gesicht in der Mitte einer großen Region (IoU unter min_iou)
+    regions = [[0, 0, 400, 400]]
+    faces = [[190, 180, 230, 220], [900, 900, 950, 950]]
+    assert assign_regions_to_faces(regions, faces) == [0]
+    assert assign_regions_to_faces(regions, faces, max_center_offset=0.0) == [None]